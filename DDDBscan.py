@@ -1,9 +1,14 @@
 import os
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from sklearn.cluster import DBSCAN
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+
+from instrumentation import stage, count, run
+from series_store import SensorSeries, CompactSeriesStore
+# sklearn（engine='sklearn'）与 matplotlib（绘图）在用到时才导入，只做合并或检测时不加载
 
 # 定义汉字月份与数字的映射
 month_mapping = {
@@ -12,10 +17,104 @@ month_mapping = {
     "九月": "09", "十月": "10", "十一月": "11", "十二月": "12"
 }
 
-def merge_xlsx_files_in_folder(month_folder):
+# 增量合并清单文件名（保存在月份文件夹内）
+MERGE_MANIFEST_NAME = "merge_manifest.json"
+
+def _file_sha256(path, chunk_size=1 << 20):
+    """
+    计算文件内容的sha256
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_merge_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_merge_manifest(manifest_path, manifest):
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def _find_month_output(month_folder, month_num):
+    """
+    查找文件夹中已有的 YYYY-MM.csv 合并结果
+    """
+    for f in sorted(os.listdir(month_folder)):
+        if re.fullmatch(rf"\d{{4}}-{month_num}\.csv", f):
+            return os.path.join(month_folder, f)
+    return None
+
+
+def _infer_year(data_frames):
+    """
+    由数据中的MDATE推断年份（取出现次数最多的年份）
+    :return: 年份，没有可用的MDATE时返回None
+    """
+    years = [pd.to_datetime(df['MDATE'], errors='coerce').dt.year for df in data_frames if 'MDATE' in df]
+    if not years:
+        return None
+    years = pd.concat(years, ignore_index=True).dropna()
+    if years.empty:
+        return None
+    return int(years.mode().iloc[0])
+
+
+def _read_xlsx(file):
+    """
+    读取单个xlsx文件（进程池工作函数）
+    :return: (文件路径, 数据框, 错误信息) 读取失败时数据框为None
+    """
+    try:
+        return file, pd.read_excel(file), None
+    except Exception as e:
+        return file, None, f"{type(e).__name__}: {e}"
+
+
+def _read_xlsx_files(files, executor=None, errors=None):
+    """
+    读取多个xlsx文件，给定executor时并发解析
+    :param files: xlsx文件路径列表
+    :param executor: concurrent.futures执行器，为None时顺序读取
+    :param errors: 错误收集列表，为None时直接打印错误
+    :return: 按files顺序排列的 {文件路径: 数据框}，读取失败的文件不在其中
+    """
+    with stage('merge.read_xlsx', files=len(files)) as record:
+        if executor is None:
+            results = map(_read_xlsx, files)
+        else:
+            results = executor.map(_read_xlsx, files)
+
+        frames = {}
+        for file, df, error in results:
+            if error is None:
+                frames[file] = df
+            elif errors is None:
+                print(f"Error reading {file}: {error}")
+            else:
+                errors.append({'file': file, 'error': error})
+        record['rows'] = sum(len(df) for df in frames.values())
+    count('merge.files_read', len(frames))
+    count('merge.read_errors', len(files) - len(frames))
+    return frames
+
+
+def merge_xlsx_files_in_folder(month_folder, year=None, incremental=False, executor=None, errors=None):
     """
     合并指定月份文件夹内所有xlsx文件的数据，并将csv保存在同一文件夹。
     :param month_folder: 月份文件夹的路径（文件夹名称为汉字月份，如"七月"）
+    :param year: 输出文件的年份，为None时依次由已有合并结果、增量清单或数据中的MDATE推断
+    :param incremental: 增量模式 按清单只解析新增或改动的xlsx，并删除已删除源文件的行
+    :param executor: 用于并发解析xlsx的执行器，为None时顺序读取
+    :param errors: 读取错误收集列表，为None时直接打印错误
+    :return: 合并csv的路径，未合并时返回None
     """
     # 提取月份的汉字部分，并映射到数字月份
     # 检查输出文件是否已存在
@@ -26,11 +125,17 @@ def merge_xlsx_files_in_folder(month_folder):
         print(f"无法识别的月份名称: {month_name}")
         return
 
-    output_file = os.path.join(month_folder, f"2022-{month_num}.csv")
+    if incremental:
+        return _merge_xlsx_incremental(month_folder, month_num, year, executor, errors)
 
-    if os.path.exists(output_file):
+    if year is not None:
+        output_file = os.path.join(month_folder, f"{year}-{month_num}.csv")
+    else:
+        output_file = _find_month_output(month_folder, month_num)
+
+    if output_file is not None and os.path.exists(output_file):
         print(f"文件 {output_file} 已存在，跳过合并。")
-        return
+        return output_file
 
     # 查找文件夹中的所有xlsx文件
     all_files = [
@@ -38,69 +143,316 @@ def merge_xlsx_files_in_folder(month_folder):
         for f in os.listdir(month_folder) if f.endswith(".xlsx")
     ]
 
-    # 使用列表存储所有数据框
-    data_frames = []
-
-    for file in all_files:
-        try:
-            # 读取xlsx文件，并假设列头一致
-            df = pd.read_excel(file)
-            data_frames.append(df)
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
+    # 读取xlsx文件，并假设列头一致
+    data_frames = list(_read_xlsx_files(all_files, executor, errors).values())
 
     if data_frames:
-        # 拼接所有数据框
-        merged_df = pd.concat(data_frames, ignore_index=True)
+        if output_file is None:
+            year = _infer_year(data_frames)
+            if year is None:
+                print(f"无法从数据中推断年份，请指定year参数: {month_folder}")
+                return
+            output_file = os.path.join(month_folder, f"{year}-{month_num}.csv")
+
+        with stage('merge.write_csv') as record:
+            # 拼接所有数据框
+            merged_df = pd.concat(data_frames, ignore_index=True)
 
-        # 将拼接后的数据保存为csv
-        merged_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+            # 将拼接后的数据保存为csv
+            merged_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+            record['rows'] = len(merged_df)
         print(f"数据已保存到 {output_file}")
+        return output_file
     else:
         print(f"未找到有效的xlsx文件在文件夹 {month_folder} 中。")
 
-def DBScan(x):
+
+def _merge_xlsx_incremental(month_folder, month_num, year=None, executor=None, errors=None):
     """
-    DBScan异常检测
-    :param x: 输入的索力数据 应为 list 格式
-    :return: 返回异常值索引
+    增量合并：清单记录每个源文件的大小、修改时间、sha256及其在合并csv中的行数，
+    合并csv中各源文件的行按清单顺序连续存放，据此删除已删除或已改动源文件的行，
+    只对新增或改动的xlsx调用read_excel，并追加到合并csv末尾。
+    :return: 合并csv的路径
     """
-    counts, edges = np.histogram(x, bins='auto')
-    cidx = np.where(counts > 0)[0]
-    intv = np.mean(np.diff(edges))
-    md = [[] for _ in range(len(cidx) - 1)]
-    stdd = [[] for _ in range(len(cidx) - 1)]
-    for m in range(len(cidx) - 1):  # 此处需检查
-        kk1 = edges[cidx[m]]
-        kk2 = edges[cidx[m + 1]]
-        mask = np.logical_and(x <= kk2, x >= kk1)
-        mask1 = np.where(mask == True)[0]
-        dd = [x[a] for a in mask1]
-        md[m] = np.mean(dd)
-        stdd[m] = np.std(dd)
-
-    if len(cidx) > 1:
-        dis = np.diff(edges[cidx]) - intv
+    manifest_path = os.path.join(month_folder, MERGE_MANIFEST_NAME)
+    manifest = _load_merge_manifest(manifest_path)
+
+    # 确定输出文件
+    if year is not None:
+        output_file = os.path.join(month_folder, f"{year}-{month_num}.csv")
+    elif manifest is not None:
+        output_file = os.path.join(month_folder, manifest['output'])
+    else:
+        output_file = _find_month_output(month_folder, month_num)
+
+    # 清单与合并结果不一致（无清单、输出已删除或换了输出文件）时从头重建
+    if (manifest is None or output_file is None or not os.path.exists(output_file)
+            or manifest['output'] != os.path.basename(output_file)):
+        if manifest is not None or (output_file is not None and os.path.exists(output_file)):
+            print(f"增量清单与合并结果不一致，重新合并 {month_folder}")
+        manifest = {'output': None, 'sources': []}
+        if output_file is not None and os.path.exists(output_file):
+            os.remove(output_file)
+
+    # 比较当前源文件与清单
+    current = {f: os.stat(os.path.join(month_folder, f))
+               for f in sorted(os.listdir(month_folder)) if f.endswith(".xlsx")}
+    kept, removed, to_parse = [], [], []
+    for entry in manifest['sources']:
+        name = entry['file']
+        stat = current.get(name)
+        if stat is None:
+            removed.append(entry)
+        elif stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+            kept.append(entry)
+        else:
+            digest = _file_sha256(os.path.join(month_folder, name))
+            if digest == entry['sha256']:
+                # 内容未变，仅更新修改时间
+                entry['mtime'] = stat.st_mtime
+                kept.append(entry)
+            else:
+                removed.append(entry)
+                to_parse.append((name, digest))
+    known = {entry['file'] for entry in manifest['sources']}
+    to_parse.extend((name, None) for name in current if name not in known)
+
+    if not current and not manifest['sources']:
+        print(f"未找到有效的xlsx文件在文件夹 {month_folder} 中。")
+        return None
+
+    if not removed and not to_parse:
+        _save_merge_manifest(manifest_path, manifest)
+        print(f"文件 {output_file} 已是最新，跳过合并。")
+        return output_file
+
+    # 解析新增或改动的xlsx
+    new_entries, new_frames = [], []
+    parsed = _read_xlsx_files([os.path.join(month_folder, name) for name, _ in to_parse], executor, errors)
+    for name, digest in to_parse:
+        file = os.path.join(month_folder, name)
+        if file not in parsed:
+            continue
+        df = parsed[file]
+        stat = current[name]
+        new_entries.append({
+            'file': name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'sha256': digest if digest is not None else _file_sha256(file), 'rows': int(len(df))
+        })
+        new_frames.append(df)
+
+    if not new_frames and (output_file is None or not os.path.exists(output_file)):
+        # 没有已有的合并结果且新的xlsx全部读取失败（错误已记录在errors中）
+        print(f"未找到有效的xlsx文件在文件夹 {month_folder} 中。")
+        return None
+
+    if output_file is None:
+        year = _infer_year(new_frames)
+        if year is None:
+            print(f"无法从数据中推断年份，请指定year参数: {month_folder}")
+            return None
+        output_file = os.path.join(month_folder, f"{year}-{month_num}.csv")
+
+    # 删除已删除或已改动源文件对应的行
+    if removed:
+        with stage('merge.remove_rows') as record:
+            merged_df = pd.read_csv(output_file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+            keep_mask = np.zeros(len(merged_df), dtype=bool)
+            offset = 0
+            removed_ids = {id(entry) for entry in removed}
+            for entry in manifest['sources']:
+                if id(entry) not in removed_ids:
+                    keep_mask[offset:offset + entry['rows']] = True
+                offset += entry['rows']
+            merged_df = merged_df[keep_mask]
+            merged_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+            record['rows'] = int((~keep_mask).sum())
+        print(f"已从 {output_file} 删除 {len(removed)} 个源文件的 {int((~keep_mask).sum())} 行")
+
+    # 追加新解析的行
+    if new_frames:
+        with stage('merge.write_csv') as record:
+            append_df = pd.concat(new_frames, ignore_index=True)
+            record['rows'] = len(append_df)
+            if os.path.exists(output_file):
+                columns = pd.read_csv(output_file, nrows=0, encoding='utf-8-sig').columns
+                if set(columns) == set(append_df.columns):
+                    append_df[list(columns)].to_csv(output_file, mode='a', header=False, index=False,
+                                                    encoding='utf-8')
+                else:
+                    # 列头不一致时退回整体重写
+                    merged_df = pd.read_csv(output_file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+                    pd.concat([merged_df, append_df], ignore_index=True).to_csv(
+                        output_file, index=False, encoding='utf-8-sig')
+            else:
+                append_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        print(f"已追加 {len(new_frames)} 个源文件的 {len(append_df)} 行到 {output_file}")
+
+    manifest = {'output': os.path.basename(output_file), 'sources': kept + new_entries}
+    _save_merge_manifest(manifest_path, manifest)
+    return output_file
+
+
+def merge_month_folders(root_folder, workers=None, year=None, incremental=False):
+    """
+    并行合并根目录下所有汉字月份文件夹（如 C:\\DBSCAN方法\\marked 下的"一月"~"十二月"）。
+    各月份文件夹由线程并行调度，xlsx由共享进程池并发解析。
+    :param root_folder: 包含月份文件夹的根目录
+    :param workers: 解析进程数，为None时使用CPU核数
+    :param year: 输出文件的年份，为None时自动推断
+    :param incremental: 是否使用增量合并
+    :return: 合并报告列表，每项含 month_folder、output、errors
+    """
+    month_folders = [
+        os.path.join(root_folder, f)
+        for f in sorted(os.listdir(root_folder), key=lambda f: month_mapping.get(f.strip(), ""))
+        if f.strip() in month_mapping and os.path.isdir(os.path.join(root_folder, f))
+    ]
+    if not month_folders:
+        print(f"未在 {root_folder} 中找到月份文件夹。")
+        return []
+
+    report = [{'month_folder': folder, 'output': None, 'errors': []} for folder in month_folders]
+
+    def merge_one(item):
+        try:
+            item['output'] = merge_xlsx_files_in_folder(
+                item['month_folder'], year=year, incremental=incremental,
+                executor=executor, errors=item['errors'])
+        except Exception as e:
+            item['errors'].append({'file': item['month_folder'], 'error': f"{type(e).__name__}: {e}"})
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        with ThreadPoolExecutor(max_workers=len(month_folders)) as scheduler:
+            list(scheduler.map(merge_one, report))
+
+    n_errors = sum(len(item['errors']) for item in report)
+    print(f"共合并 {len(month_folders)} 个月份文件夹，{n_errors} 个文件读取失败。")
+    return report
+
+
+def _histogram_bin_stats(x, edges, cidx):
+    """
+    计算相邻非空直方图区间之间数据的均值与标准差（单次排序+bincount分组统计）
+    第m组为闭区间 [edges[cidx[m]], edges[cidx[m + 1]]] 内的数据，与逐区间掩码统计结果一致
+    :param x: 索力数据 一维数组
+    :param edges: np.histogram 返回的区间边界
+    :param cidx: 非空区间的索引
+    :return: (md, stdd) 每组的均值与标准差 长度为 len(cidx) - 1
+    """
+    n_groups = len(cidx) - 1
+    if n_groups < 1:
+        return np.empty(0), np.empty(0)
+    xs = np.sort(x)
+    lo = np.searchsorted(xs, edges[cidx[:-1]], side='left')
+    hi = np.searchsorted(xs, edges[cidx[1:]], side='right')
+    sizes = hi - lo
+
+    # 相邻组只在公共边界上重叠，每个数据点至多属于两组，展开后的索引长度不超过 2n
+    group = np.repeat(np.arange(n_groups), sizes)
+    starts = np.cumsum(sizes) - sizes
+    values = xs[np.arange(len(group)) - np.repeat(starts - lo, sizes)]
+
+    md = np.bincount(group, weights=values, minlength=n_groups) / sizes
+    dev = values - md[group]
+    stdd = np.sqrt(np.bincount(group, weights=dev * dev, minlength=n_groups) / sizes)
+    return md, stdd
+
+
+def dbscan_1d_labels(x, epsilon):
+    """
+    一维数据、minpts=1 时的DBSCAN聚类：排序后相邻差值 <= epsilon 的最长连续段即为一簇。
+    只需一次 O(n log n) 排序，无需构建邻域图；簇编号按各簇最早出现的原始索引排序，
+    与 sklearn.cluster.DBSCAN(eps=epsilon, min_samples=1) 的 labels_ 完全一致。
+    :param x: 一维数据
+    :param epsilon: 邻域半径
+    :return: 每个数据点的簇编号
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    if len(x) == 0:
+        return np.empty(0, dtype=np.intp)
+    order = np.argsort(x, kind='stable')
+    xs = x[order]
+    run = np.empty(len(x), dtype=np.intp)
+    run[0] = 0
+    np.cumsum(np.diff(xs) > epsilon, out=run[1:])
+
+    labels = np.empty(len(x), dtype=np.intp)
+    labels[order] = run
+    # 按最早出现的原始索引重新编号
+    _, first_index = np.unique(labels, return_index=True)
+    remap = np.empty(len(first_index), dtype=np.intp)
+    remap[np.argsort(first_index)] = np.arange(len(first_index))
+    return remap[labels]
+
+
+def gap_epsilon(left_edges, intv, min_epsilon=100):
+    """
+    由非空直方图区间确定DBSCAN邻域半径：取第一个相邻非空区间之间的空隙，无空隙时取区间宽度的一半
+    :param left_edges: 非空区间的左边界（升序）
+    :param intv: 区间宽度
+    :param min_epsilon: 邻域半径下限
+    :return: epsilon
+    """
+    if len(left_edges) > 1:
+        dis = np.diff(left_edges) - intv
         if np.mean(dis) == 0:
             dis = 0
     else:
         dis = 0
 
-    mm = np.where(dis > 0)[0]
+    mm = np.where(np.atleast_1d(dis) > 0)[0]
 
     if len(mm) > 0:
         epsilon = dis[mm[0]]
     else:
         epsilon = intv / 2
 
-    if epsilon < 100:
-        epsilon = 100
+    if epsilon < min_epsilon:
+        epsilon = min_epsilon
+    return epsilon
+
+
+def histogram_epsilon(x, min_epsilon=100):
+    """
+    按 'auto' 规则做直方图，并由非空区间的空隙确定DBSCAN邻域半径
+    :param x: 索力数据 一维数组
+    :param min_epsilon: 邻域半径下限
+    :return: (epsilon, 直方图计数, 区间边界)
+    """
+    counts, edges = np.histogram(x, bins='auto')
+    cidx = np.where(counts > 0)[0]
+    intv = np.mean(np.diff(edges))
+    return gap_epsilon(edges[cidx], intv, min_epsilon), counts, edges
+
+
+def DBScan(x, engine='sorted', return_labels=False):
+    """
+    DBScan异常检测
+    :param x: 输入的索力数据 list、数组或 SensorSeries 视图
+    :param engine: 聚类后端 'sorted' 为一维排序分段聚类，'sklearn' 为 sklearn.cluster.DBSCAN，两者结果一致
+    :param return_labels: 为True时同时返回每个数据点的DBSCAN簇编号
+    :return: 返回异常值索引（return_labels为True时返回 (异常值索引, 簇编号)）
+    """
+    x = np.asarray(x, dtype=float)
+    with stage('dbscan.histogram', rows=len(x)):
+        epsilon, counts, edges = histogram_epsilon(x)
+        cidx = np.where(counts > 0)[0]
+        md, stdd = _histogram_bin_stats(x, edges, cidx)
 
     minpts = 1
-    x_2d = np.array(x).reshape(-1, 1)
-    dbscan_model = DBSCAN(eps=epsilon, min_samples=minpts).fit(x_2d)
-    classidx = dbscan_model.labels_
+    with stage('dbscan.cluster', rows=len(x), engine=engine):
+        if engine == 'sorted':
+            classidx = dbscan_1d_labels(x, epsilon)
+        elif engine == 'sklearn':
+            from sklearn.cluster import DBSCAN
+            x_2d = np.array(x).reshape(-1, 1)
+            dbscan_model = DBSCAN(eps=epsilon, min_samples=minpts).fit(x_2d)
+            classidx = dbscan_model.labels_
+        else:
+            raise ValueError("engine must be one of 'sorted' or 'sklearn'")
 
+    labels = classidx.copy()
     counts1, edges1 = np.histogram(classidx, bins=np.arange(classidx.min(), classidx.max() + 2))
     Normclass = np.ceil(edges1[np.where(counts1 > 0.5 * len(x))])
 
@@ -111,40 +463,164 @@ def DBScan(x):
     classidx[L_idx2] = 2
 
     error = np.where(classidx == 2)[0]
+    count('dbscan.anomalies', len(error))
+    if return_labels:
+        return error, labels
     return error
 
+
+def sensor_names(SLnum=48):
+    """
+    按编号生成索力名称 SLS01~SLS24、SLX01~SLX24
+    :param SLnum: 索力个数（上下游各一半）
+    :return: 索力名称列表
+    """
+    half = SLnum // 2
+    return [f"SLS{i:02d}" for i in range(1, half + 1)] + [f"SLX{i:02d}" for i in range(1, half + 1)]
+
+
+def _detect_sensor(task):
+    """
+    单个索力的DBScan检测（进程池工作函数）
+    :param task: (索力名称, 时间顺序的索力数据, 聚类后端)
+    :return: (索力名称, 异常值索引, 簇编号, 错误信息)
+    """
+    sensor_id, values, engine = task
+    try:
+        error, labels = DBScan(values, engine=engine, return_labels=True)
+        return sensor_id, error, labels, None
+    except Exception as e:
+        return sensor_id, None, None, f"{type(e).__name__}: {e}"
+
+
+def _detect_with_baseline(baseline_cache, task, source):
+    """
+    按跨月基线检测单个索力
+    :return: (索力名称, 异常值索引, 簇编号（按基线判定时为-1）, 错误信息)
+    """
+    sensor_id, values, _ = task
+    try:
+        error, labels = baseline_cache.detect(sensor_id, values, source)
+        if labels is None:
+            labels = np.full(len(values), -1, dtype=np.intp)
+        return sensor_id, error, labels, None
+    except Exception as e:
+        return sensor_id, None, None, f"{type(e).__name__}: {e}"
+
+
+def detect_all_sensors(df, workers=None, engine='sorted', anomaly_file=None, errors=None, baseline_cache=None,
+                       source=None, anomaly_rows=None):
+    """
+    对月度数据中的全部索力批量进行DBScan异常检测（无界面）。
+    只按 SENSOR_ID、MDATE 排序分组一次，各索力在进程池中并行检测。
+    :param df: 含 MDATE、SENSOR_ID、M_RESULT 列的数据（如合并后的 2022-07.csv）
+    :param workers: 进程数，为None时使用CPU核数，为1时在当前进程中顺序执行
+    :param engine: DBScan的聚类后端
+    :param anomaly_file: 若给定则将异常表保存为csv（供 lstm_prediction.train_and_predict_lstm 使用的 anomaly_info.csv）
+    :param errors: 检测失败的索力收集列表，为None时直接打印错误
+    :param baseline_cache: baseline_cache.BaselineCache，给定时各索力按缓存的跨月基线 O(n) 判定
+                           （首次或漂移时才完整聚类，在当前进程中顺序执行），检测后保存缓存
+    :param source: 数据来源标识（如月份文件名），同一来源不会重复计入基线
+    :param anomaly_rows: 给定列表时追加异常值在 df 中的行位置（供出图直接标注，不再重复检测）
+    :return: 异常表 DataFrame，列为 MDATE、SENSOR_ID、M_RESULT、CLUSTER（按基线判定的异常为-1），按索力、时间排序
+    """
+    mdate = pd.to_datetime(df['MDATE']).to_numpy()
+    values = df['M_RESULT'].to_numpy(dtype=float)
+    codes, uniques = pd.factorize(df['SENSOR_ID'].astype(str), sort=True)
+
+    # 按 (索力, 时间) 一次稳定排序，各索力的数据即为连续的一段
+    order = np.lexsort((mdate, codes))
+    codes = codes[order]
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    # 无数据时（如按 SENSOR_ID 筛选后为空）没有任何分组，返回空的异常表
+    starts = np.concatenate(([0], bounds)) if len(codes) else bounds
+    ends = np.concatenate((bounds, [len(codes)])) if len(codes) else bounds
+    tasks = [(uniques[codes[a]], values[order[a:b]], engine) for a, b in zip(starts, ends)]
+
+    if baseline_cache is not None:
+        results = [_detect_with_baseline(baseline_cache, task, source) for task in tasks]
+        if baseline_cache.path is not None:
+            baseline_cache.save()
+    elif workers == 1:
+        results = list(map(_detect_sensor, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_detect_sensor, tasks))
+
+    rows, clusters = [], []
+    for start, (sensor_id, error, labels, message) in zip(starts, results):
+        if message is not None:
+            if errors is None:
+                print(f"索力 {sensor_id} 检测失败: {message}")
+            else:
+                errors.append({'sensor_id': sensor_id, 'error': message})
+            continue
+        rows.append(order[start + error])
+        clusters.append(labels[error])
+
+    positions = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    if anomaly_rows is not None:
+        anomaly_rows.append(positions)
+    anomaly_df = pd.DataFrame({
+        'MDATE': mdate[positions],
+        'SENSOR_ID': df['SENSOR_ID'].astype(str).to_numpy()[positions],
+        'M_RESULT': values[positions],
+        'CLUSTER': np.concatenate(clusters) if clusters else np.empty(0, dtype=np.intp),
+    })
+
+    if anomaly_file is not None:
+        os.makedirs(os.path.dirname(anomaly_file) or '.', exist_ok=True)
+        anomaly_df.to_csv(anomaly_file, index=False, encoding='utf-8')
+        print(f"异常数据已保存到 {anomaly_file}")
+    return anomaly_df
+
 def DECT_single_SL_figure_show(SLData, sensor_id, error_index):
-    # 更改
-    SL_M = SLData.M_RESULT.tolist()
-    SLData['MDATE'] = pd.to_datetime(SLData['MDATE'])
-    SL_date = SLData['MDATE'].dt.date
-    # 【已成功】只保留日期去掉时间 在x轴显示时不出现时刻
+    """
+    交互显示单个索力的异常图（plt.show 会阻塞）；服务器上批量出图请用 anomaly_plots.render_all_sensors
+    :param SLData: 单个索力时间顺序的数据 DataFrame（MDATE、M_RESULT 列）或 SensorSeries 视图
+    """
+    import matplotlib.pyplot as plt
+    from anomaly_plots import configure_fonts, draw_sensor
 
+    if isinstance(SLData, SensorSeries):
+        mdate, values = SLData.mdate, SLData.values
+    else:
+        mdate, values = SLData['MDATE'].to_numpy(), SLData['M_RESULT'].to_numpy()
+    configure_fonts()
     fig = plt.figure(figsize=(10, 6))
-    plt.rcParams['font.family'] = 'Microsoft YaHei'
-    plt.rcParams['font.size'] = 10
     ax = fig.add_subplot(1, 1, 1)
-
-    # 更改 时间间隔去掉了
-    ar_xticks = np.arange(1, len(SL_date) + 1, step=1)
-    plt.xticks(ar_xticks, SL_date, rotation=45, fontsize=10)
-    ax.plot(ar_xticks, SL_M, linewidth=1)
-    # 更改 不会空数据 连续数据
-
-    ax.set_xlabel("Date")
-    ax.set_ylabel("SLData")
-    ax.set_title(sensor_id)
-    for error in error_index:
-        ax.scatter(ar_xticks[error], SL_M[error], c="r")
-    tick_spacing = 12
-    ax.xaxis.set_major_locator(ticker.MultipleLocator(tick_spacing))
+    # x轴按数据序号等间距（不出现空数据段），只标注抽取的日期
+    draw_sensor(ax, mdate, values, sensor_id, error_index)
     fig.tight_layout()
     plt.show()
 
 if __name__ == "__main__":
     # 读取表格数据为df并按照时间顺序对表格内容进行排序
-    month_folder_path = r"C:\DBSCAN方法\marked\七月"  # 修改为实际路径
-    merge_xlsx_files_in_folder(month_folder_path)
+    marked_folder_path = r"C:\DBSCAN方法\marked"  # 修改为实际路径
+    # 各阶段耗时、行数、内存峰值写入 merge_log.jsonl，结束时打印汇总（profile=True 时同时输出cProfile结果）
+    with run('merge', os.path.join(marked_folder_path, 'merge_log.jsonl')):
+        merge_report = merge_month_folders(marked_folder_path, workers=None, incremental=True)
+    for item in merge_report:
+        for err in item['errors']:
+            print(f"Error reading {err['file']}: {err['error']}")
+    # month_folder_path = r"C:\DBSCAN方法\marked\七月"  # 单月合并
+    # merge_xlsx_files_in_folder(month_folder_path, incremental=True)
+    # 批量检测全部索力并生成 anomaly_info.csv
+    # df = pd.read_csv(r"C:\DBSCAN方法\marked\七月\2022-07.csv", encoding='utf-8')
+    # store = CompactSeriesStore.from_frame(df)  # 紧凑存储 各索力为零拷贝视图 可直接传给 DBScan 与出图函数
+    # error_index = DBScan(store.sensor('SLS01'))
+    # 多年历史：从内存映射的索力归档中按时间段取数据检测（只读取该时间段）
+    # from sensor_archive import SensorArchive
+    # error_index = DBScan(SensorArchive('./sensor_archive').open('SLS01', '2022-07-01', '2022-07-31 23:59:59'))
+    # anomaly_df = detect_all_sensors(df, workers=None, anomaly_file='./anomaly/anomaly_info.csv')
+    # 逐月检测时使用跨月基线缓存：只在首月或漂移时完整聚类，其余月份按缓存的正常簇范围 O(n) 判定
+    # from baseline_cache import BaselineCache
+    # cache = BaselineCache(os.path.join(marked_folder_path, 'baselines.json'))
+    # anomaly_df = detect_all_sensors(df, baseline_cache=cache, source='2022-07')
+    # 无界面批量出图（png/svg）并输出汇总图
+    # from anomaly_plots import render_all_sensors
+    # render_all_sensors(df, './figures/2022-07', fmt='png', report_path='./figures/2022-07/report.png')
+
     # file_path = r"C:\DBSCAN方法\marked\七月\2022-07.csv"
     # plot_month = 1  # 单月绘图  0-不显示 1-显示
     # plot_day = 0  # 单天绘图 0-不显示 1-显示
@@ -0,0 +1,223 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from series_store import CompactSeriesStore
+
+# 默认最多显示的x轴日期标签数
+MAX_TICKS = 12
+
+_fonts_configured = False
+_renderer = None
+
+
+def configure_fonts():
+    """
+    设置绘图字体（只在第一次调用时修改rcParams），没有微软雅黑时依次退回其他字体
+    """
+    global _fonts_configured
+    if _fonts_configured:
+        return
+    matplotlib.rcParams['font.family'] = 'sans-serif'
+    matplotlib.rcParams['font.sans-serif'] = ['Microsoft YaHei', 'SimHei', 'Noto Sans CJK SC', 'DejaVu Sans']
+    matplotlib.rcParams['font.size'] = 10
+    _fonts_configured = True
+
+
+def draw_sensor(ax, mdate, values, sensor_id, error_index, max_ticks=MAX_TICKS):
+    """
+    在给定坐标轴上绘制单个索力的时程曲线与异常点
+    异常点只调用一次 scatter；x轴只在均匀抽取的 max_ticks 个位置标注日期
+    :param ax: matplotlib 坐标轴
+    :param mdate: 时间顺序的测量时间
+    :param values: 与 mdate 对应的索力数据
+    :param sensor_id: 索力名称（标题）
+    :param error_index: 异常值索引
+    :param max_ticks: x轴日期标签个数上限
+    """
+    values = np.asarray(values, dtype=float)
+    x = np.arange(1, len(values) + 1)
+    ax.plot(x, values, linewidth=1)
+    error_index = np.asarray(error_index, dtype=np.intp)
+    if len(error_index) > 0:
+        ax.scatter(x[error_index], values[error_index], c="r", s=12, zorder=3)
+
+    if len(x) > 0:
+        ticks = np.unique(np.linspace(0, len(x) - 1, min(max_ticks, len(x))).astype(np.intp))
+        labels = pd.to_datetime(pd.Series(np.asarray(mdate)[ticks])).dt.strftime('%Y-%m-%d')
+        ax.set_xticks(x[ticks])
+        ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.set_xlabel("Date")
+    ax.set_ylabel("SLData")
+    ax.set_title(sensor_id)
+
+
+class SensorFigureRenderer:
+    """
+    无界面（Agg）单索力图渲染器：整个进程复用同一个 Figure，每张图只清空坐标轴后重绘
+    """
+
+    def __init__(self, figsize=(10, 6), dpi=100, max_ticks=MAX_TICKS):
+        configure_fonts()
+        self.dpi = dpi
+        self.max_ticks = max_ticks
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+
+    def render(self, mdate, values, sensor_id, error_index, path):
+        """
+        :param path: 输出文件路径，格式由扩展名（.png/.svg）决定
+        :return: path
+        """
+        self.ax.clear()
+        draw_sensor(self.ax, mdate, values, sensor_id, error_index, self.max_ticks)
+        self.fig.tight_layout()
+        self.fig.savefig(path, dpi=self.dpi)
+        return path
+
+
+def _detect_errors(values):
+    from DDDBscan import DBScan
+    try:
+        return DBScan(values)
+    except Exception as e:
+        # 无占多数的簇时 DBScan 无法判定，只画曲线
+        print(f"DBScan 检测失败，不标注异常点: {type(e).__name__}: {e}")
+        return np.empty(0, dtype=np.intp)
+
+
+def _render_sensor(task):
+    """
+    单个索力出图（进程池工作函数），每个进程只创建一个渲染器
+    :param task: (索力名称, 测量时间, 索力数据, 异常值索引或None, 输出路径, figsize, dpi)
+    :return: (索力名称, 输出路径, 错误信息)
+    """
+    global _renderer
+    sensor_id, mdate, values, error_index, path, figsize, dpi = task
+    try:
+        if error_index is None:
+            error_index = _detect_errors(values)
+        if _renderer is None or _renderer.fig.get_size_inches().tolist() != list(figsize) or _renderer.dpi != dpi:
+            _renderer = SensorFigureRenderer(figsize, dpi)
+        return sensor_id, _renderer.render(mdate, values, sensor_id, error_index, path), None
+    except Exception as e:
+        return sensor_id, None, f"{type(e).__name__}: {e}"
+
+
+def _sensor_groups(df):
+    """
+    :return: (测量时间, 索力名称, 各索力时间顺序的行位置列表)，与 DDDBscan.detect_all_sensors 的排序一致
+    """
+    mdate = pd.to_datetime(df['MDATE']).to_numpy()
+    codes, uniques = pd.factorize(df['SENSOR_ID'].astype(str), sort=True)
+    order = np.lexsort((mdate, codes))
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    groups = [idx for idx in np.split(order, bounds) if len(idx)]
+    return mdate, [uniques[codes[idx[0]]] for idx in groups], groups
+
+
+def split_sensors(df):
+    """
+    按 (索力, 时间) 一次排序，拆分出每个索力时间顺序的数据
+    :param df: 含 MDATE、SENSOR_ID、M_RESULT 列的数据，或 CompactSeriesStore（直接取各索力的视图，不排序不复制）
+    :return: [(索力名称, 测量时间, 索力数据)]，按索力名称排序
+    """
+    if isinstance(df, CompactSeriesStore):
+        return [(series.sensor_id, series.mdate, series.values) for series in df]
+    values = df['M_RESULT'].to_numpy(dtype=float)
+    mdate, sensor_ids, groups = _sensor_groups(df)
+    return [(sensor_id, mdate[idx], values[idx]) for sensor_id, idx in zip(sensor_ids, groups)]
+
+
+def error_indices_from_rows(df, rows):
+    """
+    将异常值在 df 中的行位置换算为 render_all_sensors 的 error_indices（各索力时间顺序数据中的索引）
+    每个索力都有一项（无异常时为空数组），出图时不再用DBScan重复检测
+    :param df: 含 MDATE、SENSOR_ID、M_RESULT 列的数据
+    :param rows: 异常值的行位置（如 detect_all_sensors 的 anomaly_rows 拼接结果）
+    :return: {索力名称: 异常值索引}
+    """
+    is_error = np.zeros(len(df), dtype=bool)
+    is_error[np.asarray(rows, dtype=np.intp)] = True
+    _, sensor_ids, groups = _sensor_groups(df)
+    return {sensor_id: np.flatnonzero(is_error[idx]) for sensor_id, idx in zip(sensor_ids, groups)}
+
+
+def render_all_sensors(df, output_folder, error_indices=None, fmt='png', workers=None, figsize=(10, 6), dpi=100,
+                       report_path=None, errors=None):
+    """
+    批量无界面渲染全部索力的异常图，各索力在进程池中并行输出为 png 或 svg
+    :param df: 含 MDATE、SENSOR_ID、M_RESULT 列的数据（如合并后的 2022-07.csv），或 CompactSeriesStore
+    :param output_folder: 输出文件夹，文件名为 {索力名称}.{fmt}
+    :param error_indices: {索力名称: 时间顺序数据中的异常值索引}，为None或缺少某索力时在工作进程中用DBScan检测
+    :param fmt: 'png' 或 'svg'
+    :param workers: 进程数，为None时使用CPU核数，为1时在当前进程中顺序执行
+    :param figsize: 单图尺寸（英寸）
+    :param dpi: 分辨率
+    :param report_path: 若给定则另外输出一张包含全部索力的多子图汇总图
+    :param errors: 出图失败的索力收集列表，为None时直接打印错误
+    :return: {索力名称: 输出路径}
+    """
+    if fmt not in ('png', 'svg'):
+        raise ValueError("fmt must be one of 'png' or 'svg'")
+    os.makedirs(output_folder, exist_ok=True)
+    error_indices = error_indices or {}
+
+    sensors = split_sensors(df)
+    tasks = [(sensor_id, mdate, values, error_indices.get(sensor_id),
+              os.path.join(output_folder, f"{sensor_id}.{fmt}"), figsize, dpi)
+             for sensor_id, mdate, values in sensors]
+    if workers == 1:
+        results = list(map(_render_sensor, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_sensor, tasks))
+
+    paths = {}
+    for sensor_id, path, message in results:
+        if message is None:
+            paths[sensor_id] = path
+        elif errors is None:
+            print(f"索力 {sensor_id} 出图失败: {message}")
+        else:
+            errors.append({'sensor_id': sensor_id, 'error': message})
+    print(f"已输出 {len(paths)} 张索力图到 {output_folder}")
+
+    if report_path is not None:
+        render_report(sensors, report_path, error_indices)
+    return paths
+
+
+def render_report(sensors, report_path, error_indices=None, columns=4, panel_size=(5, 3), dpi=100):
+    """
+    全部索力绘制在一张多子图汇总图上（png/svg/pdf 由扩展名决定）
+    :param sensors: split_sensors 的返回值
+    :param report_path: 输出路径
+    :param error_indices: {索力名称: 异常值索引}，缺少的索力用DBScan检测
+    :param columns: 每行子图数
+    :param panel_size: 单个子图尺寸（英寸）
+    :return: report_path
+    """
+    configure_fonts()
+    error_indices = error_indices or {}
+    rows = max(1, math.ceil(len(sensors) / columns))
+    fig = Figure(figsize=(panel_size[0] * columns, panel_size[1] * rows), dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(rows, columns, squeeze=False).ravel()
+    for ax, (sensor_id, mdate, values) in zip(axes, sensors):
+        error_index = error_indices.get(sensor_id)
+        if error_index is None:
+            error_index = _detect_errors(values)
+        draw_sensor(ax, mdate, values, sensor_id, error_index, max_ticks=6)
+    for ax in axes[len(sensors):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    fig.savefig(report_path, dpi=dpi)
+    print(f"汇总图已保存到 {report_path}")
+    return report_path
@@ -0,0 +1,237 @@
+import os
+import json
+import numpy as np
+
+from DDDBscan import histogram_epsilon, dbscan_1d_labels, gap_epsilon
+
+
+class SensorBaseline:
+    """
+    单个索力的跨月DBScan基线。
+
+    保存的摘要：
+    - 固定网格的累计直方图计数（原点与区间宽度在完整聚类时按 'auto' 规则确定，之后各月数据累加到同一网格）；
+    - 由累计直方图按 DBScan 相同规则（gap_epsilon）确定的 epsilon；
+    - 正常簇的取值范围 [lower, upper)：非空区间之间的空隙大于 epsilon 处分簇，计数过半的簇为正常簇。
+    新的一个月只需累加直方图（O(n)）、在非空区间上重新分簇（O(区间数)），再按正常簇范围判定（O(n)），
+    与之前各月数据合在一起做DBSCAN的结果一致（精度为一个区间宽度），不受月份边界影响。
+    无过半的簇、异常比例或超出原正常范围的比例超过阈值时视为漂移，按当月数据完整聚类并重建基线。
+    """
+
+    def __init__(self, min_epsilon=100, max_anomaly_fraction=0.2, max_outside_fraction=0.25):
+        """
+        :param min_epsilon: epsilon 下限，与 DBScan 一致默认为 100
+        :param max_anomaly_fraction: 当月异常比例超过该值时视为漂移
+        :param max_outside_fraction: 当月落在原正常范围之外的正常读数比例超过该值时视为漂移
+        """
+        self.min_epsilon = min_epsilon
+        self.max_anomaly_fraction = max_anomaly_fraction
+        self.max_outside_fraction = max_outside_fraction
+        self.origin = None
+        self.bin_width = None
+        self.bin_counts = {}
+        self.rows = 0
+        self.epsilon = None
+        self.lower = None
+        self.upper = None
+        self.sources = []
+        self.reclusters = 0
+
+    @property
+    def fitted(self):
+        return self.epsilon is not None
+
+    # 直方图摘要 -----------------------------------------------------------
+
+    def _add_to_histogram(self, x):
+        """
+        读数累加到固定网格的直方图（bincount，O(n)）
+        """
+        keys = np.floor((x - self.origin) / self.bin_width).astype(np.int64)
+        first = int(keys.min())
+        counts = np.bincount(keys - first)
+        for offset in np.flatnonzero(counts).tolist():
+            key = first + offset
+            self.bin_counts[key] = self.bin_counts.get(key, 0) + int(counts[offset])
+        self.rows += len(x)
+
+    def _refresh(self):
+        """
+        由累计直方图重新确定 epsilon 与正常簇范围（O(区间数)）
+        :return: 是否存在计数过半的簇
+        """
+        keys = np.array(sorted(self.bin_counts), dtype=np.int64)
+        counts = np.array([self.bin_counts[key] for key in keys.tolist()], dtype=float)
+        left_edges = self.origin + keys * self.bin_width
+        epsilon = float(gap_epsilon(left_edges, self.bin_width, self.min_epsilon))
+
+        cluster = np.concatenate(([0], np.cumsum(np.diff(left_edges) - self.bin_width > epsilon)))
+        sizes = np.bincount(cluster, weights=counts)
+        normal = int(np.argmax(sizes))
+        if sizes[normal] <= 0.5 * self.rows:
+            return False
+        members = np.flatnonzero(cluster == normal)
+        self.epsilon = epsilon
+        self.lower = float(left_edges[members[0]])
+        self.upper = float(left_edges[members[-1]] + self.bin_width)
+        return True
+
+    # 聚类与判定 -----------------------------------------------------------
+
+    def fit(self, x):
+        """
+        按 x 完整聚类（与 DBScan 相同）并重建基线
+        :param x: 索力数据 一维数组
+        :return: (异常值索引, 簇编号)
+        """
+        epsilon, _, edges = histogram_epsilon(x, self.min_epsilon)
+        labels = dbscan_1d_labels(x, epsilon)
+        sizes = np.bincount(labels)
+        normal_label = int(np.argmax(sizes))
+        if sizes[normal_label] <= 0.5 * len(x):
+            raise ValueError("没有包含半数以上数据的簇，无法建立基线")
+        normal = labels == normal_label
+
+        width = float(np.mean(np.diff(edges)))
+        self.origin = float(edges[0])
+        self.bin_width = width if width > 0 else float(self.min_epsilon)
+        self.bin_counts = {}
+        self.rows = 0
+        self._add_to_histogram(x)
+        if not self._refresh():
+            # 区间粒度下无过半的簇时退回本次聚类的正常簇范围
+            self.epsilon = float(epsilon)
+            self.lower = float(x[normal].min())
+            self.upper = float(np.nextafter(x[normal].max(), np.inf))
+        self.reclusters += 1
+        return np.flatnonzero(~normal), labels
+
+    def classify(self, x):
+        """
+        按缓存的正常簇范围判定 x，不修改基线
+        :return: 正常掩码
+        """
+        return (x >= self.lower) & (x < self.upper)
+
+    def update(self, x, source=None):
+        """
+        判定一批新数据（如一个月）并增量更新基线；首次调用或检测到漂移时完整聚类
+        :param x: 索力数据 一维数组
+        :param source: 数据来源标识（如月份文件名），已计入基线的来源只判定不重复累加
+        :return: (异常值索引, 簇编号或None（按基线判定时）, 是否重新聚类)
+        """
+        x = np.asarray(x, dtype=float)
+        if len(x) == 0:
+            return np.empty(0, dtype=np.intp), None, False
+        if not self.fitted:
+            error, labels = self.fit(x)
+            self._record(source)
+            return error, labels, True
+        if source is not None and source in self.sources:
+            return np.flatnonzero(~self.classify(x)), None, False
+
+        previous = (self.lower, self.upper)
+        snapshot = self._snapshot()
+        try:
+            self._add_to_histogram(x)
+            drift = not self._refresh()
+            if not drift:
+                normal = self.classify(x)
+                outside = normal & ((x < previous[0]) | (x >= previous[1]))
+                drift = 1.0 - normal.mean() > self.max_anomaly_fraction or outside.mean() > self.max_outside_fraction
+            if drift:
+                # 漂移（如换索、调索后索力整体变化）：按当月数据重新聚类
+                error, labels = self.fit(x)
+                self._record(source)
+                return error, labels, True
+        except Exception:
+            # 重新聚类失败（如没有过半的簇）时恢复原基线，当月数据不计入
+            self._restore(snapshot)
+            raise
+
+        self._record(source)
+        return np.flatnonzero(~normal), None, False
+
+    def _snapshot(self):
+        return (dict(self.bin_counts), self.rows, self.epsilon, self.lower, self.upper, self.origin,
+                self.bin_width, self.reclusters)
+
+    def _restore(self, snapshot):
+        (self.bin_counts, self.rows, self.epsilon, self.lower, self.upper, self.origin,
+         self.bin_width, self.reclusters) = snapshot
+
+    def _record(self, source):
+        if source is not None and source not in self.sources:
+            self.sources.append(source)
+
+    # 持久化 ---------------------------------------------------------------
+
+    def to_dict(self):
+        return {
+            'origin': self.origin,
+            'bin_width': self.bin_width,
+            'bin_counts': {str(key): value for key, value in sorted(self.bin_counts.items())},
+            'rows': self.rows,
+            'epsilon': self.epsilon,
+            'lower': self.lower,
+            'upper': self.upper,
+            'sources': self.sources,
+            'reclusters': self.reclusters,
+        }
+
+    @classmethod
+    def from_dict(cls, state, **kwargs):
+        baseline = cls(**kwargs)
+        for key, value in state.items():
+            setattr(baseline, key, value)
+        baseline.bin_counts = {int(key): value for key, value in state['bin_counts'].items()}
+        return baseline
+
+
+class BaselineCache:
+    """
+    全部索力的跨月基线缓存，保存为一个JSON文件（每个索力一项 SensorBaseline 摘要）
+    """
+
+    def __init__(self, path=None, **kwargs):
+        """
+        :param path: 缓存文件路径，为None时只保存在内存中
+        :param kwargs: 传给每个 SensorBaseline 的参数（min_epsilon、max_anomaly_fraction 等）
+        """
+        self.path = path
+        self.kwargs = kwargs
+        self.baselines = {}
+        self.stats = {'classified': 0, 'reclustered': 0}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.baselines = {sensor_id: SensorBaseline.from_dict(item, **kwargs)
+                              for sensor_id, item in state['sensors'].items()}
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self.baselines
+
+    def baseline(self, sensor_id):
+        if sensor_id not in self.baselines:
+            self.baselines[sensor_id] = SensorBaseline(**self.kwargs)
+        return self.baselines[sensor_id]
+
+    def detect(self, sensor_id, values, source=None):
+        """
+        按某个索力的基线判定一批数据并更新基线
+        :param sensor_id: 索力名称
+        :param values: 时间顺序的索力数据
+        :param source: 数据来源标识（如月份文件名）
+        :return: (异常值索引, 簇编号或None)
+        """
+        error, labels, reclustered = self.baseline(sensor_id).update(values, source)
+        self.stats['reclustered' if reclustered else 'classified'] += 1
+        return error, labels
+
+    def save(self, path=None):
+        path = path if path is not None else self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        state = {'sensors': {sensor_id: baseline.to_dict() for sensor_id, baseline in sorted(self.baselines.items())}}
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(path + '.tmp', path)
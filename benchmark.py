@@ -0,0 +1,516 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from DDDBscan import DBScan, dbscan_1d_labels, detect_all_sensors, merge_xlsx_files_in_folder, month_mapping, \
+    sensor_names
+from stream_detection import StreamingDBScan
+
+
+def synthetic_cable_force(n, seed=0, base=3000.0, outlier_ratio=0.001):
+    """
+    Synthetic single-cable force series: slow daily drift plus noise, with a few
+    injected spikes.
+    :param n: number of samples
+    :param seed: random seed
+    :param base: mean cable force
+    :param outlier_ratio: fraction of samples replaced by outliers
+    :return: float64 array of length n
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    x = base + 150.0 * np.sin(2 * np.pi * t / 1440.0) + rng.normal(0.0, 20.0, n)
+    n_outliers = int(n * outlier_ratio)
+    if n_outliers:
+        idx = rng.choice(n, n_outliers, replace=False)
+        x[idx] += rng.choice([-1.0, 1.0], n_outliers) * rng.uniform(800.0, 2000.0, n_outliers)
+    return x
+
+
+def _peak_memory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _sklearn_labels(x, epsilon):
+    from sklearn.cluster import DBSCAN
+    return DBSCAN(eps=epsilon, min_samples=1).fit(x.reshape(-1, 1)).labels_
+
+
+def _run_engine(engine, n, epsilon):
+    """
+    Run one clustering engine in the current process and measure wall time and
+    peak memory growth (peak RSS where available, tracemalloc otherwise; sklearn's
+    neighbour lists are not visible to tracemalloc).
+    """
+    x = synthetic_cable_force(n)
+    func = _sklearn_labels if engine == 'sklearn' else dbscan_1d_labels
+    rss_before = _peak_memory()
+    if rss_before is None:
+        tracemalloc.start()
+    start = time.perf_counter()
+    labels = func(x, epsilon)
+    elapsed = time.perf_counter() - start
+    if rss_before is None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = _peak_memory() - rss_before
+    return labels, elapsed, peak
+
+
+def _measure(engine, n, epsilon):
+    # A fresh process per measurement keeps peak RSS from leaking between runs
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_run_engine, engine, n, epsilon).result()
+
+
+def bench_dbscan_engines(sizes, epsilon=100.0, sklearn_max=10000):
+    """
+    Time and peak memory of the 1-D sorted-gap engine against sklearn DBSCAN.
+    sklearn builds the full neighbour graph, so it only runs up to `sklearn_max` samples.
+    :return: list of result dicts, one per size
+    """
+    results = []
+    for n in sizes:
+        labels, sorted_time, sorted_peak = _measure('sorted', n, epsilon)
+        row = {'bench': 'dbscan_engine', 'n': n, 'epsilon': epsilon,
+               'sorted_time_s': sorted_time, 'sorted_peak_bytes': sorted_peak,
+               'sklearn_time_s': None, 'sklearn_peak_bytes': None, 'speedup': None, 'labels_equal': None}
+        if n <= sklearn_max:
+            sk_labels, sk_time, sk_peak = _measure('sklearn', n, epsilon)
+            row.update(sklearn_time_s=sk_time, sklearn_peak_bytes=sk_peak,
+                       speedup=sk_time / sorted_time, labels_equal=bool(np.array_equal(labels, sk_labels)))
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+def bench_streaming(n=100000, window=1440, batch=10, rerun_samples=200):
+    """
+    Amortized per-sample cost of StreamingDBScan against re-running the batch DBScan
+    on the sliding window for every new sample.
+    :return: result dict
+    """
+    x = synthetic_cable_force(n)
+    detector = StreamingDBScan(window=window)
+    start = time.perf_counter()
+    for k in range(0, n, batch):
+        detector.update(x[k:k + batch])
+    stream_time = (time.perf_counter() - start) / n
+
+    rerun_samples = min(rerun_samples, n - window)
+    start = time.perf_counter()
+    for k in range(rerun_samples):
+        DBScan(x[k:k + window])
+    rerun_time = (time.perf_counter() - start) / max(rerun_samples, 1)
+
+    row = {'bench': 'streaming', 'n': n, 'window': window, 'batch': batch,
+           'stream_per_sample_s': stream_time, 'rerun_per_sample_s': rerun_time,
+           'speedup': rerun_time / stream_time}
+    print(json.dumps(row))
+    return row
+
+
+def synthetic_sensor_matrix(n, n_sensors=48, seed=0):
+    """
+    Synthetic (time x sensor) cable-force matrix: all cables share the daily drift
+    (physically coupled), each with its own offset, gain and noise.
+    :return: float64 array of shape (n, n_sensors)
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    drift = np.sin(2 * np.pi * t / 1440.0)[:, None]
+    base = rng.uniform(2000.0, 4000.0, n_sensors)
+    gain = rng.uniform(100.0, 200.0, n_sensors)
+    return base + gain * drift + rng.normal(0.0, 20.0, (n, n_sensors))
+
+
+def bench_multi_sensor(n=20000, n_sensors=48, epochs=3, time_step=10):
+    """
+    Training and inference cost of one shared multi-sensor LSTM against the
+    per-sensor loop (one LSTM per cable), on the same synthetic matrix.
+    :return: result dict
+    """
+    import torch
+    from sklearn.preprocessing import MinMaxScaler
+    from lstm_prediction import LSTM, SlidingWindowDataset, num_windows, train_lstm
+
+    matrix = MinMaxScaler().fit_transform(synthetic_sensor_matrix(n, n_sensors))
+    config = {'epochs': epochs, 'patience': None, 'seed': 0}
+    train_size = int(num_windows(n, time_step) * 0.7)
+
+    start = time.perf_counter()
+    models, per_sensor_val = [], []
+    for k in range(n_sensors):
+        dataset = SlidingWindowDataset(matrix[:, k:k + 1], time_step)
+        model, history = train_lstm(LSTM(), *dataset[:train_size], *dataset[train_size:], config, f'S{k}')
+        models.append((model, dataset))
+        per_sensor_val.append(history[-1]['val_loss'])
+    per_sensor_train = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        for model, dataset in models:
+            model(dataset[train_size:][0])
+    per_sensor_infer = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dataset = SlidingWindowDataset(matrix, time_step)
+    multi_model = LSTM(input_size=n_sensors, hidden_layer_size=128, output_size=n_sensors)
+    multi_model, history = train_lstm(multi_model, *dataset[:train_size], *dataset[train_size:], config, 'multi')
+    multi_train = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        multi_model(dataset[train_size:][0])
+    multi_infer = time.perf_counter() - start
+
+    row = {'bench': 'multi_sensor', 'n': n, 'n_sensors': n_sensors, 'epochs': epochs,
+           'per_sensor_train_s': per_sensor_train, 'per_sensor_infer_s': per_sensor_infer,
+           'per_sensor_val_mse': float(np.mean(per_sensor_val)),
+           'multi_train_s': multi_train, 'multi_infer_s': multi_infer, 'multi_val_mse': history[-1]['val_loss'],
+           'train_speedup': per_sensor_train / multi_train, 'infer_speedup': per_sensor_infer / multi_infer}
+    print(json.dumps(row))
+    return row
+
+
+def synthetic_sensor_records(days, n_sensors=48, interval_minutes=10, start='2022-07-01', seed=0,
+                             outlier_ratio=0.001):
+    """
+    Synthetic long-format archive in the layout of the merged monthly CSVs
+    (MDATE, SENSOR_ID, M_RESULT): every cable has its own mean force, a daily
+    temperature cycle, a yearly seasonal drift and noise, with spikes injected at
+    random (time, sensor) cells.
+    :param days: length of the archive in days (1 to several years)
+    :param n_sensors: number of cables, named like DDDBscan.sensor_names
+    :param interval_minutes: sampling interval
+    :param start: first timestamp
+    :param seed: random seed
+    :param outlier_ratio: fraction of readings replaced by outliers
+    :return: (DataFrame sorted by MDATE then SENSOR_ID, boolean outlier mask per row)
+    """
+    rng = np.random.default_rng(seed)
+    n = days * 1440 // interval_minutes
+    mdate = pd.date_range(start, periods=n, freq=f'{interval_minutes}min')
+    minutes = np.arange(n) * float(interval_minutes)
+
+    daily = np.sin(2 * np.pi * minutes / 1440.0)[:, None]
+    seasonal = np.sin(2 * np.pi * minutes / (365.0 * 1440.0))[:, None]
+    base = rng.uniform(2000.0, 4000.0, n_sensors)
+    gain = rng.uniform(100.0, 200.0, n_sensors)
+    seasonal_gain = rng.uniform(50.0, 150.0, n_sensors)
+    values = base + gain * daily + seasonal_gain * seasonal + rng.normal(0.0, 20.0, (n, n_sensors))
+
+    outliers = rng.random((n, n_sensors)) < outlier_ratio
+    count = int(outliers.sum())
+    values[outliers] += rng.choice([-1.0, 1.0], count) * rng.uniform(800.0, 2000.0, count)
+
+    df = pd.DataFrame({
+        'MDATE': np.repeat(mdate.to_numpy(), n_sensors),
+        'SENSOR_ID': np.tile(np.array(sensor_names(n_sensors), dtype=object), n),
+        'M_RESULT': values.ravel(),
+    })
+    return df, outliers.ravel()
+
+
+def bench_baselines(days=365, n_sensors=48, interval_minutes=10):
+    """
+    Month-by-month detection over a synthetic archive: DBScan from scratch on every
+    sensor-month against the cross-month BaselineCache (full re-cluster only on the first
+    month or on drift). Detections are scored against the injected outliers.
+    :return: result dict
+    """
+    from baseline_cache import BaselineCache
+
+    df, outliers = synthetic_sensor_records(days, n_sensors=n_sensors, interval_minutes=interval_minutes)
+    months = df['MDATE'].dt.strftime('%Y-%m').to_numpy()
+    sensor_ids = df['SENSOR_ID'].to_numpy()
+    values = df['M_RESULT'].to_numpy()
+    groups = [(month, sensor_id, np.flatnonzero((months == month) & (sensor_ids == sensor_id)))
+              for month in np.unique(months) for sensor_id in sensor_names(n_sensors)]
+
+    flags = {'dbscan': np.zeros(len(df), dtype=bool), 'cached': np.zeros(len(df), dtype=bool)}
+    times = {'dbscan': 0.0, 'cached': 0.0}
+    cache = BaselineCache()
+    for month, sensor_id, rows in groups:
+        x = values[rows]
+        start = time.perf_counter()
+        error = DBScan(x)
+        times['dbscan'] += time.perf_counter() - start
+        flags['dbscan'][rows[error]] = True
+
+        start = time.perf_counter()
+        error, _ = cache.detect(sensor_id, x, month)
+        times['cached'] += time.perf_counter() - start
+        flags['cached'][rows[error]] = True
+
+    row = {'bench': 'baseline_cache', 'days': days, 'n': len(df), 'injected': int(outliers.sum()),
+           'monthly_dbscan_s': times['dbscan'], 'cached_s': times['cached'],
+           'speedup': times['dbscan'] / times['cached'], 'reclustered': cache.stats['reclustered']}
+    for name, flag in flags.items():
+        row[f'{name}_detected'] = int((flag & outliers).sum())
+        row[f'{name}_false'] = int((flag & ~outliers).sum())
+    print(json.dumps(row))
+    return row
+
+
+def _write_month_folder(df, root, files_per_folder):
+    """
+    Write the first month of `df` as xlsx exports into a Chinese-named month folder
+    (e.g. 七月), the input layout of merge_xlsx_files_in_folder.
+    :return: (month folder path, year, number of rows written)
+    """
+    first = df['MDATE'].iloc[0]
+    month_df = df[(df['MDATE'].dt.year == first.year) & (df['MDATE'].dt.month == first.month)]
+    month_name = next(name for name, num in month_mapping.items() if int(num) == first.month)
+    month_folder = os.path.join(root, month_name)
+    os.makedirs(month_folder, exist_ok=True)
+    for k, part in enumerate(np.array_split(np.arange(len(month_df)), files_per_folder)):
+        month_df.iloc[part].to_excel(os.path.join(month_folder, f"export_{k:03d}.xlsx"), index=False)
+    return month_folder, first.year, len(month_df)
+
+
+def _write_raw_archive(df, raw_directory):
+    """
+    Write `df` as one gb2312 CSV per month, the layout of the raw ./索力数据 archive
+    read by process_and_save_sensor_data.
+    """
+    os.makedirs(raw_directory, exist_ok=True)
+    for month, group in df.groupby(df['MDATE'].dt.strftime('%Y-%m'), sort=True):
+        group.to_csv(os.path.join(raw_directory, f"{month}.csv"), index=False, encoding='gb2312')
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_pipeline(days, workdir, n_sensors=48, interval_minutes=10, epochs=2, time_step=10,
+                   merge_max_days=31, files_per_folder=8, sensor_id='SLS01'):
+    """
+    Time every stage of the detection and imputation pipeline separately on a
+    synthetic archive of `days` days:
+    merge (xlsx month folder -> csv, on at most `merge_max_days` days since xlsx
+    writing dominates otherwise), per-sensor extraction (raw CSV rescan and the
+    columnar store), DBScan on one sensor and on all sensors, create_dataset,
+    LSTM training and batched imputation of the sensor's injected outliers.
+    :param days: archive length in days
+    :param workdir: scratch folder for the generated files
+    :return: list of result dicts, one per stage
+    """
+    from sklearn.preprocessing import MinMaxScaler
+    from sensor_store import build_sensor_store
+    from lstm_prediction import LSTM, SlidingWindowDataset, create_dataset, impute_anomalies, \
+        process_and_save_sensor_data, train_lstm
+
+    workdir = os.path.join(workdir, f"days_{days}")
+    df, outliers = synthetic_sensor_records(days, n_sensors, interval_minutes)
+    results = []
+
+    def record(stage, elapsed, rows, **extra):
+        row = {'bench': 'pipeline', 'stage': stage, 'days': days, 'n_sensors': n_sensors,
+               'interval_minutes': interval_minutes, 'rows': int(rows), 'time_s': elapsed,
+               'rows_per_s': rows / elapsed if elapsed > 0 else None}
+        row.update(extra)
+        results.append(row)
+        print(json.dumps(row))
+
+    # Merge
+    merge_df = df[df['MDATE'] < df['MDATE'].iloc[0] + pd.Timedelta(days=merge_max_days)]
+    month_folder, year, merge_rows = _write_month_folder(merge_df, os.path.join(workdir, 'marked'), files_per_folder)
+    _, elapsed = _timed(merge_xlsx_files_in_folder, month_folder, year=year)
+    record('merge', elapsed, merge_rows, files=files_per_folder)
+
+    # Per-sensor extraction
+    raw_directory = os.path.join(workdir, 'raw')
+    _write_raw_archive(df, raw_directory)
+    save_directory = os.path.join(workdir, 'merge')
+    store_directory = os.path.join(workdir, 'sensor_store')
+    sensor_df, elapsed = _timed(process_and_save_sensor_data, raw_directory, sensor_id, save_directory)
+    record('extract_csv_rescan', elapsed, len(df))
+    _, elapsed = _timed(build_sensor_store, raw_directory, store_directory)
+    record('store_build', elapsed, len(df))
+    _, elapsed = _timed(process_and_save_sensor_data, raw_directory, sensor_id, save_directory, store_directory)
+    record('extract_store', elapsed, len(sensor_df))
+
+    # Detection
+    values = sensor_df['M_RESULT'].to_numpy(dtype=float)
+    _, elapsed = _timed(DBScan, values)
+    record('dbscan_sensor', elapsed, len(values))
+    _, elapsed = _timed(detect_all_sensors, df, workers=1)
+    record('dbscan_all_sensors', elapsed, len(df))
+
+    # Dataset and training
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaled = scaler.fit_transform(values.reshape(-1, 1))
+    (X, _), elapsed = _timed(create_dataset, scaled, time_step)
+    record('create_dataset', elapsed, len(X))
+
+    dataset = SlidingWindowDataset(scaled, time_step)
+    train_size = int(len(dataset) * 0.7)
+    config = {'epochs': epochs, 'patience': None, 'seed': 0}
+    (model, _), elapsed = _timed(train_lstm, LSTM(), *dataset[:train_size], *dataset[train_size:], config, sensor_id)
+    record('train', elapsed, train_size * epochs, epochs=epochs)
+
+    # Imputation of the injected outliers of the sensor
+    anomalies = df[outliers & (df['SENSOR_ID'] == sensor_id).to_numpy()]
+    (imputed, _), elapsed = _timed(impute_anomalies, model, scaler, sensor_df, scaled, anomalies, time_step)
+    record('impute', elapsed, len(anomalies), predicted=int(imputed['Prediction'].notna().sum()))
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def _result_key(row):
+    return tuple(row.get(field) for field in ('bench', 'stage', 'days', 'n'))
+
+
+def compare_results(baseline, results, threshold=1.2):
+    """
+    Compare the timings (fields ending in '_s') of two benchmark runs matched by
+    bench, stage, days and n.
+    :param baseline: path of an earlier --output file, or its list of results
+    :param results: results of the current run
+    :param threshold: ratio current / baseline above which a timing is a regression
+    :return: list of regressions {'key', 'field', 'baseline', 'current', 'ratio'}
+    """
+    if isinstance(baseline, str):
+        with open(baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    if isinstance(baseline, dict):
+        baseline = baseline['results']
+    previous = {_result_key(row): row for row in baseline}
+
+    regressions = []
+    for row in results:
+        old = previous.get(_result_key(row))
+        if old is None:
+            continue
+        for field, value in row.items():
+            if not field.endswith('_s') or not isinstance(value, (int, float)) \
+                    or not isinstance(old.get(field), (int, float)) or old[field] <= 0:
+                continue
+            ratio = value / old[field]
+            if ratio > threshold:
+                regressions.append({'key': list(_result_key(row)), 'field': field,
+                                    'baseline': old[field], 'current': value, 'ratio': ratio})
+    return regressions
+
+
+# Run in a fresh interpreter per measurement: imports the modules of one CLI command and
+# reports which heavy libraries ended up loaded
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import cli
+cli.load_command({command!r})
+print(json.dumps({{'import_s': time.perf_counter() - start,
+                  'loaded': [m for m in ('torch', 'sklearn', 'matplotlib') if m in sys.modules]}}))
+"""
+
+
+def bench_startup(commands=('detect', 'merge', 'train'), repeats=5):
+    """
+    Cold-start latency of the CLI commands: wall time of a fresh interpreter that
+    imports everything one command needs, and the in-process import time.
+    :return: list of result dicts, one per command
+    """
+    results = []
+    for command in commands:
+        walls, imports = [], []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', STARTUP_PROBE.format(command=command)], check=True,
+                                 capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            walls.append(time.perf_counter() - start)
+            probe = json.loads(out.stdout.strip().splitlines()[-1])
+            imports.append(probe['import_s'])
+        row = {'bench': 'startup', 'stage': command, 'repeats': repeats,
+               'wall_median_s': float(np.median(walls)), 'import_median_s': float(np.median(imports)),
+               'loaded': probe['loaded']}
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DBScan clustering engine benchmark")
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7],
+                        help="series lengths for the clustering engine benchmark (none to skip it)")
+    parser.add_argument('--epsilon', type=float, default=100.0)
+    parser.add_argument('--sklearn-max', type=int, default=10000,
+                        help="largest size to run sklearn DBSCAN on (its memory grows with neighbour count)")
+    parser.add_argument('--stream-window', type=int, default=1440, help="0 skips the streaming benchmark")
+    parser.add_argument('--baseline-days', type=int, default=0,
+                        help="archive length in days for the cross-month baseline cache benchmark (0 skips it)")
+    parser.add_argument('--lstm', action='store_true', help="also run the LSTM benchmarks (needs torch)")
+    parser.add_argument('--startup', action='store_true',
+                        help="also measure cold-start latency of the CLI commands")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="also time every pipeline stage on synthetic 48-sensor archives (needs torch)")
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 31, 365],
+                        help="archive lengths in days for the pipeline benchmark")
+    parser.add_argument('--interval', type=int, default=10, help="sampling interval in minutes of the archives")
+    parser.add_argument('--epochs', type=int, default=2, help="training epochs in the pipeline benchmark")
+    parser.add_argument('--merge-max-days', type=int, default=31)
+    parser.add_argument('--workdir', help="scratch folder for generated files (default: a temporary folder)")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="earlier --output file to check for timing regressions")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="slowdown ratio reported as a regression by --compare")
+    args = parser.parse_args(argv)
+
+    results = bench_dbscan_engines(args.sizes, args.epsilon, args.sklearn_max)
+    if args.stream_window > 0:
+        results.append(bench_streaming(window=args.stream_window))
+    if args.baseline_days > 0:
+        results.append(bench_baselines(args.baseline_days))
+    if args.startup:
+        results.extend(bench_startup())
+    if args.lstm:
+        results.append(bench_multi_sensor())
+    if args.pipeline:
+        with tempfile.TemporaryDirectory() as scratch:
+            for days in args.days:
+                results.extend(bench_pipeline(days, args.workdir or scratch, interval_minutes=args.interval,
+                                              epochs=args.epochs, merge_max_days=args.merge_max_days))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': _environment(), 'results': results}, f, indent=2)
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        for regression in regressions:
+            print(f"Regression {regression['key']} {regression['field']}: "
+                  f"{regression['baseline']:.4f}s -> {regression['current']:.4f}s ({regression['ratio']:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
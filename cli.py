@@ -0,0 +1,270 @@
+import argparse
+import importlib
+import sys
+
+
+# Modules each command needs, imported only when that command runs: merge and detect never
+# load torch, sklearn or matplotlib (unless plots are requested)
+COMMAND_MODULES = {
+    'merge': ('DDDBscan',),
+    'detect': ('DDDBscan',),
+    'train': ('lstm_prediction',),
+    'impute': ('lstm_prediction',),
+    'export': ('lstm_export',),
+    'bench': ('benchmark',),
+    'serve': ('ingest_service',),
+    'replay': ('ingest_service',),
+}
+
+
+def load_command(command):
+    """
+    Import the modules of one command.
+    :return: list of modules in COMMAND_MODULES order
+    """
+    return [importlib.import_module(name) for name in COMMAND_MODULES[command]]
+
+
+def run_merge(args):
+    DDDBscan, = load_command('merge')
+    if args.month_folder:
+        errors = []
+        DDDBscan.merge_xlsx_files_in_folder(args.folder, year=args.year, incremental=args.incremental, errors=errors)
+        report = [{'month_folder': args.folder, 'errors': errors}]
+    else:
+        report = DDDBscan.merge_month_folders(args.folder, workers=args.workers, year=args.year,
+                                              incremental=args.incremental)
+    failed = 0
+    for item in report:
+        for err in item['errors']:
+            print(f"Error reading {err['file']}: {err['error']}")
+            failed += 1
+    return 1 if failed else 0
+
+
+def run_detect(args):
+    DDDBscan, = load_command('detect')
+    import os
+    import pandas as pd
+    from csv_reader import read_sensor_csv
+
+    frames = [read_sensor_csv(path, sensor_ids=args.sensors, encoding=args.encoding) for path in args.csv]
+    df = pd.concat(frames, ignore_index=True)
+    errors, anomaly_rows = [], []
+    if args.baseline_cache:
+        # Months in file order against the cross-month baselines, one anomaly table for all of them
+        from baseline_cache import BaselineCache
+        if args.workers is not None or args.engine != 'sorted':
+            print("--baseline-cache runs in-process with the sorted engine, ignoring --workers and --engine")
+        cache = BaselineCache(args.baseline_cache)
+        tables, offset = [], 0
+        for path, frame in zip(args.csv, frames):
+            frame_rows = []
+            tables.append(DDDBscan.detect_all_sensors(frame, errors=errors, baseline_cache=cache,
+                                                      source=os.path.basename(path), anomaly_rows=frame_rows))
+            # Rows of each month shifted to their place in the concatenated frame
+            anomaly_rows.extend(rows + offset for rows in frame_rows)
+            offset += len(frame)
+        anomaly_df = pd.concat(tables, ignore_index=True)
+        os.makedirs(os.path.dirname(args.anomaly_file) or '.', exist_ok=True)
+        anomaly_df.to_csv(args.anomaly_file, index=False, encoding='utf-8')
+        print(f"Baselines: {cache.stats['classified']} sensor-months classified, "
+              f"{cache.stats['reclustered']} re-clustered")
+    else:
+        anomaly_df = DDDBscan.detect_all_sensors(df, workers=args.workers, engine=args.engine,
+                                                 anomaly_file=args.anomaly_file, errors=errors,
+                                                 anomaly_rows=anomaly_rows)
+    for err in errors:
+        print(f"Detection failed for sensor {err['sensor_id']}: {err['error']}")
+    print(f"{len(anomaly_df)} anomalies in {df['SENSOR_ID'].nunique()} sensors")
+    if args.plots:
+        import numpy as np
+        from anomaly_plots import render_all_sensors, error_indices_from_rows
+        # Plots mark exactly the detected anomalies instead of running DBScan again
+        error_indices = error_indices_from_rows(df, np.concatenate(anomaly_rows))
+        render_all_sensors(df, args.plots, fmt=args.plot_format, workers=args.workers, report_path=args.report,
+                           error_indices=error_indices)
+    return 1 if errors else 0
+
+
+def _data_folders(args):
+    # Passed down as arguments (unset ones fall back to the lstm_prediction defaults), so
+    # training workers get them too whatever the multiprocessing start method
+    return {'data_directory': args.data_directory, 'store_directory': args.store_directory,
+            'archive_directory': args.archive_directory}
+
+
+def run_train(args):
+    lstm_prediction, = load_command('train')
+    import os
+    data_folders = _data_folders(args)
+    os.makedirs(args.model_folder, exist_ok=True)
+
+    train_config = {key: value for key, value in
+                    (('epochs', args.epochs), ('batch_size', args.batch_size), ('num_threads', args.threads))
+                    if value is not None}
+    if args.multi_sensor:
+        lstm_prediction.train_and_predict_multi_sensor(args.anomaly_file, args.save_folder, args.model_folder,
+                                                       train_config=train_config, data_folders=data_folders)
+        return 0
+    if args.workers is not None and args.workers > 1:
+        summaries = lstm_prediction.schedule_training(args.anomaly_file, args.save_folder, args.model_folder,
+                                                      workers=args.workers, train_config=train_config,
+                                                      skip_fresh=not args.retrain, data_folders=data_folders)
+    else:
+        summaries = lstm_prediction.train_and_predict_lstm(args.anomaly_file, args.save_folder, args.model_folder,
+                                                           train_config=train_config, skip_fresh=not args.retrain,
+                                                           data_folders=data_folders)
+        lstm_prediction.print_training_summary(summaries)
+    return 1 if any(summary['status'] == 'failed' for summary in summaries) else 0
+
+
+def run_impute(args):
+    lstm_prediction, = load_command('impute')
+    data_folders = _data_folders(args)
+    if args.backend == 'registry':
+        summaries = lstm_prediction.predict_from_registry(args.anomaly_file, args.save_folder, args.model_folder,
+                                                          data_folders=data_folders)
+        lstm_prediction.print_training_summary(summaries)
+        return 1 if any(summary['status'] == 'missing' for summary in summaries) else 0
+    if args.backend in ('script', 'int8'):
+        lstm_export, = load_command('export')
+        summaries = lstm_export.predict_from_exports(args.anomaly_file, args.save_folder, args.model_folder,
+                                                     variant=args.backend, data_folders=data_folders)
+        lstm_prediction.print_training_summary(summaries)
+        return 1 if any(summary['status'] == 'missing' for summary in summaries) else 0
+    from predictors import impute_with_backend
+    impute_with_backend(args.anomaly_file, args.save_folder, algorithm=args.backend, data_folders=data_folders)
+    return 0
+
+
+def run_export(args):
+    lstm_export, = load_command('export')
+    reports = lstm_export.export_registry(args.save_folder, args.model_folder, sensor_ids=args.sensors,
+                                          variants=args.variant, tolerance=args.tolerance,
+                                          data_folders=_data_folders(args))
+    return 1 if any(report['status'] == 'rejected' for report in reports) else 0
+
+
+def run_bench(args):
+    benchmark, = load_command('bench')
+    return benchmark.main(args.extra)
+
+
+def run_serve(args):
+    ingest_service, = load_command('serve')
+    detector_kwargs = {key: value for key, value in (('window', args.window), ('warmup', args.warmup))
+                       if value is not None}
+    ingest_service.run_service(args.host, args.tcp_port, None if args.no_websocket else args.ws_port,
+                               queue_size=args.queue_size, **detector_kwargs)
+    return 0
+
+
+def run_replay(args):
+    ingest_service, = load_command('replay')
+    report = ingest_service.run_replay(args.csv, args.host, args.port, speedup=args.speedup,
+                                       encoding=args.encoding, timeout=args.timeout)
+    return 0 if report['verdicts'] == report['readings'] else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="Cable-force anomaly detection and imputation")
+    parser.add_argument('--log', help="JSON-lines instrumentation log; prints a per-stage summary at the end")
+    parser.add_argument('--profile', action='store_true', help="also dump cProfile stats next to --log")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    merge = commands.add_parser('merge', help="merge monthly xlsx exports into one csv per month")
+    merge.add_argument('folder', help="root folder of the month folders (七月, 八月...), or one month folder")
+    merge.add_argument('--month-folder', action='store_true', help="folder is a single month folder")
+    merge.add_argument('--year', type=int)
+    merge.add_argument('--incremental', action='store_true')
+    merge.add_argument('--workers', type=int)
+    merge.set_defaults(handler=run_merge)
+
+    detect = commands.add_parser('detect', help="DBScan anomaly detection of every sensor in merged csvs")
+    detect.add_argument('csv', nargs='+', help="merged monthly csv files (MDATE, SENSOR_ID, M_RESULT)")
+    detect.add_argument('--anomaly-file', default='./anomaly/anomaly_info.csv')
+    detect.add_argument('--encoding', help="encoding of the csvs (default: detected per file)")
+    detect.add_argument('--sensors', nargs='+', help="only these SENSOR_IDs")
+    detect.add_argument('--baseline-cache', help="cross-month baseline file (json): each csv is one month, classified "
+                                                 "against the cached baselines and re-clustered only on drift; "
+                                                 "runs in-process with the sorted engine, --workers and --engine "
+                                                 "are ignored")
+    detect.add_argument('--engine', choices=('sorted', 'sklearn'), default='sorted')
+    detect.add_argument('--workers', type=int)
+    detect.add_argument('--plots', help="render one plot per sensor into this folder")
+    detect.add_argument('--plot-format', choices=('png', 'svg'), default='png')
+    detect.add_argument('--report', help="also write a combined multi-panel figure")
+    detect.set_defaults(handler=run_detect)
+
+    for name, handler, help_text in (('train', run_train, "train per-sensor LSTMs and impute anomalies"),
+                                     ('impute', run_impute, "impute anomalies without training"),
+                                     ('export', run_export, "compile (and quantize) trained LSTMs for inference")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--anomaly-file', default='./anomaly/anomaly_info.csv')
+        command.add_argument('--save-folder', default='./merge')
+        command.add_argument('--model-folder', default='./models')
+        command.add_argument('--data-directory', help="raw csv archive (default ./索力数据)")
+        command.add_argument('--store-directory')
+        command.add_argument('--archive-directory')
+        command.set_defaults(handler=handler)
+        if name == 'train':
+            command.add_argument('--workers', type=int, help="train sensors in parallel processes")
+            command.add_argument('--epochs', type=int)
+            command.add_argument('--batch-size', type=int)
+            command.add_argument('--threads', type=int, help="torch threads per process")
+            command.add_argument('--retrain', action='store_true',
+                                 help="retrain every sensor (default: reuse models trained on the same data)")
+            command.add_argument('--multi-sensor', action='store_true', help="one shared model for all sensors")
+        elif name == 'impute':
+            command.add_argument('--backend', default='registry',
+                                 choices=('registry', 'script', 'int8', 'LSTM', 'LinearRegression', 'AR', 'SVR'),
+                                 help="'registry' predicts with the trained LSTMs, 'script'/'int8' with their "
+                                      "exports, others fit a fast predictor")
+        else:
+            command.add_argument('--variant', nargs='+', choices=('script', 'int8'), default=['script'],
+                                 help="float32 TorchScript and/or int8 dynamically quantized TorchScript")
+            command.add_argument('--sensors', nargs='+', help="only these sensors (default: all registered)")
+            command.add_argument('--tolerance', type=float,
+                                 help="largest accepted prediction difference to the eager model, in scaled units")
+
+    serve = commands.add_parser('serve', help="real-time ingestion service with online detection")
+    serve.add_argument('--host', default='localhost')
+    serve.add_argument('--tcp-port', type=int, default=8081, help="newline-delimited JSON readings")
+    serve.add_argument('--ws-port', type=int, default=8080, help="WebSocket port the dashboard connects to")
+    serve.add_argument('--no-websocket', action='store_true', help="TCP only (no websockets package needed)")
+    serve.add_argument('--queue-size', type=int, default=1024, help="per-sensor queue bound (backpressure)")
+    serve.add_argument('--window', type=int, help="readings per sensor kept by the online detector")
+    serve.add_argument('--warmup', type=int, help="readings before the online detector starts flagging")
+    serve.set_defaults(handler=run_serve)
+
+    replay = commands.add_parser('replay', help="replay a merged csv against a running service, report latency")
+    replay.add_argument('csv', help="merged monthly csv (MDATE, SENSOR_ID, M_RESULT)")
+    replay.add_argument('--host', default='localhost')
+    replay.add_argument('--port', type=int, default=8081)
+    replay.add_argument('--speedup', type=float, help="times real time (default: send as fast as possible)")
+    replay.add_argument('--encoding', help="encoding of the csv (default: detected)")
+    replay.add_argument('--timeout', type=float, default=60.0)
+    replay.set_defaults(handler=run_replay)
+
+    bench = commands.add_parser('bench', help="benchmarks (all further arguments are passed to benchmark.py)",
+                                add_help=False)
+    bench.set_defaults(handler=run_bench)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command != 'bench':
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.extra = extra
+    if args.log is None:
+        return args.handler(args)
+    from instrumentation import run
+    with run(args.command, args.log, profile=args.profile):
+        return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
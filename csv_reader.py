@@ -0,0 +1,183 @@
+import os
+import codecs
+import pandas as pd
+
+from instrumentation import count
+
+
+# Columns every reader of sensor readings needs
+SENSOR_COLUMNS = ['MDATE', 'SENSOR_ID', 'M_RESULT']
+
+# Explicit dtypes of the known columns, nothing is inferred; MDATE is parsed per chunk
+# with MDATE_FORMAT after the SENSOR_ID filter
+SENSOR_DTYPES = {'MDATE': str, 'SENSOR_ID': str, 'M_RESULT': 'float64'}
+MDATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rows per chunk: a chunk of the three sensor columns is a few tens of MB
+DEFAULT_CHUNKSIZE = 500_000
+
+# Bytes per block of the pyarrow reader (about 200k rows of the three sensor columns);
+# larger blocks are not faster and raise the peak memory of a streamed scan
+PYARROW_BLOCK_SIZE = 8 << 20
+
+# Bytes sampled to detect the encoding of a file
+ENCODING_SAMPLE_SIZE = 1 << 16
+
+# (absolute path, size, mtime) -> detected encoding
+_encoding_cache = {}
+
+
+def list_csv_files(directory):
+    """
+    All CSV files under `directory`, sorted.
+    """
+    all_files = []
+    for subdir, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.csv'):
+                all_files.append(os.path.join(subdir, file))
+    return sorted(all_files)
+
+
+def _sniff_encoding(path, sample_size):
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    # Incremental decoding so a multi-byte character cut at the end of the sample is not an error
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
+
+def detect_encoding(path, sample_size=ENCODING_SAMPLE_SIZE):
+    """
+    Encoding of a CSV file from its first bytes: 'utf-8-sig' (BOM, as written by the
+    merge step), 'utf-8' (also plain ASCII), 'gb18030' (superset of the gb2312 raw
+    exports) or 'latin-1' as a last resort. The result is cached per path, size and
+    mtime, so each file is sniffed once per process.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    encoding = _encoding_cache.get(key)
+    if encoding is None:
+        encoding = _encoding_cache[key] = _sniff_encoding(path, sample_size)
+        count('csv.encoding_detected')
+    return encoding
+
+
+def parse_mdate(mdate, date_format=MDATE_FORMAT):
+    """
+    Parse MDATE strings with the fixed format; a column in another layout falls back to
+    pandas' format inference instead of failing.
+    """
+    try:
+        return pd.to_datetime(mdate, format=date_format)
+    except (ValueError, TypeError):
+        return pd.to_datetime(mdate)
+
+
+def _pyarrow_available():
+    try:
+        import pyarrow.csv  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _iter_chunks_c(path, encoding, usecols, sensor_ids, chunksize):
+    dtype = SENSOR_DTYPES if usecols is None else {column: SENSOR_DTYPES[column] for column in usecols
+                                                    if column in SENSOR_DTYPES}
+    with pd.read_csv(path, encoding=encoding, usecols=usecols, dtype=dtype, engine='c',
+                     chunksize=chunksize) as reader:
+        for chunk in reader:
+            count('csv.rows_scanned', len(chunk))
+            if sensor_ids is not None:
+                chunk = chunk[chunk['SENSOR_ID'].isin(sensor_ids)]
+            yield chunk
+
+
+def _iter_chunks_pyarrow(path, encoding, usecols, sensor_ids):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pcsv
+
+    # pyarrow skips a UTF-8 BOM itself and transcodes other encodings while reading
+    read_options = pcsv.ReadOptions(block_size=PYARROW_BLOCK_SIZE,
+                                    encoding='utf8' if encoding in ('utf-8', 'utf-8-sig') else encoding)
+    types = {'MDATE': pa.string(), 'SENSOR_ID': pa.string(), 'M_RESULT': pa.float64()}
+    convert_options = pcsv.ConvertOptions(include_columns=usecols, column_types=types)
+    value_set = None if sensor_ids is None else pa.array([str(sensor_id) for sensor_id in sensor_ids])
+    with pcsv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            count('csv.rows_scanned', batch.num_rows)
+            if value_set is not None:
+                batch = batch.filter(pc.is_in(batch.column('SENSOR_ID'), value_set=value_set))
+            yield batch.to_pandas()
+
+
+def iter_sensor_csv(path, sensor_ids=None, usecols=SENSOR_COLUMNS, chunksize=DEFAULT_CHUNKSIZE, encoding=None,
+                    date_format=MDATE_FORMAT, engine='auto'):
+    """
+    Stream a CSV of sensor readings in chunks, so memory is bounded by the chunk size
+    (and the rows the caller keeps) rather than the file size.
+    - the encoding is detected (and cached) unless given;
+    - only `usecols` are parsed, with the explicit SENSOR_DTYPES;
+    - rows of other sensors are dropped from each chunk before MDATE is parsed.
+    :param sensor_ids: a sensor id or a collection of them, None keeps every sensor
+    :param usecols: columns to read, None reads all of them
+    :param chunksize: rows per chunk of the C engine (pyarrow reads PYARROW_BLOCK_SIZE blocks)
+    :param date_format: format of MDATE, None leaves MDATE as text
+    :param engine: 'pyarrow' (streaming reader, about twice as fast), 'c' (pandas), or
+                   'auto' for pyarrow when it is installed
+    :return: iterator of DataFrames (chunks without matching rows are skipped)
+    """
+    if encoding is None:
+        encoding = detect_encoding(path)
+    if isinstance(sensor_ids, str):
+        sensor_ids = [sensor_ids]
+    if engine == 'auto':
+        engine = 'pyarrow' if _pyarrow_available() else 'c'
+    if engine == 'pyarrow':
+        chunks = _iter_chunks_pyarrow(path, encoding, usecols, sensor_ids)
+    elif engine == 'c':
+        chunks = _iter_chunks_c(path, encoding, usecols, sensor_ids, chunksize)
+    else:
+        raise ValueError("engine must be one of 'auto', 'pyarrow' or 'c'")
+
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if date_format is not None and 'MDATE' in chunk:
+            chunk = chunk.assign(MDATE=parse_mdate(chunk['MDATE'], date_format))
+        count('csv.rows_kept', len(chunk))
+        yield chunk
+
+
+def read_sensor_csv(path, sensor_ids=None, usecols=SENSOR_COLUMNS, chunksize=DEFAULT_CHUNKSIZE, encoding=None,
+                    date_format=MDATE_FORMAT, engine='auto'):
+    """
+    Read a CSV of sensor readings through iter_sensor_csv and concatenate the kept rows
+    once. Arguments as in iter_sensor_csv.
+    :return: DataFrame (empty, with the requested columns, if nothing matched)
+    """
+    chunks = list(iter_sensor_csv(path, sensor_ids, usecols, chunksize, encoding, date_format, engine))
+    if not chunks:
+        return pd.DataFrame(columns=list(usecols) if usecols is not None else SENSOR_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def iter_sensor_tree(directory, sensor_ids=None, usecols=SENSOR_COLUMNS, chunksize=DEFAULT_CHUNKSIZE,
+                     encoding=None, date_format=MDATE_FORMAT, engine='auto'):
+    """
+    Stream every CSV under `directory` (e.g. the raw archive './索力数据'), file by file.
+    :return: iterator of (file path, DataFrame chunk)
+    """
+    for file in list_csv_files(directory):
+        count('csv.files_read')
+        for chunk in iter_sensor_csv(file, sensor_ids, usecols, chunksize, encoding, date_format, engine):
+            yield file, chunk
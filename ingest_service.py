@@ -0,0 +1,380 @@
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from stream_detection import StreamingDBScan
+
+# 仪表盘（main.js）默认连接的地址 ws://localhost:8080
+DEFAULT_HOST = 'localhost'
+DEFAULT_WS_PORT = 8080
+DEFAULT_TCP_PORT = 8081
+
+
+class _TcpConnection:
+    """
+    TCP连接：每行一条JSON消息
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def messages(self):
+        async for line in self.reader:
+            if line.strip():
+                yield line
+
+    async def send(self, text):
+        self.writer.write(text.encode('utf-8') + b'\n')
+        await self.writer.drain()
+
+
+class _WebSocketConnection:
+    """
+    WebSocket连接：每帧一条JSON文本消息
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+
+    async def messages(self):
+        async for message in self.websocket:
+            yield message
+
+    async def send(self, text):
+        await self.websocket.send(text)
+
+
+class IngestService:
+    """
+    实时索力数据接入与在线异常检测服务（asyncio）。
+
+    消息（TCP每行一条JSON，WebSocket每帧一条JSON）：
+    - 读数 {"SENSOR_ID": "SLS01", "MDATE": "...", "M_RESULT": 3012.5, "sent": 发送时间(可选)}，
+      或批量 {"type": "readings", "readings": [读数, ...]}；
+    - 订阅 {"type": "subscribe", "verdicts": false}（仪表盘的 {"type": "init"} 同样视为订阅），
+      服务端回复 {"type": "subscribed"}，之后推送 {"type": "anomaly", ...}；
+      verdicts 为 true 时还推送每批读数的判定 {"type": "batch", "SENSOR_ID", "sent": [...], "anomalies"}；
+    - {"type": "stats"} 返回服务统计。
+    无效消息与读数（非JSON对象、缺 SENSOR_ID、M_RESULT 不是有限数值）丢弃并计入 stats['invalid']，连接不会断开。
+
+    每个索力一个有界队列和一个处理协程：队列满时读取该连接的协程等待，
+    不再从套接字读数据，由TCP流控把压力传回发送端（背压）。
+    处理协程一次取出队列中至多 max_batch 个读数，在线程池中调用该索力的 StreamingDBScan
+    （与 DBScan 相同的判定逻辑），事件循环不会被检测阻塞。
+    每个订阅者有自己的有界发送队列，慢订阅者的消息被丢弃并计数，不影响检测。
+    """
+
+    def __init__(self, queue_size=1024, max_batch=256, executor_workers=4, subscriber_queue_size=4096,
+                 **detector_kwargs):
+        """
+        :param queue_size: 每个索力读数队列的长度上限
+        :param max_batch: 每次检测的读数个数上限
+        :param executor_workers: 检测线程数
+        :param subscriber_queue_size: 每个订阅者发送队列的长度上限
+        :param detector_kwargs: 传给 StreamingDBScan 的参数（window、warmup 等）
+        """
+        self.queue_size = queue_size
+        self.max_batch = max_batch
+        self.subscriber_queue_size = subscriber_queue_size
+        self.detector_kwargs = detector_kwargs
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self.queues = {}
+        self.workers = {}
+        self.subscribers = {}
+        self.stats = {'received': 0, 'processed': 0, 'anomalies': 0, 'invalid': 0, 'failed': 0,
+                      'backpressure_waits': 0, 'dropped_messages': 0}
+
+    # 读数处理 -------------------------------------------------------------
+
+    @staticmethod
+    def _valid_reading(reading):
+        """
+        读数须为含 SENSOR_ID 和有限数值 M_RESULT 的字典
+        """
+        if not isinstance(reading, dict) or reading.get('SENSOR_ID') in (None, ''):
+            return False
+        value = reading.get('M_RESULT')
+        if isinstance(value, bool):
+            return False
+        try:
+            return math.isfinite(float(value))
+        except (TypeError, ValueError):
+            return False
+
+    async def submit(self, reading):
+        """
+        读数放入所属索力的队列，队列满时等待（背压）；无效读数丢弃并计入 stats['invalid']
+        :return: 读数是否被接收
+        """
+        if not self._valid_reading(reading):
+            self.stats['invalid'] += 1
+            return False
+        sensor_id = str(reading['SENSOR_ID'])
+        queue = self.queues.get(sensor_id)
+        if queue is None:
+            queue = self.queues[sensor_id] = asyncio.Queue(maxsize=self.queue_size)
+            self.workers[sensor_id] = asyncio.create_task(self._sensor_worker(sensor_id, queue))
+        self.stats['received'] += 1
+        if queue.full():
+            self.stats['backpressure_waits'] += 1
+        await queue.put(reading)
+        return True
+
+    async def _sensor_worker(self, sensor_id, queue):
+        detector = StreamingDBScan(**self.detector_kwargs)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                values = np.array([float(reading['M_RESULT']) for reading in batch])
+                flags = await loop.run_in_executor(self.executor, detector.update, values)
+            except Exception as e:
+                # 检测失败只丢弃这一批，处理协程继续运行，否则该索力的队列再也不会被取空
+                self.stats['failed'] += len(batch)
+                print(f"索力 {sensor_id} 的 {len(batch)} 个读数检测失败: {type(e).__name__}: {e}")
+                continue
+            finally:
+                # drain() 依赖 task_done，无论检测是否成功都要标记
+                for _ in batch:
+                    queue.task_done()
+
+            detected = time.time()
+            self.stats['processed'] += len(batch)
+            anomalies = [reading for reading, flag in zip(batch, flags) if flag]
+            self.stats['anomalies'] += len(anomalies)
+            for reading in anomalies:
+                self.publish({'type': 'anomaly', 'SENSOR_ID': sensor_id, 'MDATE': reading.get('MDATE'),
+                              'M_RESULT': float(reading['M_RESULT']), 'sent': reading.get('sent'),
+                              'detected': detected})
+            self.publish({'type': 'batch', 'SENSOR_ID': sensor_id, 'sent': [reading.get('sent') for reading in batch],
+                          'anomalies': len(anomalies), 'detected': detected}, verdict=True)
+
+    async def drain(self):
+        """
+        等待所有已接收的读数检测完毕
+        """
+        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+
+    # 订阅者 ---------------------------------------------------------------
+
+    def publish(self, message, verdict=False):
+        """
+        推送消息给订阅者；verdict 消息只发给订阅了逐批判定的订阅者。发送队列满时丢弃
+        """
+        text = None
+        for subscriber in self.subscribers.values():
+            if verdict and not subscriber['verdicts']:
+                continue
+            if text is None:
+                text = json.dumps(message, ensure_ascii=False, default=str)
+            try:
+                subscriber['queue'].put_nowait(text)
+            except asyncio.QueueFull:
+                self.stats['dropped_messages'] += 1
+
+    async def _subscribe(self, connection, verdicts):
+        queue = asyncio.Queue(maxsize=self.subscriber_queue_size)
+
+        async def sender():
+            while True:
+                await connection.send(await queue.get())
+
+        if connection in self.subscribers:
+            self.subscribers[connection]['verdicts'] = verdicts
+        else:
+            self.subscribers[connection] = {'queue': queue, 'verdicts': verdicts,
+                                            'task': asyncio.create_task(sender())}
+        await self._reply(connection, {'type': 'subscribed'})
+
+    async def _reply(self, connection, message):
+        # 订阅者的全部消息都经其发送队列，同一连接上不会并发写
+        text = json.dumps(message, ensure_ascii=False)
+        subscriber = self.subscribers.get(connection)
+        if subscriber is None:
+            await connection.send(text)
+        else:
+            await subscriber['queue'].put(text)
+
+    # 连接 -----------------------------------------------------------------
+
+    async def handle(self, connection):
+        """
+        处理一个连接上的全部消息，直到连接关闭
+        """
+        try:
+            async for text in connection.messages():
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    self.stats['invalid'] += 1
+                    continue
+                if not isinstance(message, dict):
+                    self.stats['invalid'] += 1
+                    continue
+                kind = message.get('type', 'reading')
+                if kind in ('subscribe', 'init'):
+                    await self._subscribe(connection, bool(message.get('verdicts', False)))
+                elif kind == 'readings':
+                    readings = message.get('readings')
+                    if not isinstance(readings, list):
+                        self.stats['invalid'] += 1
+                        continue
+                    for reading in readings:
+                        await self.submit(reading)
+                elif kind == 'reading':
+                    await self.submit(message)
+                elif kind == 'stats':
+                    await self._reply(connection, {'type': 'stats', 'sensors': len(self.queues), **self.stats})
+                else:
+                    self.stats['invalid'] += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except (ValueError, asyncio.LimitOverrunError):
+            # 单行超过读取上限（TCP 的 limit）时无法再按行分帧，计为无效消息并关闭连接
+            self.stats['invalid'] += 1
+        finally:
+            subscriber = self.subscribers.pop(connection, None)
+            if subscriber is not None:
+                subscriber['task'].cancel()
+
+    async def _handle_tcp(self, reader, writer):
+        try:
+            await self.handle(_TcpConnection(reader, writer))
+        finally:
+            writer.close()
+
+    async def _handle_websocket(self, websocket, *args):
+        await self.handle(_WebSocketConnection(websocket))
+
+    async def serve(self, host=DEFAULT_HOST, tcp_port=DEFAULT_TCP_PORT, ws_port=DEFAULT_WS_PORT, ready=None):
+        """
+        启动TCP与WebSocket监听并一直运行；ws_port 为None时只监听TCP，tcp_port 为None时只监听WebSocket
+        WebSocket 需要安装 websockets 库
+        :param ready: 可选 asyncio.Event，监听就绪后置位
+        """
+        servers = []
+        if tcp_port is not None:
+            servers.append(await asyncio.start_server(self._handle_tcp, host, tcp_port, limit=1 << 20))
+            print(f"TCP 接入: {host}:{tcp_port}")
+        if ws_port is not None:
+            try:
+                import websockets
+            except ImportError:
+                raise ImportError("WebSocket 接入需要 websockets 库（pip install websockets），"
+                                  "或设置 ws_port=None 只使用TCP")
+            servers.append(await websockets.serve(self._handle_websocket, host, ws_port))
+            print(f"WebSocket 接入: ws://{host}:{ws_port}")
+        if ready is not None:
+            ready.set()
+        try:
+            await asyncio.Future()
+        finally:
+            for server in servers:
+                server.close()
+            for task in self.workers.values():
+                task.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def _percentiles(latencies):
+    if len(latencies) == 0:
+        return None
+    values = np.asarray(latencies) * 1000.0
+    return {'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+
+async def replay(csv_file, host=DEFAULT_HOST, port=DEFAULT_TCP_PORT, speedup=None, encoding=None,
+                 timeout=60.0):
+    """
+    回放客户端：按MDATE顺序把合并后的月度csv（如 2022-07.csv）经TCP发送给服务，
+    另开一个订阅逐批判定的连接，统计端到端延迟（发送到收到判定）
+    :param csv_file: 含 MDATE、SENSOR_ID、M_RESULT 列的csv
+    :param speedup: 相对实时的加速倍数（如 3600 表示1小时数据1秒发完），为None时尽快发送
+    :param encoding: csv编码，为None时自动检测
+    :param timeout: 发送完毕后等待全部判定的最长秒数
+    :return: 统计结果 dict（读数数、判定数、异常数、发送耗时、吞吐量、延迟分位数 ms）
+    """
+    from csv_reader import read_sensor_csv
+
+    df = read_sensor_csv(csv_file, encoding=encoding)
+    df = df.sort_values(by='MDATE', kind='stable').reset_index(drop=True)
+    total = len(df)
+
+    sub_reader, sub_writer = await asyncio.open_connection(host, port, limit=1 << 24)
+    sub_writer.write(json.dumps({'type': 'subscribe', 'verdicts': True}).encode('utf-8') + b'\n')
+    await sub_writer.drain()
+    await sub_reader.readline()  # {"type": "subscribed"}
+
+    latencies, anomalies = [], []
+    done = asyncio.Event()
+
+    async def receive():
+        async for line in sub_reader:
+            received = time.time()
+            message = json.loads(line)
+            if message['type'] == 'batch':
+                latencies.extend(received - sent for sent in message['sent'] if sent is not None)
+                if len(latencies) >= total:
+                    done.set()
+            elif message['type'] == 'anomaly':
+                anomalies.append(message)
+
+    receiver = asyncio.create_task(receive())
+    pub_reader, pub_writer = await asyncio.open_connection(host, port)
+
+    mdate_text = df['MDATE'].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+    mdate_ns = df['MDATE'].to_numpy().astype('datetime64[ns]').view(np.int64)
+    sensor_ids = df['SENSOR_ID'].astype(str).to_numpy()
+    values = df['M_RESULT'].to_numpy(dtype=float)
+    bounds = np.flatnonzero(np.diff(mdate_ns)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [total]))
+
+    start = time.time()
+    for a, b in zip(starts, ends):
+        if speedup is not None:
+            delay = start + (mdate_ns[a] - mdate_ns[0]) / 1e9 / speedup - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sent = time.time()
+        readings = [{'SENSOR_ID': sensor_ids[k], 'MDATE': mdate_text[k], 'M_RESULT': values[k], 'sent': sent}
+                    for k in range(a, b)]
+        pub_writer.write(json.dumps({'type': 'readings', 'readings': readings}).encode('utf-8') + b'\n')
+        await pub_writer.drain()
+    send_time = time.time() - start
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout)
+    except asyncio.TimeoutError:
+        print(f"{timeout}s 内只收到 {len(latencies)}/{total} 条判定")
+    receiver.cancel()
+    pub_writer.close()
+    sub_writer.close()
+
+    report = {'readings': total, 'verdicts': len(latencies), 'anomalies': len(anomalies),
+              'send_s': send_time, 'throughput_per_s': total / send_time if send_time > 0 else None,
+              'speedup': speedup, 'latency_ms': _percentiles(latencies)}
+    print(json.dumps(report, ensure_ascii=False))
+    return report
+
+
+def run_service(host=DEFAULT_HOST, tcp_port=DEFAULT_TCP_PORT, ws_port=DEFAULT_WS_PORT, **kwargs):
+    """
+    启动服务（阻塞，Ctrl+C 退出）
+    :param kwargs: 传给 IngestService 的参数
+    """
+    try:
+        asyncio.run(IngestService(**kwargs).serve(host, tcp_port, ws_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_replay(csv_file, host=DEFAULT_HOST, port=DEFAULT_TCP_PORT, speedup=None, encoding=None, timeout=60.0):
+    return asyncio.run(replay(csv_file, host, port, speedup, encoding, timeout))
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import functools
+from contextlib import contextmanager
+
+
+# Environment variables carrying the active run into process-pool workers, whose stages
+# are appended to the same JSON-lines log
+LOG_ENV = 'DBSCAN_INSTRUMENT_LOG'
+RUN_ENV = 'DBSCAN_INSTRUMENT_RUN'
+
+# Seconds between RSS samples while a stage is running
+SAMPLE_INTERVAL = 0.05
+
+_lock = threading.Lock()
+_state = threading.local()
+_run = None
+
+
+def _current_rss():
+    """
+    Current resident set size of this process in bytes, or None where it cannot be read.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class _MemorySampler:
+    """
+    Background thread sampling the RSS of the process while a stage runs; ru_maxrss only
+    ever grows, so it cannot tell the peak of one stage from the peak of the whole run.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = _current_rss()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = _current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            rss = _current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+        return self.peak
+
+
+def _accumulate(stages, record):
+    stats = stages.setdefault(record['stage'], {'calls': 0, 'time_s': 0.0, 'rows': 0, 'peak_rss_bytes': None})
+    stats['calls'] += 1
+    stats['time_s'] += record['elapsed_s']
+    stats['rows'] += record.get('rows') or 0
+    peak = record.get('peak_rss_bytes')
+    if peak is not None and (stats['peak_rss_bytes'] is None or peak > stats['peak_rss_bytes']):
+        stats['peak_rss_bytes'] = peak
+
+
+def _add_rates(stages):
+    for stats in stages.values():
+        stats['rows_per_s'] = stats['rows'] / stats['time_s'] if stats['rows'] and stats['time_s'] > 0 else None
+    return stages
+
+
+class Run:
+    """
+    One instrumented run: JSON-lines log of every stage and event, per-stage aggregates
+    (calls, wall time, rows, peak RSS) and named counters.
+    """
+
+    def __init__(self, name, log_path=None, run_id=None, sample_memory=True):
+        self.name = name
+        self.log_path = log_path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.sample_memory = sample_memory
+        self.start = time.time()
+        self.stages = {}
+        self.counters = {}
+
+    def emit(self, record):
+        record = {'run': self.run_id, 'pid': os.getpid(), 'time': time.time(), **record}
+        if self.log_path is None:
+            return record
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        # One write per line in append mode, so lines from worker processes do not interleave
+        with _lock, open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+        return record
+
+    def add_stage(self, record):
+        with _lock:
+            _accumulate(self.stages, record)
+
+    def count(self, name, n=1):
+        with _lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+def active_run():
+    """
+    The run stages are recorded into: the one started by `run()` in this process, or the
+    parent's run inherited by a process-pool worker through the environment.
+    :return: Run, or None when instrumentation is off
+    """
+    global _run
+    if _run is None and os.environ.get(LOG_ENV):
+        _run = Run('worker', os.environ[LOG_ENV], os.environ.get(RUN_ENV))
+    return _run
+
+
+@contextmanager
+def stage(name, rows=None, **fields):
+    """
+    Time a pipeline stage and record it with its row count and peak RSS. Does nothing
+    when no run is active. Stages nest; the log records the parent stage.
+    Usage:
+        with stage('merge.read_xlsx') as s:
+            ...
+            s['rows'] = len(df)
+    :param name: stage name, '<step>.<part>' by convention
+    :param rows: rows processed, can also be set on the yielded dict
+    :param fields: extra fields written to the log record
+    """
+    current = active_run()
+    if current is None:
+        yield {}
+        return
+
+    parents = getattr(_state, 'stack', None)
+    if parents is None:
+        parents = _state.stack = []
+    record = {'event': 'stage', 'stage': name, 'parent': parents[-1] if parents else None, 'rows': rows}
+    record.update(fields)
+    sampler = _MemorySampler() if current.sample_memory else None
+    parents.append(name)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['elapsed_s'] = time.perf_counter() - start
+        parents.pop()
+        if sampler is not None:
+            record['peak_rss_bytes'] = sampler.stop()
+        current.add_stage(record)
+        current.emit(record)
+
+
+def instrumented(name=None, rows=None):
+    """
+    Decorator form of `stage`.
+    :param name: stage name, defaults to the function name
+    :param rows: optional callable (args, kwargs, result) -> row count
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if active_run() is None:
+                return func(*args, **kwargs)
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    record['rows'] = rows(args, kwargs, result)
+                return result
+        return wrapper
+    return decorator
+
+
+def log_event(event, **fields):
+    """
+    Write a structured event (e.g. one training epoch) to the run log when a run is active.
+    """
+    current = active_run()
+    if current is not None:
+        current.emit({'event': event, **fields})
+
+
+def count(name, n=1):
+    """
+    Add n to a named counter of the active run (files read, rows dropped, cache hits...).
+    """
+    current = active_run()
+    if current is not None:
+        current.count(name, n)
+        current.emit({'event': 'count', 'counter': name, 'n': n})
+
+
+def summarize(log_path, run_id=None):
+    """
+    Aggregate a JSON-lines log per stage, including stages recorded by worker processes.
+    :param log_path: log written by `run`
+    :param run_id: restrict to one run, defaults to the last run in the log
+    :return: {'run', 'stages': {name: {calls, time_s, rows, rows_per_s, peak_rss_bytes}}, 'counters'}
+    """
+    with open(log_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if run_id is None:
+        run_id = next((r['run'] for r in reversed(records)), None)
+
+    stages, counters = {}, {}
+    for record in records:
+        if record['run'] != run_id:
+            continue
+        if record['event'] == 'stage':
+            _accumulate(stages, record)
+        elif record['event'] == 'count':
+            counters[record['counter']] = counters.get(record['counter'], 0) + record['n']
+    return {'run': run_id, 'stages': _add_rates(stages), 'counters': counters}
+
+
+def format_summary(summary):
+    """
+    Plain-text table of a `summarize` result, slowest stage first.
+    """
+    lines = [f"Run {summary['run']}",
+             f"{'stage':<32}{'calls':>8}{'time_s':>12}{'rows':>12}{'rows/s':>14}{'peak_MB':>10}"]
+    for name, stats in sorted(summary['stages'].items(), key=lambda item: -item[1]['time_s']):
+        rate = f"{stats['rows_per_s']:.0f}" if stats['rows_per_s'] else '-'
+        peak = f"{stats['peak_rss_bytes'] / 2 ** 20:.0f}" if stats['peak_rss_bytes'] else '-'
+        lines.append(f"{name:<32}{stats['calls']:>8}{stats['time_s']:>12.3f}{stats['rows']:>12}{rate:>14}{peak:>10}")
+    for name, value in sorted(summary['counters'].items()):
+        lines.append(f"counter {name}: {value}")
+    return '\n'.join(lines)
+
+
+@contextmanager
+def run(name, log_path=None, profile=False, profile_path=None, report=True, sample_memory=True):
+    """
+    Enable instrumentation for the enclosed code. Stages, events and counters go to the
+    JSON-lines file `log_path` (also from process-pool workers started inside the block,
+    through the environment); a per-stage summary is printed and logged at the end.
+    Usage:
+        with run('merge', 'merge_log.jsonl'):
+            merge_month_folders(...)
+    :param name: run name
+    :param log_path: JSON-lines log file, None keeps the records in memory only
+    :param profile: also run cProfile over the block
+    :param profile_path: where to dump the cProfile stats (snakeviz / pstats), default
+                         '<log_path>.prof'; for sampling profilers such as py-spy attach
+                         to the pid written in every record instead
+    :param report: print the summary table at the end
+    :param sample_memory: sample RSS in a background thread during every stage
+    :return: the Run object
+    """
+    global _run
+    previous = _run, os.environ.get(LOG_ENV), os.environ.get(RUN_ENV)
+    current = Run(name, log_path, sample_memory=sample_memory)
+    _run = current
+    if log_path is not None:
+        os.environ[LOG_ENV] = os.path.abspath(log_path)
+        os.environ[RUN_ENV] = current.run_id
+    current.emit({'event': 'run_start', 'name': name, 'argv': sys.argv})
+
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield current
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_path = profile_path or (f"{log_path}.prof" if log_path else f"{name}.prof")
+            profiler.dump_stats(profile_path)
+            current.emit({'event': 'profile', 'path': profile_path})
+
+        _run = previous[0]
+        for key, value in ((LOG_ENV, previous[1]), (RUN_ENV, previous[2])):
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+        if log_path is not None:
+            summary = summarize(log_path, current.run_id)
+        else:
+            summary = {'run': current.run_id, 'stages': _add_rates(current.stages), 'counters': current.counters}
+        summary['wall_time_s'] = time.time() - current.start
+        current.summary = summary
+        current.emit({'event': 'run_end', 'name': name, 'summary': summary})
+        if report:
+            print(format_summary(summary))
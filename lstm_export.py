@@ -0,0 +1,224 @@
+import os
+import io
+import glob
+import json
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+from lstm_prediction import (PREDICT_BATCH_SIZE, ModelRegistry, get_registry, load_sorted_sensor_data,
+                             predict_from_registry)
+from instrumentation import stage, count
+
+
+# Export variants: TorchScript of the float32 model, and TorchScript of the model with
+# dynamically quantized int8 nn.LSTM / nn.Linear weights
+EXPORT_VARIANTS = ('script', 'int8')
+
+# Largest |exported - eager| prediction accepted, in scaled units (fraction of the sensor's range)
+EXPORT_TOLERANCE = {'script': 1e-5, 'int8': 1e-2}
+
+# Windows of the sensor's own data used to verify and time an export
+VERIFY_WINDOWS = 4096
+
+
+# Path of an exported model next to the registry files of the sensor
+def export_path(model_folder, sensor_id, variant):
+    return os.path.join(model_folder, f'{sensor_id}_model.{variant}.pt')
+
+
+# Compile a trained LSTM to a frozen TorchScript module; 'int8' first applies dynamic
+# quantization (int8 weights, activations quantized on the fly) to its LSTM and Linear layers.
+# The eager model is not modified.
+def compile_model(model, variant='script'):
+    if variant not in EXPORT_VARIANTS:
+        raise ValueError(f"variant must be one of {EXPORT_VARIANTS}")
+    model.eval()
+    if variant == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    return torch.jit.freeze(torch.jit.script(model))
+
+
+# Up to n evenly spaced windows of a scaled series, shaped (n, time_step, 1)
+def sample_windows(series_scaled, time_step, n=VERIFY_WINDOWS):
+    series = np.asarray(series_scaled, dtype=np.float32).reshape(-1)
+    windows = np.lib.stride_tricks.sliding_window_view(series, time_step)
+    index = np.unique(np.linspace(0, len(windows) - 1, min(n, len(windows))).astype(np.intp))
+    return torch.from_numpy(np.ascontiguousarray(windows[index])).unsqueeze(-1)
+
+
+def _predict(model, windows, batch_size):
+    with torch.no_grad():
+        return torch.cat([model(windows[start_index:start_index + batch_size])
+                          for start_index in range(0, len(windows), batch_size)]).squeeze(1).numpy()
+
+
+# Mean seconds per forward pass on one batch, after a warm-up pass
+def _time_forward(model, batch, repeats):
+    with torch.no_grad():
+        model(batch)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+    return (time.perf_counter() - start) / repeats
+
+
+# Serialized size in bytes: the state dict of an eager model, the archive of a TorchScript module
+def _model_bytes(model):
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+    else:
+        torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+# Compare an exported model with the eager one on the same windows: largest prediction
+# difference, latency of a single window (the old per-point inference) and of a full
+# batch, and model size
+def compare_models(eager, exported, windows, batch_size=PREDICT_BATCH_SIZE, repeats=10):
+    eager.eval()
+    reference = _predict(eager, windows, batch_size)
+    predictions = _predict(exported, windows, batch_size)
+    batch = windows[:batch_size]
+    report = {'windows': len(windows), 'batch_size': len(batch),
+              'max_abs_error': float(np.max(np.abs(predictions - reference)))}
+    for name, model in (('eager', eager), ('exported', exported)):
+        report[f'{name}_single_ms'] = _time_forward(model, windows[:1], repeats * 20) * 1e3
+        report[f'{name}_batch_ms'] = _time_forward(model, batch, repeats) * 1e3
+        report[f'{name}_bytes'] = _model_bytes(model)
+    report['single_speedup'] = report['eager_single_ms'] / report['exported_single_ms']
+    report['batch_speedup'] = report['eager_batch_ms'] / report['exported_batch_ms']
+    report['size_ratio'] = report['exported_bytes'] / report['eager_bytes']
+    return report
+
+
+def _write_metadata(model_folder, sensor_id, metadata):
+    with open(os.path.join(model_folder, f'{sensor_id}_model.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+
+
+# Compile the registered model of one sensor, verify it against the eager model on windows of
+# the sensor's own data and save it to {sensor_id}_model.{variant}.pt. The comparison is
+# recorded under 'exports' in the registry metadata; an export outside the tolerance is
+# rejected and any earlier artifact of that variant is removed.
+def export_sensor_model(sensor_id, save_folder, model_folder, variant='script', tolerance=None, registry=None,
+                        data_folders=None):
+    registry = registry if registry is not None else get_registry(model_folder)
+    tolerance = EXPORT_TOLERANCE[variant] if tolerance is None else tolerance
+    report = {'sensor_id': sensor_id, 'variant': variant, 'status': 'missing', 'tolerance': tolerance}
+    entry = registry.load(sensor_id)
+    if entry is None:
+        print(f'No registered model for sensor {sensor_id} in {model_folder}')
+        return report
+    model, scaler, metadata = entry
+    sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+    if len(sensor_series) < metadata['time_step']:
+        report['status'] = 'no data'
+        return report
+
+    sensor_data_scaled = scaler.transform(sensor_series.values.reshape(-1, 1))
+    windows = sample_windows(sensor_data_scaled, metadata['time_step'])
+    exported = compile_model(model, variant)
+    report.update(compare_models(model, exported, windows))
+    # Same error in the sensor's own units
+    report['max_abs_error_units'] = report['max_abs_error'] / float(scaler.scale_[0])
+
+    path = export_path(model_folder, sensor_id, variant)
+    exports = metadata.setdefault('exports', {})
+    if report['max_abs_error'] > tolerance:
+        report['status'] = 'rejected'
+        exports.pop(variant, None)
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"{variant} export of sensor {sensor_id} rejected: max error {report['max_abs_error']:.2e} "
+              f"> tolerance {tolerance:.0e}")
+    else:
+        torch.jit.save(exported, path)
+        report['status'] = 'exported'
+        report['path'] = os.path.basename(path)
+        exports[variant] = {key: value for key, value in report.items() if key not in ('sensor_id', 'status')}
+    _write_metadata(model_folder, sensor_id, metadata)
+    return report
+
+
+# Registered sensors of a model folder (those with registry metadata)
+def registered_sensors(model_folder):
+    suffix = '_model.json'
+    return sorted(os.path.basename(path)[:-len(suffix)] for path in glob.glob(os.path.join(model_folder, '*' + suffix)))
+
+
+def print_export_summary(reports):
+    print(f"{'sensor':<8}  {'variant':<7} {'status':<9} {'max error':>10}  {'single ms':>15}  "
+          f"{'batch ms':>17}  {'size KB':>13}")
+    for report in reports:
+        if 'max_abs_error' not in report:
+            print(f"{report['sensor_id']:<8}  {report['variant']:<7} {report['status']:<9}")
+            continue
+        print(f"{report['sensor_id']:<8}  {report['variant']:<7} {report['status']:<9} "
+              f"{report['max_abs_error']:>10.2e}  "
+              f"{report['eager_single_ms']:>6.3f} -> {report['exported_single_ms']:<6.3f} "
+              f"{report['eager_batch_ms']:>7.2f} -> {report['exported_batch_ms']:<7.2f} "
+              f"{report['eager_bytes'] / 1024:>5.0f} -> {report['exported_bytes'] / 1024:<5.0f}")
+    for variant in EXPORT_VARIANTS:
+        compared = [report for report in reports if report['variant'] == variant and 'max_abs_error' in report]
+        if compared:
+            print(f"{variant}: single-window speedup x{np.mean([r['single_speedup'] for r in compared]):.2f}, "
+                  f"batch speedup x{np.mean([r['batch_speedup'] for r in compared]):.2f}, "
+                  f"size x{np.mean([r['size_ratio'] for r in compared]):.2f} "
+                  f"over {len(compared)} sensors")
+
+
+# Export the registered models of all (or the given) sensors in each variant and print
+# the accuracy, latency and size comparison with the eager models
+def export_registry(save_folder, model_folder, sensor_ids=None, variants=('script',), tolerance=None,
+                    data_folders=None):
+    registry = get_registry(model_folder)
+    sensor_ids = registered_sensors(model_folder) if sensor_ids is None else sensor_ids
+    reports = []
+    for sensor_id in sensor_ids:
+        for variant in variants:
+            with stage('export.sensor', sensor_id=sensor_id, variant=variant) as record:
+                report = export_sensor_model(sensor_id, save_folder, model_folder, variant, tolerance, registry,
+                                             data_folders)
+                record['status'] = report['status']
+            count(f"export.{report['status']}")
+            reports.append(report)
+    print_export_summary(reports)
+    return reports
+
+
+# Registry of exported models with the ModelRegistry interface, so predict_from_registry runs
+# batched inference from the artifacts (scaler and time_step come from the registry metadata).
+# A sensor whose metadata lists no export of the variant, e.g. because the model has been
+# retrained since, has no entry.
+class ExportedModelRegistry(ModelRegistry):
+    def __init__(self, model_folder, variant='script', capacity=8):
+        super().__init__(model_folder, capacity)
+        self.variant = variant
+
+    def _paths(self, sensor_id):
+        _, metadata_path = super()._paths(sensor_id)
+        return export_path(self.model_folder, sensor_id, self.variant), metadata_path
+
+    def _load_model(self, model_path, metadata):
+        return torch.jit.load(model_path)
+
+    def load(self, sensor_id):
+        metadata = self.metadata(sensor_id)
+        if metadata is None or self.variant not in metadata.get('exports', {}):
+            return None
+        return super().load(sensor_id)
+
+
+# Predict-only imputation with the exported models of one variant
+def predict_from_exports(anomaly_file, save_folder, model_folder, variant='script', data_folders=None):
+    return predict_from_registry(anomaly_file, save_folder, model_folder,
+                                 registry=ExportedModelRegistry(model_folder, variant), data_folders=data_folders)
+
+
+if __name__ == "__main__":
+    # Export float TorchScript and int8 models of every trained sensor, then impute from the int8 ones
+    export_registry('./merge', './models', variants=EXPORT_VARIANTS)
+    # predict_from_exports('./anomaly/anomaly_info.csv', './merge', './models', variant='int8')
@@ -4,9 +4,19 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import DataLoader, Dataset, TensorDataset
 from sklearn.preprocessing import MinMaxScaler
 import glob
+import time
+import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sensor_store import build_sensor_store, load_sensor_data
+from sensor_archive import SensorArchive, build_sensor_archive
+from series_store import SensorSeries
+from csv_reader import list_csv_files, iter_sensor_csv, read_sensor_csv
+from instrumentation import stage, count, log_event, run
 
 
 # Define the LSTM model
@@ -23,382 +33,725 @@ class LSTM(nn.Module):
         return predictions
 
 
-# Create dataset function
-def create_dataset(data, time_step=1):
-    X, Y = [], []
-    for i in range(len(data) - time_step - 1):
-        a = data[i:(i + time_step), 0]
-        X.append(a)
-        Y.append(data[i + time_step, 0])
+# Number of (window, target) pairs in a series; the legacy loop stopped one window early
+def num_windows(length, time_step, legacy_off_by_one=True):
+    return max(length - time_step - (1 if legacy_off_by_one else 0), 0)
+
+
+# Create dataset function; data is a (N, 1) column or a 1-D series (e.g. a SensorSeries view)
+def create_dataset(data, time_step=1, legacy_off_by_one=True):
+    n = num_windows(len(data), time_step, legacy_off_by_one)
+    if n == 0:
+        return np.array([]), np.array([])
+    data = np.asarray(data)
+    series = data[:, 0] if data.ndim == 2 else data
+    X = np.lib.stride_tricks.sliding_window_view(series, time_step)[:n]
+    Y = series[time_step:time_step + n]
     return np.array(X), np.array(Y)
 
 
-# Function to process and save sensor data for a specific sensor ID
-def process_and_save_sensor_data(directory, sensor_id, save_directory):
-    # Ensure the save directory exists
-    os.makedirs(save_directory, exist_ok=True)
+# Sliding-window dataset over a series: windows are a strided view (Tensor.unfold),
+# so the (N, time_step) matrix is never materialized; indexing with a slice returns views,
+# indexing with an index tensor gathers only the requested batch.
+# A 1-D series gives (N, time_step) windows and (N,) targets; a (time, sensor) matrix, also
+# with a single column, gives (N, time_step, sensors) windows and (N, sensors) targets.
+class SlidingWindowDataset(Dataset):
+    def __init__(self, data, time_step=10, legacy_off_by_one=True):
+        data = np.asarray(data, dtype=np.float32)
+        self.multichannel = data.ndim == 2
+        series = torch.as_tensor(np.ascontiguousarray(data if self.multichannel else data.reshape(-1)))
+        n = num_windows(len(series), time_step, legacy_off_by_one)
+        self.series = series
+        self.time_step = time_step
+        if n > 0:
+            windows = series.unfold(0, time_step, 1)[:n]
+            self.windows = windows.transpose(1, 2) if self.multichannel else windows
+        else:
+            self.windows = series.new_empty((0, time_step) + tuple(series.shape[1:]))
+        self.targets = series[time_step:time_step + n]
+
+    def __len__(self):
+        return len(self.targets)
 
-    # Initialize DataFrame for the sensor ID
-    sensor_data_df = pd.DataFrame()
+    def __getitem__(self, idx):
+        if self.multichannel:
+            return self.windows[idx], self.targets[idx]
+        return self.windows[idx].unsqueeze(-1), self.targets[idx]
 
-    all_files = []
-    # List all CSV files in the given directory
-    for subdir, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.csv'):
-                file_path = os.path.join(subdir, file)
-                all_files.append(file_path)
 
-    for file in all_files:
-        # Read the current file
-        df = pd.read_csv(file,encoding='gb2312')
-        df['MDATE'] = pd.to_datetime(df['MDATE'])
+# Function to process and save sensor data for a specific sensor ID
+def process_and_save_sensor_data(directory, sensor_id, save_directory, store_directory=None):
+    # Ensure the save directory exists
+    os.makedirs(save_directory, exist_ok=True)
 
-        # Filter data for the sensor ID and append to the DataFrame
-        if sensor_id in df['SENSOR_ID'].values:
-            filtered_data = df[df['SENSOR_ID'] == sensor_id]
-            sensor_data_df = pd.concat([sensor_data_df, filtered_data], ignore_index=True)
+    if store_directory is not None:
+        # Ingest the raw tree once into the columnar store, then read only this sensor's partitions
+        with stage('extract.build_store'):
+            build_sensor_store(directory, store_directory)
+        with stage('extract.load_store', sensor_id=sensor_id) as record:
+            sensor_data_df = load_sensor_data(store_directory, sensor_id)
+            record['rows'] = len(sensor_data_df)
+    else:
+        # Slices of the sensor from every file, concatenated once at the end
+        pieces = []
+
+        for file in list_csv_files(directory):
+            # Stream the file in chunks, keeping only this sensor's rows (encoding detected per file)
+            with stage('extract.read_csv', file=file) as record:
+                kept = len(pieces)
+                pieces.extend(iter_sensor_csv(file, sensor_ids=sensor_id))
+                record['rows'] = sum(len(piece) for piece in pieces[kept:])
+            count('extract.files_read')
+        sensor_data_df = pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame()
 
     # Save the sorted sensor data to a CSV file in the designated save directory if not empty
     if not sensor_data_df.empty:
-        sensor_data_df = sensor_data_df.sort_values(by='MDATE').reset_index(drop=True)
-        file_path = os.path.join(save_directory, f"{sensor_id}_sorted_data.csv")
-        sensor_data_df.to_csv(file_path, index=False)
+        with stage('extract.sort_save', rows=len(sensor_data_df), sensor_id=sensor_id):
+            sensor_data_df = sensor_data_df.sort_values(by='MDATE').reset_index(drop=True)
+            file_path = os.path.join(save_directory, f"{sensor_id}_sorted_data.csv")
+            sensor_data_df.to_csv(file_path, index=False)
         print(f"Sorted data for sensor {sensor_id} saved to {file_path}")
 
     return sensor_data_df
 
 
-# LSTM training and prediction function
-def train_and_predict_lstm(anomaly_file, save_folder, model_folder):
-    anomaly_df = pd.read_csv(anomaly_file)
-    anomaly_df['MDATE'] = pd.to_datetime(anomaly_df['MDATE'])
-    anomaly_df = anomaly_df.sort_values(by=['MDATE']).reset_index(drop=True)
-    anomaly_sensor_ids = anomaly_df['SENSOR_ID'].unique()
-
-    for sensor_id in anomaly_sensor_ids:
+# Default settings of the LSTM training engine
+DEFAULT_TRAIN_CONFIG = {
+    'batch_size': 64,      # windows per optimizer step
+    'epochs': 20,          # upper bound on passes over the training split
+    'shuffle': True,       # reshuffle training windows every epoch
+    'lr': 0.001,
+    'patience': 3,         # stop after this many epochs without validation improvement (None disables)
+    'num_threads': None,   # torch.set_num_threads, None keeps the torch default
+    'seed': None,
+}
+
+# Windows per forward pass when evaluating the held-out split
+VAL_BATCH_SIZE = 4096
+
+
+# Mini-batch training engine with early stopping on the held-out split
+def train_lstm(model, X_train, Y_train, X_test=None, Y_test=None, train_config=None, sensor_id='',
+               checkpoint_path=None):
+    config = dict(DEFAULT_TRAIN_CONFIG, **(train_config or {}))
+    if config['num_threads'] is not None:
+        torch.set_num_threads(config['num_threads'])
+    generator = None
+    if config['seed'] is not None:
+        torch.manual_seed(config['seed'])
+        generator = torch.Generator().manual_seed(config['seed'])
+
+    loss_function = nn.MSELoss()
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+    batch_size = config['batch_size']
+    validate = X_test is not None and len(X_test) > 0
+
+    history = []
+    best_loss, best_state, stale_epochs, stopped = float('inf'), None, 0, False
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        # Resume an interrupted run from its last completed epoch
+        checkpoint = torch.load(checkpoint_path)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        history, best_loss, best_state = checkpoint['history'], checkpoint['best_loss'], checkpoint['best_state']
+        stale_epochs, stopped = checkpoint['stale_epochs'], checkpoint['stopped']
+        if generator is not None:
+            generator.set_state(checkpoint['generator'])
+        print(f"{sensor_id} resuming from checkpoint after epoch {len(history)}")
+
+    for epoch in range(len(history), config['epochs']):
+        if stopped:
+            break
+        start = time.perf_counter()
+        model.train()
+        total_loss = 0.0
+        # Index batches gather only batch_size windows at a time, so X_train may be a window view
+        if config['shuffle']:
+            order = torch.randperm(len(X_train), generator=generator)
+        else:
+            order = torch.arange(len(X_train))
+        for batch in order.split(batch_size):
+            seq, labels = X_train[batch], Y_train[batch]
+            optimizer.zero_grad()
+            y_pred = model(seq)
+            loss = loss_function(y_pred, labels.view_as(y_pred))
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(seq)
+        train_time = time.perf_counter() - start
+
+        record = {
+            'epoch': epoch + 1,
+            'train_loss': total_loss / max(len(X_train), 1),
+            'val_loss': None,
+            'epoch_time_s': train_time,
+            'samples_per_s': len(X_train) / train_time if train_time > 0 else float('inf'),
+        }
+        if validate:
+            model.eval()
+            with torch.no_grad():
+                val_loss = 0.0
+                for start_index in range(0, len(X_test), VAL_BATCH_SIZE):
+                    seq = X_test[start_index:start_index + VAL_BATCH_SIZE]
+                    labels = Y_test[start_index:start_index + VAL_BATCH_SIZE]
+                    y_pred = model(seq)
+                    val_loss += loss_function(y_pred, labels.view_as(y_pred)).item() * len(seq)
+                record['val_loss'] = val_loss / len(X_test)
+        history.append(record)
+        log_event('epoch', sensor_id=sensor_id, **record)
+        val_text = f", val loss: {record['val_loss']:.6f}" if validate else ''
+        print(f"{sensor_id} Epoch {epoch + 1} loss: {record['train_loss']:.6f}{val_text} "
+              f"({record['epoch_time_s']:.2f}s, {record['samples_per_s']:.0f} samples/s)")
+
+        # Early stopping on the held-out split, keeping the best weights
+        if validate and config['patience'] is not None:
+            if record['val_loss'] < best_loss:
+                best_loss, stale_epochs = record['val_loss'], 0
+                best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            else:
+                stale_epochs += 1
+                if stale_epochs >= config['patience']:
+                    print(f"{sensor_id} early stopping at epoch {epoch + 1}")
+                    stopped = True
+
+        if checkpoint_path is not None:
+            checkpoint = {
+                'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'history': history,
+                'best_loss': best_loss, 'best_state': best_state, 'stale_epochs': stale_epochs,
+                'stopped': stopped, 'generator': generator.get_state() if generator is not None else None,
+            }
+            torch.save(checkpoint, checkpoint_path + '.tmp')
+            os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    model.eval()
+    return model, history
+
+
+# Windows per forward pass when imputing anomalies
+PREDICT_BATCH_SIZE = 4096
+
+
+# Batched imputation of anomaly points: map all anomaly timestamps to positions with one
+# searchsorted over the sorted MDATE column, stack every window with enough history and
+# run chunked no_grad forward passes. Returns the anomalies with a 'Prediction' column and
+# the skipped anomalies with a 'Skip_reason' column.
+def impute_anomalies(model, scaler, sensor_data, sensor_data_scaled, anomalies, time_step=10,
+                     batch_size=PREDICT_BATCH_SIZE):
+    anomalies = anomalies.copy()
+    positions, found, enough_history = locate_anomalies(sensor_data, anomalies, time_step)
+
+    series = np.asarray(sensor_data_scaled, dtype=np.float32).reshape(-1)
+    valid_positions = positions[enough_history]
+    predictions = np.empty(len(valid_positions), dtype=np.float32)
+    if len(valid_positions) > 0:
+        windows = np.lib.stride_tricks.sliding_window_view(series, time_step)
+        model.eval()
+        with torch.no_grad():
+            for start_index in range(0, len(valid_positions), batch_size):
+                chunk = valid_positions[start_index:start_index + batch_size] - time_step
+                sequence_tensor = torch.from_numpy(np.ascontiguousarray(windows[chunk])).unsqueeze(-1)
+                predictions[start_index:start_index + len(chunk)] = model(sequence_tensor).squeeze(1).numpy()
+
+        predictions = scaler.inverse_transform(predictions.reshape(-1, 1).astype(np.float64))[:, 0]
+
+    return fill_predictions(anomalies, found, enough_history, predictions, time_step)
+
+
+# Positions of the anomaly timestamps in the sorted sensor data (one searchsorted), whether
+# each was found and whether it has at least time_step preceding points
+def locate_anomalies(sensor_data, anomalies, time_step):
+    times, _ = sensor_arrays(sensor_data)
+    targets = pd.to_datetime(anomalies['MDATE']).to_numpy()
+
+    positions = np.searchsorted(times, targets, side='left')
+    found = positions < len(times)
+    found[found] = times[positions[found]] == targets[found]
+    enough_history = found & (positions >= time_step)
+    return positions, found, enough_history
+
+
+# Write predictions for the imputable anomalies and split off the skipped ones with a reason
+def fill_predictions(anomalies, found, enough_history, predictions, time_step):
+    anomalies['Prediction'] = np.nan
+    anomalies.loc[anomalies.index[enough_history], 'Prediction'] = predictions
+
+    skipped = anomalies.loc[~enough_history].drop(columns='Prediction')
+    skipped['Skip_reason'] = np.where(found[~enough_history],
+                                      f'fewer than {time_step} preceding points', 'MDATE not found in sensor data')
+    return anomalies, skipped
+
+
+# Read the anomaly table produced by the detection stage
+def read_anomaly_file(anomaly_file):
+    anomaly_df = read_sensor_csv(anomaly_file, usecols=None)
+    return anomaly_df.sort_values(by=['MDATE']).reset_index(drop=True)
+
+
+# MDATE (datetime64[ns]) and M_RESULT arrays of a sensor's data, given as a SensorSeries
+# (views, nothing is copied) or as a DataFrame with those columns
+def sensor_arrays(sensor_data):
+    if isinstance(sensor_data, SensorSeries):
+        return sensor_data.mdate, sensor_data.values
+    return (pd.to_datetime(sensor_data['MDATE']).to_numpy().astype('datetime64[ns]'),
+            sensor_data['M_RESULT'].to_numpy())
+
+
+# Raw data, sensor store and archive folders sensor data is loaded from: the given
+# data_folders entries, the module defaults for those missing or None. The folders travel
+# as arguments, so worker processes see the same ones whatever the start method.
+def resolve_data_folders(data_folders=None):
+    folders = {'data_directory': data_directory, 'store_directory': store_directory,
+               'archive_directory': archive_directory}
+    folders.update({key: value for key, value in (data_folders or {}).items() if value is not None})
+    return folders
+
+
+# Load the time-sorted data of one sensor (optionally only start <= MDATE <= end) as a
+# SensorSeries: a memory-mapped view of the sensor archive if it holds the sensor, so no
+# frame of the whole history is built, else read from its sorted CSV or the raw data
+def load_sorted_sensor_data(sensor_id, save_folder, start=None, end=None, data_folders=None):
+    folders = resolve_data_folders(data_folders)
+    archive_folder = folders['archive_directory']
+    if archive_folder is not None and os.path.exists(os.path.join(archive_folder, 'manifest.json')):
+        archive = SensorArchive(archive_folder)
+        if sensor_id in archive:
+            print(f"Opening sensor {sensor_id} from archive {archive_folder}")
+            return archive.open(sensor_id, start, end)
+
+    sorted_data_path = os.path.join(save_folder, f"{sensor_id}_sorted_data.csv")
+    if os.path.exists(sorted_data_path):
+        print(f"Reading sorted data from {sorted_data_path}")
+        sensor_data_df = read_sensor_csv(sorted_data_path, usecols=None)
+    else:
+        print(f"No sorted data file found for sensor {sensor_id}, processing data...")
+        sensor_data_df = process_and_save_sensor_data(folders['data_directory'], sensor_id, save_folder,
+                                                      store_directory=folders['store_directory'])
+    if sensor_data_df.empty:
+        return SensorSeries(sensor_id, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    mdate, values = sensor_arrays(sensor_data_df)
+    series = SensorSeries(sensor_id, mdate.view(np.int64), values)
+    if start is not None or end is not None:
+        series = series.between(start, end)
+    return series
+
+
+# Hash of a sensor's training series (timestamps and values), stored with its model so a
+# registered model can be matched against the current data. Values are hashed as float32,
+# the precision of the sensor archive, so the same readings hash alike whether they come
+# from a sorted CSV (float64) or the archive
+def sensor_data_hash(sensor_data):
+    mdate, values = sensor_arrays(sensor_data)
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(mdate).view(np.int64).tobytes())
+    h.update(np.asarray(values, dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+
+def _scaler_to_dict(scaler):
+    return {
+        'feature_range': list(scaler.feature_range),
+        'data_min_': scaler.data_min_.tolist(),
+        'data_max_': scaler.data_max_.tolist(),
+        'n_samples_seen_': int(np.max(scaler.n_samples_seen_)),
+    }
+
+
+def _scaler_from_dict(params):
+    scaler = MinMaxScaler(feature_range=tuple(params['feature_range']))
+    # partial_fit on the stored extremes restores data_min_/data_max_, scale_ and min_ exactly
+    scaler.partial_fit(np.array([params['data_min_'], params['data_max_']], dtype=np.float64))
+    scaler.n_samples_seen_ = params['n_samples_seen_']
+    return scaler
+
+
+# Save a trained per-sensor model to the registry: weights in {sensor_id}_model.pth and the
+# fitted scaler, time_step, model size and training-data hash in {sensor_id}_model.json
+def register_model(model_folder, sensor_id, model, scaler, time_step, data_hash):
+    os.makedirs(model_folder, exist_ok=True)
+    model_save_path = os.path.join(model_folder, f'{sensor_id}_model.pth')
+    torch.save(model.state_dict(), model_save_path)
+    metadata = {
+        'sensor_id': sensor_id,
+        'time_step': time_step,
+        'hidden_layer_size': model.hidden_layer_size,
+        'scaler': _scaler_to_dict(scaler),
+        'data_hash': data_hash,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(os.path.join(model_folder, f'{sensor_id}_model.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+    return model_save_path
+
+
+# Registry of saved per-sensor models with a bounded in-process LRU cache of loaded
+# (model, scaler, metadata) entries; cached entries are reloaded if their files change
+class ModelRegistry:
+    def __init__(self, model_folder, capacity=8):
+        self.model_folder = model_folder
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, sensor_id):
+        return (os.path.join(self.model_folder, f'{sensor_id}_model.pth'),
+                os.path.join(self.model_folder, f'{sensor_id}_model.json'))
+
+    def metadata(self, sensor_id):
+        _, metadata_path = self._paths(sensor_id)
+        if not os.path.exists(metadata_path):
+            return None
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    # Returns (model, scaler, metadata), or None if the sensor has no registered model
+    def load(self, sensor_id):
+        model_path, metadata_path = self._paths(sensor_id)
+        if not (os.path.exists(model_path) and os.path.exists(metadata_path)):
+            return None
+        stamp = (os.path.getmtime(model_path), os.path.getmtime(metadata_path))
+
+        cached = self._cache.get(sensor_id)
+        if cached is not None and cached[0] == stamp:
+            self._cache.move_to_end(sensor_id)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        metadata = self.metadata(sensor_id)
+        entry = (self._load_model(model_path, metadata), _scaler_from_dict(metadata['scaler']), metadata)
+
+        self._cache[sensor_id] = (stamp, entry)
+        self._cache.move_to_end(sensor_id)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return entry
+
+    # Eager LSTM from the saved state dict
+    def _load_model(self, model_path, metadata):
+        model = LSTM(hidden_layer_size=metadata['hidden_layer_size'])
+        model.load_state_dict(torch.load(model_path))
+        model.eval()
+        return model
+
+    def clear(self):
+        self._cache.clear()
+
+
+_registries = {}
+
+
+# Shared registry per model folder, so repeated runs in one process reuse the hot models
+def get_registry(model_folder, capacity=8):
+    key = os.path.abspath(model_folder)
+    if key not in _registries:
+        _registries[key] = ModelRegistry(model_folder, capacity)
+    return _registries[key]
+
+
+def save_imputed_anomalies(sensor_id, anomalies, skipped, save_folder, suffix=''):
+    if not skipped.empty:
+        skipped_file = os.path.join(save_folder, f'{sensor_id}_anomaly_skipped{suffix}.csv')
+        skipped.to_csv(skipped_file, index=False, encoding='utf-8')
+        print(f'{len(skipped)} of {len(anomalies)} anomalies skipped for sensor {sensor_id}, '
+              f'listed in {skipped_file}')
+
+    # Save completed anomaly data
+    anomaly_completed_file = os.path.join(save_folder, f'{sensor_id}_anomaly_completed{suffix}.csv')
+    anomalies.to_csv(anomaly_completed_file, index=False, encoding='utf-8')
+    print(f'Anomaly data saved for sensor {sensor_id} at {anomaly_completed_file}')
+
+
+# Train (or reuse) the model of one sensor and impute its anomalies; returns a summary record
+def train_and_predict_sensor(sensor_id, anomalies, save_folder, model_folder, train_config=None,
+                             skip_fresh=False, data_folders=None):
+    start = time.perf_counter()
+    summary = {'sensor_id': sensor_id, 'status': 'no data', 'epochs': 0, 'wall_time_s': 0.0}
+
+    with stage('train.load_data', sensor_id=sensor_id) as record:
+        sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+        record['rows'] = len(sensor_series)
+    if len(sensor_series) > 0:
+        sensor_data = sensor_series.values
+        time_step = 10
+        data_hash = sensor_data_hash(sensor_series)
+
+        model_save_path = os.path.join(model_folder, f'{sensor_id}_model.pth')
+        checkpoint_path = os.path.join(model_folder, f'{sensor_id}_checkpoint.pth')
         sorted_data_path = os.path.join(save_folder, f"{sensor_id}_sorted_data.csv")
-        if os.path.exists(sorted_data_path):
-            print(f"Reading sorted data from {sorted_data_path}")
-            sensor_data_df = pd.read_csv(sorted_data_path)
+        registry = get_registry(model_folder)
+        entry = registry.load(sensor_id) if skip_fresh else None
+
+        if entry is not None and entry[2]['data_hash'] == data_hash and entry[2]['time_step'] == time_step:
+            # The registered model was trained on exactly this data, reuse it with its scaler
+            model, scaler, _ = entry
+            sensor_data_scaled = scaler.transform(sensor_data.reshape(-1, 1))
+            summary['status'] = 'reused'
+            print(f'Reusing registered model for sensor {sensor_id} from {model_save_path}')
+        elif skip_fresh and registry.metadata(sensor_id) is None and os.path.exists(model_save_path) \
+                and os.path.exists(sorted_data_path) \
+                and os.path.getmtime(model_save_path) > os.path.getmtime(sorted_data_path):
+            # Model saved without registry metadata but newer than its input data, reuse it
+            scaler = MinMaxScaler(feature_range=(0, 1))
+            sensor_data_scaled = scaler.fit_transform(sensor_data.reshape(-1, 1))
+            model = LSTM()
+            model.load_state_dict(torch.load(model_save_path))
+            model.eval()
+            summary['status'] = 'reused'
+            print(f'Reusing model for sensor {sensor_id} from {model_save_path}')
         else:
-            print(f"No sorted data file found for sensor {sensor_id}, processing data...")
-            sensor_data_df = process_and_save_sensor_data(data_directory, sensor_id, save_folder)
-
-        if not sensor_data_df.empty:
-            sensor_data = sensor_data_df['M_RESULT'].values
+            summary['status'] = 'resumed' if os.path.exists(checkpoint_path) else 'trained'
 
             # Normalize data
             scaler = MinMaxScaler(feature_range=(0, 1))
             sensor_data_scaled = scaler.fit_transform(sensor_data.reshape(-1, 1))
 
-            # Create dataset
-            time_step = 10
-            X, Y = create_dataset(sensor_data_scaled, time_step)
-
-            # Convert to Tensor
-            X = torch.tensor(X, dtype=torch.float32).unsqueeze(-1)
-            Y = torch.tensor(Y, dtype=torch.float32)
+            # Create dataset (window views, nothing is copied per window)
+            dataset = SlidingWindowDataset(sensor_data_scaled, time_step)
 
             # Split into training and testing set
-            train_size = int(len(X) * 0.7)
-            X_train, X_test = X[:train_size], X[train_size:]
-            Y_train, Y_test = Y[:train_size], Y[train_size:]
+            train_size = int(len(dataset) * 0.7)
+            X_train, Y_train = dataset[:train_size]
+            X_test, Y_test = dataset[train_size:]
 
-            # Build LSTM model
+            # Train LSTM model, checkpointing every epoch so an interrupted run can resume
             model = LSTM()
-            loss_function = nn.MSELoss()
-            optimizer = optim.Adam(model.parameters(), lr=0.001)
-
-            # DataLoader
-            train_data = TensorDataset(X_train, Y_train)
-            train_loader = DataLoader(train_data, batch_size=1, shuffle=False)
-
-            # Train model
-            epochs = 1
-            for epoch in range(epochs):
-                for seq, labels in train_loader:
-                    optimizer.zero_grad()
-                    model.hidden_cell = (torch.zeros(1, seq.size(0), model.hidden_layer_size),
-                                         torch.zeros(1, seq.size(0), model.hidden_layer_size))
-
-                    y_pred = model(seq)
-
-                    single_loss = loss_function(y_pred, labels.unsqueeze(1))
-                    single_loss.backward()
-                    optimizer.step()
-
-                print(f'{sensor_id} Epoch {epoch + 1} loss: {single_loss.item()}')
-
-            # Save model
-            model_save_path = os.path.join(model_folder, f'{sensor_id}_model.pth')
-            torch.save(model.state_dict(), model_save_path)
+            with stage('train.fit', sensor_id=sensor_id) as record:
+                model, history = train_lstm(model, X_train, Y_train, X_test, Y_test, train_config=train_config,
+                                            sensor_id=sensor_id, checkpoint_path=checkpoint_path)
+                record['rows'] = len(X_train) * len(history)
+                record['epochs'] = len(history)
+            total_time = sum(record['epoch_time_s'] for record in history)
+            summary['epochs'] = len(history)
+            # No epochs run (epochs=0, or resumed from a checkpoint at the final epoch) takes no time
+            samples_per_s = len(X_train) * len(history) / total_time if total_time > 0 else float('inf')
+            print(f"{sensor_id} trained {len(history)} epochs in {total_time:.2f}s "
+                  f"({samples_per_s:.0f} samples/s)")
+
+            # Save model, scaler and data hash to the registry
+            register_model(model_folder, sensor_id, model, scaler, time_step, data_hash)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
             print(f'Model saved for sensor {sensor_id} at {model_save_path}')
 
+        # Predict all anomalies with at least time_step preceding data points in one batch
+        with stage('train.impute', rows=len(anomalies), sensor_id=sensor_id):
+            anomalies, skipped = impute_anomalies(model, scaler, sensor_series, sensor_data_scaled,
+                                                  anomalies, time_step)
+            save_imputed_anomalies(sensor_id, anomalies, skipped, save_folder)
+        count(f"train.{summary['status']}")
+
+    summary['wall_time_s'] = time.perf_counter() - start
+    return summary
+
+
+# Predict-only imputation from the model registry: no training, models and scalers are
+# loaded from model_folder (and kept in the registry's LRU cache across calls). Sensors
+# without a registered model are reported as 'missing'; models registered for different
+# data than the current sorted data are still used and reported as 'stale'.
+def predict_from_registry(anomaly_file, save_folder, model_folder, registry=None, data_folders=None):
+    registry = registry if registry is not None else get_registry(model_folder)
+    anomaly_df = read_anomaly_file(anomaly_file)
+
+    summaries = []
+    for sensor_id in anomaly_df['SENSOR_ID'].unique():
+        start = time.perf_counter()
+        summary = {'sensor_id': sensor_id, 'status': 'missing', 'epochs': 0, 'wall_time_s': 0.0}
+        entry = registry.load(sensor_id)
+        if entry is None:
+            print(f'No registered model for sensor {sensor_id} in {model_folder}')
+        else:
+            model, scaler, metadata = entry
+            sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+            if len(sensor_series) == 0:
+                summary['status'] = 'no data'
+            else:
+                summary['status'] = 'predicted' if metadata['data_hash'] == sensor_data_hash(sensor_series) \
+                    else 'stale'
+                sensor_data_scaled = scaler.transform(sensor_series.values.reshape(-1, 1))
+                anomalies, skipped = impute_anomalies(model, scaler, sensor_series, sensor_data_scaled,
+                                                      anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id],
+                                                      metadata['time_step'])
+                save_imputed_anomalies(sensor_id, anomalies, skipped, save_folder)
+        summary['wall_time_s'] = time.perf_counter() - start
+        summaries.append(summary)
+
+    print(f"Registry cache: {registry.hits} hits, {registry.misses} loads")
+    return summaries
 
-            anomalies = anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id]
-            for index, row in anomalies.iterrows():
-                # Find the index of the anomaly in the full data
-                anomaly_index = sensor_data_df[sensor_data_df['MDATE'] == row['MDATE']].index[0]
-                print(anomaly_index)
-
-                if anomaly_index >= 10:  # Ensure there are at least 10 preceding data points
-                    start_index = anomaly_index - 10
-                    sequence = sensor_data_scaled[start_index:anomaly_index].reshape(1, 10, 1)
-                    sequence_tensor = torch.tensor(sequence, dtype=torch.float32)
 
-                    # Predict
-                    with torch.no_grad():
-                        prediction = model(sequence_tensor).item()
-                    prediction = scaler.inverse_transform([[prediction]])[0][0]
+# LSTM training and prediction function
+def train_and_predict_lstm(anomaly_file, save_folder, model_folder, train_config=None, skip_fresh=False,
+                           data_folders=None):
+    anomaly_df = read_anomaly_file(anomaly_file)
+    anomaly_sensor_ids = anomaly_df['SENSOR_ID'].unique()
 
-                    # Save the prediction
-                    anomalies.loc[index, 'Prediction'] = prediction
+    summaries = []
+    for sensor_id in anomaly_sensor_ids:
+        anomalies = anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id]
+        summaries.append(train_and_predict_sensor(sensor_id, anomalies, save_folder, model_folder,
+                                                  train_config=train_config, skip_fresh=skip_fresh,
+                                                  data_folders=data_folders))
+    return summaries
+
+
+# Aligned (time x sensor) matrix of M_RESULT for a set of sensors: outer join on MDATE,
+# duplicate timestamps averaged, gaps forward- then back-filled
+def build_sensor_matrix(sensor_ids, save_folder, data_folders=None):
+    columns = []
+    for sensor_id in sensor_ids:
+        sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+        if len(sensor_series) == 0:
+            continue
+        series = pd.Series(sensor_series.values, index=pd.DatetimeIndex(sensor_series.mdate, name='MDATE')) \
+            .groupby(level=0).mean().rename(sensor_id)
+        columns.append(series)
+    if not columns:
+        return pd.DataFrame()
+    matrix_df = pd.concat(columns, axis=1).sort_index()
+    return matrix_df.ffill().bfill()
+
+
+# Batched imputation for the multi-sensor model: every anomaly timestamp maps to one row of
+# the aligned matrix, each distinct row is predicted once for all sensors in a single forward
+# pass (chunked), and each anomaly takes the column of its own sensor
+def impute_anomalies_multi(model, scaler, matrix_df, matrix_scaled, anomalies, time_step=10,
+                           batch_size=PREDICT_BATCH_SIZE):
+    anomalies = anomalies.copy()
+    times = matrix_df.index.to_numpy()
+    targets = pd.to_datetime(anomalies['MDATE']).to_numpy()
+    columns = {sensor_id: k for k, sensor_id in enumerate(matrix_df.columns)}
+    column = anomalies['SENSOR_ID'].map(columns).to_numpy()
+
+    positions = np.searchsorted(times, targets, side='left')
+    found = (positions < len(times)) & ~pd.isna(column)
+    found[found] = times[positions[found]] == targets[found]
+    enough_history = found & (positions >= time_step)
+
+    rows, inverse = np.unique(positions[enough_history], return_inverse=True)
+    predictions = np.empty((len(rows), matrix_scaled.shape[1]), dtype=np.float32)
+    if len(rows) > 0:
+        windows = SlidingWindowDataset(matrix_scaled, time_step, legacy_off_by_one=False).windows
+        model.eval()
+        with torch.no_grad():
+            for start_index in range(0, len(rows), batch_size):
+                chunk = torch.as_tensor(rows[start_index:start_index + batch_size] - time_step)
+                predictions[start_index:start_index + len(chunk)] = model(windows[chunk]).numpy()
+        predictions = scaler.inverse_transform(predictions.astype(np.float64))
+    return fill_predictions(anomalies, found, enough_history,
+                            predictions[inverse, column[enough_history].astype(int)], time_step)
+
+
+# Train one shared LSTM over the aligned matrix of all anomalous sensors (input and output
+# size = number of sensors) and impute every sensor's anomalies from it
+def train_and_predict_multi_sensor(anomaly_file, save_folder, model_folder, train_config=None,
+                                   hidden_layer_size=128, sensor_ids=None, data_folders=None):
+    anomaly_df = read_anomaly_file(anomaly_file)
+    if sensor_ids is None:
+        sensor_ids = sorted(anomaly_df['SENSOR_ID'].unique())
+
+    matrix_df = build_sensor_matrix(sensor_ids, save_folder, data_folders)
+    if matrix_df.empty:
+        print("No sensor data found for the multi-sensor model")
+        return None
+    sensor_ids = list(matrix_df.columns)
+
+    # Normalize every sensor column separately
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    matrix_scaled = scaler.fit_transform(matrix_df.values)
+
+    time_step = 10
+    dataset = SlidingWindowDataset(matrix_scaled, time_step)
+    train_size = int(len(dataset) * 0.7)
+    X_train, Y_train = dataset[:train_size]
+    X_test, Y_test = dataset[train_size:]
+
+    model = LSTM(input_size=len(sensor_ids), hidden_layer_size=hidden_layer_size, output_size=len(sensor_ids))
+    model, history = train_lstm(model, X_train, Y_train, X_test, Y_test, train_config=train_config,
+                                sensor_id='multi-sensor')
+
+    model_save_path = os.path.join(model_folder, 'multi_sensor_model.pth')
+    torch.save({'sensor_ids': sensor_ids, 'hidden_layer_size': hidden_layer_size, 'time_step': time_step,
+                'scaler': _scaler_to_dict(scaler), 'state_dict': model.state_dict()}, model_save_path)
+    print(f'Multi-sensor model for {len(sensor_ids)} sensors saved at {model_save_path}')
+
+    anomalies, skipped = impute_anomalies_multi(model, scaler, matrix_df, matrix_scaled,
+                                                anomaly_df[anomaly_df['SENSOR_ID'].isin(sensor_ids)], time_step)
+    # Suffixed like the other backends, so the per-sensor models' imputations are kept
+    for sensor_id, sensor_anomalies in anomalies.groupby('SENSOR_ID', sort=False):
+        save_imputed_anomalies(sensor_id, sensor_anomalies, skipped[skipped['SENSOR_ID'] == sensor_id], save_folder,
+                               suffix='_multi')
+    return model, history
+
+
+def _init_training_worker(threads_per_worker):
+    torch.set_num_threads(threads_per_worker)
+
+
+def print_training_summary(summaries):
+    print(f"{'sensor':<10}{'status':<10}{'epochs':>8}{'wall time (s)':>16}")
+    for summary in sorted(summaries, key=lambda record: -record['wall_time_s']):
+        print(f"{summary['sensor_id']:<10}{summary['status']:<10}{summary['epochs']:>8}"
+              f"{summary['wall_time_s']:>16.2f}")
+
+
+# Train all anomalous sensors in a process pool, sensors sharded across workers with
+# threads_per_worker torch threads each. Sensors whose model is newer than their sorted
+# data are reused, interrupted sensors resume from their per-epoch checkpoint.
+def schedule_training(anomaly_file, save_folder, model_folder, workers=None, threads_per_worker=1,
+                      train_config=None, skip_fresh=True, data_folders=None):
+    start = time.perf_counter()
+    os.makedirs(model_folder, exist_ok=True)
+    anomaly_df = read_anomaly_file(anomaly_file)
+    anomaly_sensor_ids = anomaly_df['SENSOR_ID'].unique()
 
-            # Save completed anomaly data
-            anomaly_completed_file = os.path.join(save_folder, f'{sensor_id}_anomaly_completed.csv')
-            anomalies.to_csv(anomaly_completed_file, index=False, encoding='utf-8')
-            print(f'Anomaly data saved for sensor {sensor_id} at {anomaly_completed_file}')
+    # Resolved here and passed to every sensor, so workers never fall back to their own defaults
+    data_folders = resolve_data_folders(data_folders)
+    # Build the sensor store once here rather than racing to build it in every worker
+    if any(not os.path.exists(os.path.join(save_folder, f"{sensor_id}_sorted_data.csv"))
+           for sensor_id in anomaly_sensor_ids):
+        build_sensor_store(data_folders['data_directory'], data_folders['store_directory'])
+
+    train_config = dict(train_config or {}, num_threads=None)
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_training_worker,
+                             initargs=(threads_per_worker,)) as executor:
+        futures = {
+            executor.submit(train_and_predict_sensor, sensor_id, anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id],
+                            save_folder, model_folder, train_config, skip_fresh, data_folders): sensor_id
+            for sensor_id in anomaly_sensor_ids
+        }
+        for future in as_completed(futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"Training failed for sensor {futures[future]}: {e}")
+                summaries.append({'sensor_id': futures[future], 'status': 'failed', 'epochs': 0,
+                                  'wall_time_s': float('nan')})
+
+    print_training_summary(summaries)
+    print(f"Total wall time: {time.perf_counter() - start:.2f}s for {len(summaries)} sensors")
+    return summaries
 
 
 # Directory containing CSV files and IDs to process
 data_directory = './索力数据'
 save_directory = './merge'
+store_directory = './sensor_store'
+archive_directory = './sensor_archive'
 model_folder = './models'
-os.makedirs(model_folder, exist_ok=True)
-
-# Train and predict
-anomaly_file = './anomaly/anomaly_info.csv'
-train_and_predict_lstm(anomaly_file, save_directory, model_folder)
-# import os
-# import pandas as pd
-# import numpy as np
-# import torch
-# import torch.nn as nn
-# import torch.optim as optim
-# from torch.utils.data import DataLoader, TensorDataset
-# from sklearn.preprocessing import MinMaxScaler
-# from sklearn.svm import SVR
-# from sklearn.linear_model import LinearRegression
-# import glob
-# import joblib  # 用于保存 SVR 和线性回归模型
-#
-#
-# # Define the LSTM model
-# class LSTM(nn.Module):
-#     def __init__(self, input_size=1, hidden_layer_size=50, output_size=1):
-#         super(LSTM, self).__init__()
-#         self.hidden_layer_size = hidden_layer_size
-#         self.lstm = nn.LSTM(input_size, hidden_layer_size, batch_first=True)
-#         self.linear = nn.Linear(hidden_layer_size, output_size)
-#
-#     def forward(self, input_seq):
-#         lstm_out, _ = self.lstm(input_seq)
-#         predictions = self.linear(lstm_out[:, -1])
-#         return predictions
-#
-#
-# # Create dataset function
-# def create_dataset(data, time_step=1):
-#     X, Y = [], []
-#     for i in range(len(data) - time_step - 1):
-#         a = data[i:(i + time_step), 0]
-#         X.append(a)
-#         Y.append(data[i + time_step, 0])
-#     return np.array(X), np.array(Y)
-#
-#
-# # Function to process and save sensor data for a specific sensor ID
-# def process_and_save_sensor_data(directory, sensor_id, save_directory):
-#     # Ensure the save directory exists
-#     os.makedirs(save_directory, exist_ok=True)
-#
-#     # Initialize DataFrame for the sensor ID
-#     sensor_data_df = pd.DataFrame()
-#
-#     all_files = []
-#     # List all CSV files in the given directory
-#     for subdir, _, files in os.walk(directory):
-#         for file in files:
-#             if file.endswith('.csv'):
-#                 file_path = os.path.join(subdir, file)
-#                 all_files.append(file_path)
-#
-#     for file in all_files:
-#         # Read the current file
-#         df = pd.read_csv(file,encoding='gb2312')
-#         df['MDATE'] = pd.to_datetime(df['MDATE'])
-#
-#         # Filter data for the sensor ID and append to the DataFrame
-#         if sensor_id in df['SENSOR_ID'].values:
-#             filtered_data = df[df['SENSOR_ID'] == sensor_id]
-#             sensor_data_df = pd.concat([sensor_data_df, filtered_data], ignore_index=True)
-#
-#     # Save the sorted sensor data to a CSV file in the designated save directory if not empty
-#     if not sensor_data_df.empty:
-#         sensor_data_df = sensor_data_df.sort_values(by='MDATE').reset_index(drop=True)
-#         file_path = os.path.join(save_directory, f"{sensor_id}_sorted_data.csv")
-#         sensor_data_df.to_csv(file_path, index=False)
-#         print(f"Sorted data for sensor {sensor_id} saved to {file_path}")
-#
-#     return sensor_data_df
-#
-#
-# # Training and prediction function with algorithm selection
-# def train_and_predict(sensor_id,sensor_data, algorithm='LSTM'):
-#     if algorithm == 'LSTM':
-#         # Normalize data
-#         # scaler = MinMaxScaler(feature_range=(0, 1))
-#         # sensor_data_scaled = scaler.fit_transform(sensor_data.reshape(-1, 1))
-#
-#         # Create dataset
-#         time_step = 10
-#         X, Y = create_dataset(sensor_data, time_step)
-#
-#         # Convert to Tensor
-#         X = torch.tensor(X, dtype=torch.float32).unsqueeze(-1)
-#         Y = torch.tensor(Y, dtype=torch.float32)
-#
-#         # Split into training and testing set
-#         train_size = int(len(X) * 0.7)
-#         X_train, X_test = X[:train_size], X[train_size:]
-#         Y_train, Y_test = Y[:train_size], Y[train_size:]
-#
-#         # Build LSTM model
-#         model = LSTM()
-#         loss_function = nn.MSELoss()
-#         optimizer = optim.Adam(model.parameters(), lr=0.001)
-#
-#         # DataLoader
-#         train_data = TensorDataset(X_train, Y_train)
-#         train_loader = DataLoader(train_data, batch_size=1, shuffle=False)
-#
-#         # Train model
-#         epochs = 1
-#         for epoch in range(epochs):
-#             for seq, labels in train_loader:
-#                 optimizer.zero_grad()
-#                 model.hidden_cell = (torch.zeros(1, seq.size(0), model.hidden_layer_size),
-#                                      torch.zeros(1, seq.size(0), model.hidden_layer_size))
-#
-#                 y_pred = model(seq)
-#                 single_loss = loss_function(y_pred, labels.unsqueeze(1))
-#                 single_loss.backward()
-#                 optimizer.step()
-#
-#             print(f'Epoch {epoch + 1} loss: {single_loss.item()}')
-#
-#         # Save LSTM model
-#         model_save_path = os.path.join(model_folder, f'{sensor_id}_{algorithm}_model.pth')
-#         torch.save(model.state_dict(), model_save_path)
-#         print(f'LSTM model saved at {model_save_path}')
-#
-#         return model
-#
-#     elif algorithm == 'SVR':
-#         # Prepare data for SVR
-#         time_step = 10
-#         X, Y = create_dataset(sensor_data, time_step)
-#
-#         # Normalize data
-#         scaler_X = MinMaxScaler()
-#         scaler_Y = MinMaxScaler()
-#         X = scaler_X.fit_transform(X)
-#         Y = scaler_Y.fit_transform(Y.reshape(-1, 1)).flatten()
-#
-#         # Train SVR model
-#         model = SVR()
-#         model.fit(X, Y)
-#
-#         model_save_path = os.path.join(model_folder, f'{sensor_id}_{algorithm}_model.joblib')
-#         joblib.dump(model, model_save_path)
-#         print(f'SVR model saved at {model_save_path}')
-#
-#         return model, (scaler_X, scaler_Y)
-#
-#     elif algorithm == 'LinearRegression':
-#         # Prepare data for Linear Regression
-#         time_step = 10
-#         X, Y = create_dataset(sensor_data, time_step)
-#
-#         # Train Linear Regression model
-#         model = LinearRegression()
-#         model.fit(X, Y)
-#
-#         # Save Linear Regression model
-#         model_save_path = os.path.join(model_folder, f'{sensor_id}_{algorithm}_model.joblib')
-#         joblib.dump(model, model_save_path)
-#         print(f'Linear Regression model saved at {model_save_path}')
-#
-#         return model, None
-#
-#     else:
-#         raise ValueError("Algorithm must be one of 'LSTM', 'SVR', or 'LinearRegression'")
-#
-#
-# # Main function for training and predicting anomalies with algorithm choice
-# def main(anomaly_file, save_folder, model_folder, algorithm='LSTM'):
-#     anomaly_df = pd.read_csv(anomaly_file)
-#     anomaly_df['MDATE'] = pd.to_datetime(anomaly_df['MDATE'])
-#     anomaly_df = anomaly_df.sort_values(by=['MDATE']).reset_index(drop=True)
-#     anomaly_sensor_ids = anomaly_df['SENSOR_ID'].unique()
-#
-#     for sensor_id in anomaly_sensor_ids:
-#         sorted_data_path = os.path.join(save_folder, f"{sensor_id}_sorted_data.csv")
-#         if os.path.exists(sorted_data_path):
-#             print(f"Reading sorted data from {sorted_data_path}")
-#             sensor_data_df = pd.read_csv(sorted_data_path)
-#         else:
-#             print(f"No sorted data file found for sensor {sensor_id}, processing data...")
-#             sensor_data_df = process_and_save_sensor_data(data_directory, sensor_id, save_folder)
-#
-#         if not sensor_data_df.empty:
-#             sensor_data = sensor_data_df['M_RESULT'].values
-#
-#             # Normalize data
-#             scaler = MinMaxScaler(feature_range=(0, 1))
-#             sensor_data_scaled = scaler.fit_transform(sensor_data.reshape(-1, 1))
-#             model = train_and_predict(sensor_id,sensor_data_scaled,algorithm)
-#
-#             anomalies = anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id]
-#             for index, row in anomalies.iterrows():
-#                 # print(row)
-#                 anomaly_index = sensor_data_df[sensor_data_df['MDATE'] == row['MDATE']].index[0]
-#                 if anomaly_index >= 10:  # Ensure there are enough data points
-#                     start_index = anomaly_index - 10
-#                     sequence = sensor_data[start_index:anomaly_index].reshape(1, -1)
-#
-#                     # Predict based on the selected algorithm
-#                     if algorithm == 'LSTM':
-#                         sequence_tensor = torch.tensor(sequence, dtype=torch.float32).unsqueeze(-1)
-#                         with torch.no_grad():
-#                             prediction = model(sequence_tensor).item()
-#                         prediction = scaler.inverse_transform([[prediction]])[0][0]
-#
-#                     elif algorithm == 'SVR':
-#                         sequence_scaled = scaler[0].transform(sequence)
-#                         prediction = model.predict(sequence_scaled)
-#                         prediction = scaler[1].inverse_transform([[prediction[0]]])[0][0]
-#
-#                     elif algorithm == 'LinearRegression':
-#                         prediction = model.predict(sequence)[0]
-#
-#                     # Save the prediction
-#                     anomalies.loc[index, 'Prediction'] = prediction
-#
-#             # Save completed anomaly data with algorithm name
-#             anomaly_completed_file = os.path.join(save_folder, f'{sensor_id}_anomaly_completed_{algorithm}.csv')
-#             anomalies.to_csv(anomaly_completed_file, index=False, encoding='utf-8')
-#             print(f'Anomaly data saved for sensor {sensor_id} at {anomaly_completed_file}')
-#
-#
-# # Directory and file paths
-# data_directory = './索力数据'
-# save_directory = './merge'
-# model_folder = './models'
-# os.makedirs(model_folder, exist_ok=True)
-#
-# # Run the main function with the desired algorithm
-# anomaly_file = './anomaly/anomaly_info.csv'
-# main(anomaly_file, save_directory, model_folder,
-#      algorithm='LSTM')  # Replace 'SVR' with 'LSTM' or 'LinearRegression' as needed
+
+if __name__ == "__main__":
+    os.makedirs(model_folder, exist_ok=True)
+    # Ingest (or incrementally extend) the memory-mapped per-sensor archive from the raw data;
+    # training then opens each sensor from it instead of re-parsing CSVs
+    # build_sensor_archive(data_directory, archive_directory)
+
+    # Train and predict; stage timings, row counts, peak memory and epochs go to a JSON-lines
+    # log with a summary table at the end (profile=True also dumps cProfile stats)
+    anomaly_file = './anomaly/anomaly_info.csv'
+    with run('train_and_predict_lstm', os.path.join(model_folder, 'run_log.jsonl')):
+        train_and_predict_lstm(anomaly_file, save_directory, model_folder)
+    # schedule_training(anomaly_file, save_directory, model_folder, workers=4, threads_per_worker=2)
@@ -0,0 +1,245 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.svm import SVR
+
+from lstm_prediction import (LSTM, SlidingWindowDataset, train_lstm, PREDICT_BATCH_SIZE, read_anomaly_file,
+                             load_sorted_sensor_data, locate_anomalies, fill_predictions, save_imputed_anomalies)
+
+
+# Base class of the predictor backends: fit on a 1-D series in its original units, then
+# predict the next value for a batch of (B, time_step) windows, also in original units
+class Predictor:
+    name = ''
+
+    def __init__(self, time_step=10):
+        self.time_step = time_step
+
+    def fit(self, series):
+        raise NotImplementedError
+
+    def predict(self, windows):
+        raise NotImplementedError
+
+
+# Least squares fit of the lagged regression y[t] = c + sum_j w[j] * x[t - lags + j]. The lag
+# columns of a cable-force series are highly collinear, so the (N, lags) design matrix (a
+# sliding window view, plus a ones column) is solved with lstsq (SVD) rather than through the
+# normal equations, whose X^T X squares the condition number
+def _lagged_least_squares(series, lags, intercept=True):
+    x = np.asarray(series, dtype=np.float64)
+    n = len(x) - lags
+    if n <= lags:
+        raise ValueError(f"series of length {len(x)} is too short for {lags} lags")
+    design = np.lib.stride_tricks.sliding_window_view(x[:-1], lags)
+    if intercept:
+        design = np.hstack((design, np.ones((n, 1))))
+    coef = np.linalg.lstsq(design, x[lags:], rcond=None)[0]
+    return coef[:lags], (coef[lags] if intercept else 0.0)
+
+
+# Ordinary least squares on the full time_step window with an intercept
+class LinearPredictor(Predictor):
+    name = 'LinearRegression'
+
+    def fit(self, series):
+        self.coef_, self.intercept_ = _lagged_least_squares(series, self.time_step)
+        return self
+
+    def predict(self, windows):
+        return np.asarray(windows, dtype=np.float64) @ self.coef_ + self.intercept_
+
+
+# Autoregressive AR(order) model with a constant, using only the last `order` values of each window
+class ARPredictor(Predictor):
+    name = 'AR'
+
+    def __init__(self, time_step=10, order=3):
+        super().__init__(time_step)
+        self.order = min(order, time_step)
+
+    def fit(self, series):
+        self.coef_, self.intercept_ = _lagged_least_squares(series, self.order)
+        return self
+
+    def predict(self, windows):
+        return np.asarray(windows, dtype=np.float64)[:, -self.order:] @ self.coef_ + self.intercept_
+
+
+# Support vector regression on min-max scaled windows; the kernel solve is superlinear in the
+# number of samples, so it trains on the most recent max_train_windows windows
+class SVRPredictor(Predictor):
+    name = 'SVR'
+
+    def __init__(self, time_step=10, max_train_windows=5000, **svr_params):
+        super().__init__(time_step)
+        self.max_train_windows = max_train_windows
+        self.svr_params = svr_params
+
+    def fit(self, series):
+        series = np.asarray(series, dtype=np.float64)
+        windows = np.lib.stride_tricks.sliding_window_view(series[:-1], self.time_step)[-self.max_train_windows:]
+        targets = series[self.time_step:][-len(windows):]
+        self.scaler_ = MinMaxScaler().fit(series.reshape(-1, 1))
+        self.model_ = SVR(**self.svr_params)
+        self.model_.fit(self._scale(windows), self._scale(targets))
+        return self
+
+    def _scale(self, values):
+        return (values - self.scaler_.data_min_[0]) * self.scaler_.scale_[0]
+
+    def predict(self, windows):
+        scaled = self.model_.predict(self._scale(np.asarray(windows, dtype=np.float64)))
+        return scaled / self.scaler_.scale_[0] + self.scaler_.data_min_[0]
+
+
+# The LSTM of lstm_prediction behind the same interface; the last validation_fraction of the
+# training windows drives early stopping
+class LSTMPredictor(Predictor):
+    name = 'LSTM'
+
+    def __init__(self, time_step=10, train_config=None, hidden_layer_size=50, validation_fraction=0.3):
+        super().__init__(time_step)
+        self.train_config = train_config
+        self.hidden_layer_size = hidden_layer_size
+        self.validation_fraction = validation_fraction
+
+    def fit(self, series):
+        self.scaler_ = MinMaxScaler(feature_range=(0, 1))
+        scaled = self.scaler_.fit_transform(np.asarray(series, dtype=np.float64).reshape(-1, 1))
+        dataset = SlidingWindowDataset(scaled, self.time_step)
+        train_size = int(len(dataset) * (1 - self.validation_fraction))
+        self.model_, self.history_ = train_lstm(LSTM(hidden_layer_size=self.hidden_layer_size),
+                                                *dataset[:train_size], *dataset[train_size:],
+                                                train_config=self.train_config, sensor_id=self.name)
+        return self
+
+    def predict(self, windows):
+        windows = np.asarray(windows, dtype=np.float64)
+        scaled = self.scaler_.transform(windows.reshape(-1, 1)).reshape(windows.shape).astype(np.float32)
+        predictions = np.empty(len(windows), dtype=np.float32)
+        with torch.no_grad():
+            for start in range(0, len(windows), PREDICT_BATCH_SIZE):
+                chunk = torch.from_numpy(scaled[start:start + PREDICT_BATCH_SIZE]).unsqueeze(-1)
+                predictions[start:start + len(chunk)] = self.model_(chunk).squeeze(1).numpy()
+        return self.scaler_.inverse_transform(predictions.reshape(-1, 1).astype(np.float64))[:, 0]
+
+
+PREDICTORS = {
+    'LSTM': LSTMPredictor,
+    'LinearRegression': LinearPredictor,
+    'AR': ARPredictor,
+    'SVR': SVRPredictor,
+}
+
+
+def make_predictor(algorithm, time_step=10, **kwargs):
+    if algorithm not in PREDICTORS:
+        raise ValueError(f"Algorithm must be one of {', '.join(repr(name) for name in PREDICTORS)}")
+    return PREDICTORS[algorithm](time_step=time_step, **kwargs)
+
+
+# Fit every backend on the first (1 - holdout) of each sensor's series and score one-step
+# predictions on the holdout windows; records fit time, predict latency and holdout error.
+# A sensor too short to split into training windows and a holdout gets one 'too short' row.
+def evaluate_backends(sensor_ids, save_folder, algorithms=('LinearRegression', 'AR', 'SVR', 'LSTM'),
+                      time_step=10, holdout=0.3, backend_params=None, data_folders=None):
+    backend_params = backend_params or {}
+    results = []
+    for sensor_id in sensor_ids:
+        sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+        if len(sensor_series) == 0:
+            continue
+        series = np.asarray(sensor_series, dtype=np.float64)
+        split = int(len(series) * (1 - holdout))
+        if split <= 2 * time_step or split >= len(series):
+            print(f"{sensor_id}: {len(series)} points are too few to fit on {time_step}-point windows "
+                  f"and score a holdout, skipped")
+            results.append({'sensor_id': sensor_id, 'status': 'too short', 'n_train': split,
+                            'n_holdout': len(series) - split})
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(series[:-1], time_step)[split - time_step:]
+        targets = series[split:]
+
+        for algorithm in algorithms:
+            predictor = make_predictor(algorithm, time_step, **backend_params.get(algorithm, {}))
+            start = time.perf_counter()
+            predictor.fit(series[:split])
+            fit_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            predictions = predictor.predict(windows)
+            predict_time = time.perf_counter() - start
+
+            errors = predictions - targets
+            results.append({
+                'sensor_id': sensor_id,
+                'status': 'ok',
+                'algorithm': algorithm,
+                'fit_time_s': fit_time,
+                'predict_latency_ms': predict_time / len(windows) * 1000,
+                'predict_batch_s': predict_time,
+                'holdout_rmse': float(np.sqrt(np.mean(errors ** 2))),
+                'holdout_mae': float(np.mean(np.abs(errors))),
+                'n_train': split,
+                'n_holdout': len(targets),
+            })
+            print(f"{sensor_id} {algorithm}: fit {fit_time:.3f}s, "
+                  f"predict {results[-1]['predict_latency_ms']:.4f} ms/window, rmse {results[-1]['holdout_rmse']:.3f}")
+    return pd.DataFrame(results)
+
+
+# Cheapest backend (fit time + holdout predict time) per sensor that meets the accuracy
+# target: holdout RMSE <= max_rmse if given, otherwise within `tolerance` x the best RMSE.
+# Sensors that were not evaluated get no entry (impute_with_backend falls back to the LSTM).
+def select_backends(results, max_rmse=None, tolerance=1.1):
+    selection = {}
+    if results.empty or 'status' not in results:
+        return selection
+    for sensor_id, group in results[results['status'] == 'ok'].groupby('sensor_id', sort=False):
+        limit = max_rmse if max_rmse is not None else group['holdout_rmse'].min() * tolerance
+        eligible = group[group['holdout_rmse'] <= limit]
+        if eligible.empty:
+            eligible = group[group['holdout_rmse'] == group['holdout_rmse'].min()]
+        cost = eligible['fit_time_s'] + eligible['predict_batch_s']
+        selection[sensor_id] = eligible.loc[cost.idxmin(), 'algorithm']
+    return selection
+
+
+# Impute every sensor's anomalies with the chosen backend (one algorithm name, or a
+# {sensor_id: algorithm} mapping such as the output of select_backends), fitted on the
+# sensor's full series; results go to {sensor_id}_anomaly_completed_{algorithm}.csv
+def impute_with_backend(anomaly_file, save_folder, algorithm='LinearRegression', time_step=10, backend_params=None,
+                        data_folders=None):
+    backend_params = backend_params or {}
+    anomaly_df = read_anomaly_file(anomaly_file)
+
+    for sensor_id in anomaly_df['SENSOR_ID'].unique():
+        sensor_algorithm = algorithm.get(sensor_id, 'LSTM') if isinstance(algorithm, dict) else algorithm
+        sensor_series = load_sorted_sensor_data(sensor_id, save_folder, data_folders=data_folders)
+        if len(sensor_series) == 0:
+            continue
+        series = np.asarray(sensor_series, dtype=np.float64)
+        predictor = make_predictor(sensor_algorithm, time_step, **backend_params.get(sensor_algorithm, {}))
+        predictor.fit(series)
+
+        anomalies = anomaly_df[anomaly_df['SENSOR_ID'] == sensor_id].copy()
+        positions, found, enough_history = locate_anomalies(sensor_series, anomalies, time_step)
+        windows = np.lib.stride_tricks.sliding_window_view(series, time_step)[positions[enough_history] - time_step]
+        predictions = predictor.predict(windows) if len(windows) else np.empty(0)
+
+        anomalies, skipped = fill_predictions(anomalies, found, enough_history, predictions, time_step)
+        save_imputed_anomalies(sensor_id, anomalies, skipped, save_folder, suffix=f'_{sensor_algorithm}')
+
+
+if __name__ == "__main__":
+    save_directory = './merge'
+    anomaly_file = './anomaly/anomaly_info.csv'
+
+    sensor_ids = read_anomaly_file(anomaly_file)['SENSOR_ID'].unique()
+    evaluation = evaluate_backends(sensor_ids, save_directory)
+    evaluation.to_csv(os.path.join(save_directory, 'backend_evaluation.csv'), index=False, encoding='utf-8')
+    impute_with_backend(anomaly_file, save_directory, algorithm=select_backends(evaluation))
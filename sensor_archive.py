@@ -0,0 +1,199 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from series_store import SensorSeries, CompactSeriesStore
+from csv_reader import list_csv_files, iter_sensor_csv
+
+
+MANIFEST_NAME = 'manifest.json'
+TIMESTAMPS_FILE = 'timestamps.bin'
+VALUES_FILE = 'values.bin'
+
+
+def _write_rows(path, array, start_row):
+    """
+    Write `array` into a raw binary column file starting at row `start_row` and cut the
+    file after the last written row.
+    """
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(start_row * array.itemsize)
+        f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate()
+
+
+def _memmap(path, dtype, rows):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+
+
+class SensorArchive:
+    """
+    Binary per-sensor archive of time-sorted readings for multi-year histories:
+        {root}/{SENSOR_ID}/timestamps.bin   int64 epoch nanoseconds, sorted
+        {root}/{SENSOR_ID}/values.bin       float32
+        {root}/manifest.json                rows and time range per sensor, ingested sources
+    Both column files are raw little-endian arrays, so opening a sensor memory-maps them
+    in O(1) and a time-range slice only pages in the rows it covers. Rows newer than the
+    last stored timestamp are appended in place; older ones are merged into the tail.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        manifest_path = os.path.join(root, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {'sensors': {}, 'sources': []}
+
+    def _paths(self, sensor_id):
+        folder = os.path.join(self.root, sensor_id)
+        return os.path.join(folder, TIMESTAMPS_FILE), os.path.join(folder, VALUES_FILE)
+
+    def save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    def sensors(self):
+        return sorted(self.manifest['sensors'])
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self.manifest['sensors']
+
+    def rows(self, sensor_id):
+        return self.manifest['sensors'].get(sensor_id, {}).get('rows', 0)
+
+    def open(self, sensor_id, start=None, end=None):
+        """
+        Memory-mapped view of one sensor's readings, optionally restricted to
+        start <= MDATE <= end.
+        :return: SensorSeries (empty if the sensor is not in the archive)
+        """
+        rows = self.rows(sensor_id)
+        timestamps_path, values_path = self._paths(sensor_id)
+        series = SensorSeries(sensor_id, _memmap(timestamps_path, np.int64, rows),
+                              _memmap(values_path, np.float32, rows))
+        if start is not None or end is not None:
+            series = series.between(start, end)
+        return series
+
+    def append(self, sensor_id, timestamps, values, save=True):
+        """
+        Add readings of one sensor. Rows after the stored end are written in place at the
+        end of the column files; earlier rows are merged with the overlapping tail, which
+        is rewritten from the first affected position.
+        :param timestamps: datetime64 values or int64 epoch nanoseconds
+        :param values: readings
+        :param save: write the manifest afterwards (disable when appending many sensors)
+        :return: number of rows in the sensor afterwards
+        """
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = timestamps.astype('datetime64[ns]').view(np.int64)
+        timestamps = timestamps.astype(np.int64, copy=False)
+        values = np.asarray(values, dtype=np.float32)
+        if len(timestamps) == 0:
+            return self.rows(sensor_id)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values = timestamps[order], values[order]
+
+        rows = self.rows(sensor_id)
+        timestamps_path, values_path = self._paths(sensor_id)
+        os.makedirs(os.path.dirname(timestamps_path), exist_ok=True)
+
+        position = rows
+        if rows > 0:
+            stored = _memmap(timestamps_path, np.int64, rows)
+            if timestamps[0] < stored[-1]:
+                # Out of order: merge with the stored rows from the first later timestamp on
+                position = int(np.searchsorted(stored, timestamps[0], side='right'))
+                tail_timestamps = np.array(stored[position:])
+                tail_values = np.array(_memmap(values_path, np.float32, rows)[position:])
+                del stored
+                timestamps = np.concatenate((tail_timestamps, timestamps))
+                values = np.concatenate((tail_values, values))
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, values = timestamps[order], values[order]
+            else:
+                del stored
+
+        _write_rows(timestamps_path, timestamps, position)
+        _write_rows(values_path, values, position)
+
+        rows = position + len(timestamps)
+        entry = self.manifest['sensors'].get(sensor_id)
+        start = timestamps[0] if entry is None or position == 0 else min(entry['start_ns'], int(timestamps[0]))
+        self.manifest['sensors'][sensor_id] = {
+            'rows': rows,
+            'start_ns': int(start),
+            'end_ns': int(timestamps[-1]),
+            'start': pd.Timestamp(int(start)).isoformat(),
+            'end': pd.Timestamp(int(timestamps[-1])).isoformat(),
+        }
+        if save:
+            self.save_manifest()
+        return rows
+
+    def append_frame(self, df, save=True):
+        """
+        Add a MDATE / SENSOR_ID / M_RESULT frame (one grouping sort, then one append per sensor).
+        :return: number of rows added
+        """
+        store = CompactSeriesStore.from_frame(df)
+        for series in store:
+            self.append(series.sensor_id, series.timestamps, series.values, save=False)
+        if save:
+            self.save_manifest()
+        return len(store)
+
+    def clear(self):
+        for sensor_id in list(self.manifest['sensors']):
+            for path in self._paths(sensor_id):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.manifest = {'sensors': {}, 'sources': []}
+
+
+def build_sensor_archive(directory, archive_directory, encoding=None):
+    """
+    Ingest the raw CSV tree into a SensorArchive, streaming each file in chunks (memory
+    stays at one chunk whatever the size of the tree). Sources already recorded in the manifest with the same
+    size and mtime are skipped, so new monthly files are appended incrementally; if a
+    recorded source changed or disappeared the archive is rebuilt.
+    :param directory: raw data folder, e.g. './索力数据'
+    :param archive_directory: root folder of the archive
+    :param encoding: encoding of the raw CSV files, None detects it per file
+    :return: SensorArchive
+    """
+    archive = SensorArchive(archive_directory)
+    sources = {}
+    for file in list_csv_files(directory):
+        stat = os.stat(file)
+        sources[os.path.abspath(file)] = {'path': os.path.abspath(file), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    known = {source['path']: source for source in archive.manifest['sources']}
+    if any(sources.get(path) != source for path, source in known.items()):
+        print(f"Sources of {archive_directory} changed, rebuilding the archive")
+        archive.clear()
+        known = {}
+
+    new_sources = [source for path, source in sources.items() if path not in known]
+    if not new_sources:
+        print(f"Sensor archive {archive_directory} is up to date")
+        return archive
+
+    for source in new_sources:
+        for df in iter_sensor_csv(source['path'], encoding=encoding):
+            archive.append_frame(df, save=False)
+        archive.manifest['sources'].append(source)
+        # Record progress after every file so an interrupted ingest resumes where it stopped
+        archive.save_manifest()
+    print(f"Sensor archive {archive_directory}: {len(new_sources)} files added, "
+          f"{len(archive.manifest['sensors'])} sensors")
+    return archive
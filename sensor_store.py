@@ -0,0 +1,187 @@
+import os
+import json
+import pandas as pd
+
+from csv_reader import list_csv_files, iter_sensor_csv
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# Rows buffered before the pending (sensor, month) groups are written out as part files;
+# the buffer is also flushed at the end of every source file
+DEFAULT_FLUSH_ROWS = 2_000_000
+
+
+def _source_entries(all_files):
+    entries = []
+    for file in all_files:
+        stat = os.stat(file)
+        entries.append({'path': os.path.abspath(file), 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return entries
+
+
+def read_manifest(store_directory):
+    """
+    Read the store manifest.
+    :param store_directory: root folder of the columnar store
+    :return: manifest dict, or None if the store has not been built
+    """
+    manifest_path = os.path.join(store_directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_partition(df, path, file_format):
+    if file_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif file_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError("file_format must be one of 'parquet' or 'feather'")
+
+
+def _read_partition(path, file_format):
+    if file_format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+
+def _flush_pieces(pieces, store_directory, file_format, partitions, part_numbers):
+    """
+    Write every pending (sensor, month) group as the next part file of its partition,
+    sorted by MDATE, record it in `partitions` and empty the buffer.
+    :param part_numbers: (sensor, month) -> number of parts written so far
+    """
+    for (sensor_id, month) in sorted(pieces):
+        part_df = pd.concat(pieces[(sensor_id, month)], ignore_index=True)
+        part_df = part_df.sort_values(by='MDATE', kind='stable').reset_index(drop=True)
+
+        month_folder = os.path.join(store_directory, sensor_id, month)
+        os.makedirs(month_folder, exist_ok=True)
+        part = part_numbers.get((sensor_id, month), 0)
+        part_numbers[(sensor_id, month)] = part + 1
+        relative_path = os.path.join(sensor_id, month, f"part-{part:05d}.{file_format}")
+        _write_partition(part_df, os.path.join(store_directory, relative_path), file_format)
+
+        partitions.append({
+            'sensor_id': sensor_id,
+            'month': month,
+            'path': relative_path,
+            'rows': int(len(part_df)),
+            'start': part_df['MDATE'].iloc[0].isoformat(),
+            'end': part_df['MDATE'].iloc[-1].isoformat(),
+        })
+    pieces.clear()
+
+
+def _remove_partitions(store_directory, manifest):
+    for partition in manifest['partitions']:
+        old_path = os.path.join(store_directory, partition['path'])
+        if os.path.exists(old_path):
+            os.remove(old_path)
+        # Month folders of the part-file layout are removed once empty
+        folder = os.path.dirname(old_path)
+        if folder != os.path.join(store_directory, partition['sensor_id']) and os.path.isdir(folder) \
+                and not os.listdir(folder):
+            os.rmdir(folder)
+
+
+def build_sensor_store(directory, store_directory, file_format='parquet', encoding=None, force=False,
+                       flush_rows=DEFAULT_FLUSH_ROWS):
+    """
+    Read every raw CSV under `directory` once and write a per-sensor columnar store
+    partitioned by SENSOR_ID and month, one MDATE-sorted part file per flush:
+        {store_directory}/{SENSOR_ID}/{YYYY-MM}/part-{NNNNN}.{parquet|feather}
+    The files are streamed in chunks and the buffered groups are written out after
+    every source file or `flush_rows` rows, so memory stays bounded whatever the size
+    of the archive. The manifest records the source files (size, mtime) and every part,
+    so an unchanged archive is not ingested again unless `force` is set.
+    :param directory: raw data folder, e.g. './索力数据'
+    :param store_directory: output folder of the store
+    :param file_format: 'parquet' or 'feather'
+    :param encoding: encoding of the raw CSV files, None detects it per file
+    :param force: rebuild even if the manifest matches the raw files
+    :param flush_rows: rows buffered before the pending groups are written
+    :return: manifest dict
+    """
+    all_files = list_csv_files(directory)
+    sources = _source_entries(all_files)
+
+    manifest = read_manifest(store_directory)
+    if (not force and manifest is not None and manifest['sources'] == sources
+            and manifest['format'] == file_format):
+        print(f"Sensor store {store_directory} is up to date")
+        return manifest
+
+    os.makedirs(store_directory, exist_ok=True)
+
+    # Drop the previous build first: its manifest, then its partitions, so an interrupted
+    # build never leaves a manifest pointing at missing or half-written parts
+    if manifest is not None:
+        os.remove(os.path.join(store_directory, MANIFEST_NAME))
+        _remove_partitions(store_directory, manifest)
+
+    # Single pass over the archive, writing the (sensor, month) groups as they accumulate
+    pieces, partitions, part_numbers, buffered = {}, [], {}, 0
+    for file in all_files:
+        for df in iter_sensor_csv(file, usecols=None, encoding=encoding):
+            months = df['MDATE'].dt.strftime('%Y-%m')
+            for (sensor_id, month), group in df.groupby([df['SENSOR_ID'], months], sort=False):
+                pieces.setdefault((sensor_id, month), []).append(group)
+            buffered += len(df)
+            if buffered >= flush_rows:
+                _flush_pieces(pieces, store_directory, file_format, partitions, part_numbers)
+                buffered = 0
+        _flush_pieces(pieces, store_directory, file_format, partitions, part_numbers)
+        buffered = 0
+
+    # Parts of a partition in write order, partitions by sensor and month
+    partitions.sort(key=lambda partition: (partition['sensor_id'], partition['month']))
+    manifest = {'format': file_format, 'sources': sources, 'partitions': partitions}
+    with open(os.path.join(store_directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Sensor store built at {store_directory}: {len(all_files)} files, {len(partitions)} part files")
+    return manifest
+
+
+def load_sensor_data(store_directory, sensor_id, start=None, end=None):
+    """
+    Load the time-sorted data of one sensor from the store, reading only its own
+    part files (optionally restricted to those overlapping [start, end]).
+    :param store_directory: root folder of the columnar store
+    :param sensor_id: sensor ID, e.g. 'SLS01'
+    :param start: optional lower bound of MDATE (inclusive)
+    :param end: optional upper bound of MDATE (inclusive)
+    :return: DataFrame sorted by MDATE, empty if the sensor is unknown
+    """
+    manifest = read_manifest(store_directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No sensor store manifest found in {store_directory}")
+
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    frames = []
+    for partition in manifest['partitions']:
+        if partition['sensor_id'] != sensor_id:
+            continue
+        if start is not None and pd.Timestamp(partition['end']) < start:
+            continue
+        if end is not None and pd.Timestamp(partition['start']) > end:
+            continue
+        frames.append(_read_partition(os.path.join(store_directory, partition['path']), manifest['format']))
+
+    if not frames:
+        return pd.DataFrame()
+
+    sensor_data_df = pd.concat(frames, ignore_index=True)
+    if len(frames) > 1 and not sensor_data_df['MDATE'].is_monotonic_increasing:
+        # Parts of one month from different source files or flushes may interleave in time
+        sensor_data_df = sensor_data_df.sort_values(by='MDATE', kind='stable')
+    if start is not None:
+        sensor_data_df = sensor_data_df[sensor_data_df['MDATE'] >= start]
+    if end is not None:
+        sensor_data_df = sensor_data_df[sensor_data_df['MDATE'] <= end]
+    return sensor_data_df.reset_index(drop=True)
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+
+class SensorSeries:
+    """
+    Time-sorted series of one sensor: int64 epoch-nanosecond timestamps and float32
+    values, both views into the arrays of a CompactSeriesStore or a SensorArchive
+    (nothing is copied); a series read from a sorted CSV keeps its float64 values.
+    Behaves as a 1-D array of its values (np.asarray(series) is a zero-copy view), so
+    it can be passed to DBScan, create_dataset and SlidingWindowDataset directly.
+    """
+
+    __slots__ = ('sensor_id', 'timestamps', 'values')
+
+    def __init__(self, sensor_id, timestamps, values):
+        self.sensor_id = sensor_id
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.values.dtype:
+            return self.values.copy() if copy else self.values
+        return self.values.astype(dtype)
+
+    @property
+    def mdate(self):
+        """
+        Timestamps as a datetime64[ns] view.
+        """
+        return self.timestamps.view('datetime64[ns]')
+
+    def between(self, start=None, end=None):
+        """
+        View of the readings with start <= MDATE <= end (two binary searches).
+        """
+        lo = 0 if start is None else np.searchsorted(self.timestamps, _epoch_ns(start), side='left')
+        hi = len(self) if end is None else np.searchsorted(self.timestamps, _epoch_ns(end), side='right')
+        return SensorSeries(self.sensor_id, self.timestamps[lo:hi], self.values[lo:hi])
+
+    def to_frame(self):
+        """
+        MDATE / SENSOR_ID / M_RESULT DataFrame in the layout of the sorted sensor CSVs.
+        """
+        return pd.DataFrame({'MDATE': self.mdate, 'SENSOR_ID': self.sensor_id, 'M_RESULT': self.values})
+
+
+def _epoch_ns(value):
+    return pd.Timestamp(value).as_unit('ns').value
+
+
+def _code_dtype(n_sensors):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_sensors <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class CompactSeriesStore:
+    """
+    Columnar in-memory store of many sensors' readings:
+    - SENSOR_ID mapped to small integer codes (categorical, sensor_ids[code]);
+    - rows grouped by sensor and sorted by time, each group contiguous, so the rows of
+      sensor k are timestamps[offsets[k]:offsets[k + 1]] (int64 epoch ns) and the same
+      slice of values (float32).
+    A year of 48 sensors at one-minute sampling is 25M rows, 12 bytes each, against
+    several times that for a DataFrame with object SENSOR_ID and float64 values.
+    """
+
+    def __init__(self, sensor_ids, offsets, timestamps, values):
+        self.sensor_ids = list(sensor_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.timestamps = np.ascontiguousarray(timestamps, dtype=np.int64)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        self._index = {sensor_id: k for k, sensor_id in enumerate(self.sensor_ids)}
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Build the store from a MDATE / SENSOR_ID / M_RESULT frame with one stable sort by
+        (sensor, time).
+        :param df: e.g. a merged monthly CSV or the synthetic benchmark archive
+        :return: CompactSeriesStore with sensors ordered by name
+        """
+        timestamps = pd.to_datetime(df['MDATE']).to_numpy().astype('datetime64[ns]').view(np.int64)
+        codes, uniques = pd.factorize(df['SENSOR_ID'].astype(str), sort=True)
+        codes = codes.astype(_code_dtype(len(uniques)))
+        order = np.lexsort((timestamps, codes))
+        offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(uniques)), out=offsets[1:])
+        return cls(uniques, offsets, timestamps[order],
+                   df['M_RESULT'].to_numpy(dtype=np.float32)[order])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for sensor_id in self.sensor_ids:
+            yield self.sensor(sensor_id)
+
+    def __contains__(self, sensor_id):
+        return sensor_id in self._index
+
+    def sensor(self, sensor_id):
+        """
+        Zero-copy view of one sensor's time-sorted readings.
+        :raise KeyError: unknown sensor
+        """
+        k = self._index[sensor_id]
+        lo, hi = self.offsets[k], self.offsets[k + 1]
+        return SensorSeries(sensor_id, self.timestamps[lo:hi], self.values[lo:hi])
+
+    @property
+    def codes(self):
+        """
+        Per-row sensor codes (materialized on demand, the grouping makes them implicit).
+        """
+        return np.repeat(np.arange(len(self.sensor_ids), dtype=_code_dtype(len(self.sensor_ids))),
+                         np.diff(self.offsets))
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes + self.offsets.nbytes
+
+    def to_frame(self):
+        """
+        Long-format frame with a categorical SENSOR_ID column.
+        """
+        return pd.DataFrame({
+            'MDATE': self.timestamps.view('datetime64[ns]'),
+            'SENSOR_ID': pd.Categorical.from_codes(self.codes, categories=self.sensor_ids),
+            'M_RESULT': self.values,
+        })
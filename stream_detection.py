@@ -0,0 +1,239 @@
+import bisect
+from collections import deque
+import numpy as np
+
+from DDDBscan import gap_epsilon
+
+
+class StreamingDBScan:
+    """
+    单个索力的滑动窗口在线DBScan异常检测。
+
+    与 DDDBscan.DBScan 使用相同的判定逻辑：由直方图非空区间的空隙确定 epsilon，
+    一维 minpts=1 的DBSCAN簇为排序后相邻差值 <= epsilon 的连续段，
+    超过窗口一半数据的簇为正常簇，其余为异常。
+
+    增量维护的状态：
+    - 窗口数据（deque，超出 window 的旧数据依次移除）及其排序列表；
+    - 固定宽度的直方图计数（区间宽度在标定时按 'auto' 规则确定，每 refit_interval 个样本重新标定一次）；
+    - 排序列表中所有大于 epsilon 的空隙（以空隙下侧的值为键）。
+    正常簇必包含窗口中位数，因此由中位数两侧最近的空隙即可得到正常簇的范围，
+    每个样本的代价为 O(log window)（加上排序列表插入的内存移动），无需重新聚类整个窗口。
+    """
+
+    def __init__(self, window=1440, warmup=100, refit_interval=None, min_epsilon=100):
+        """
+        :param window: 滑动窗口长度（样本数）
+        :param warmup: 窗口中样本数达到该值后才开始判定，之前的样本均视为正常
+        :param refit_interval: 重新标定直方图区间宽度的样本间隔，默认为 window
+        :param min_epsilon: epsilon 下限，与 DBScan 一致默认为 100
+        """
+        self.window = window
+        self.warmup = min(warmup, window)
+        self.refit_interval = refit_interval if refit_interval is not None else window
+        self.min_epsilon = min_epsilon
+
+        self._values = deque()
+        self._sorted = []
+        self._gaps = []
+        self._bin_counts = {}
+        self._bin_width = None
+        self._bins_changed = True
+        self._since_refit = 0
+        self.epsilon = None
+
+    def __len__(self):
+        return len(self._values)
+
+    # 直方图 ---------------------------------------------------------------
+
+    def _bin(self, x):
+        return int(np.floor(x / self._bin_width))
+
+    def _refit_bins(self):
+        """
+        按当前窗口重新确定区间宽度并重建直方图计数（O(window)，每 refit_interval 个样本一次）
+        """
+        values = np.fromiter(self._values, dtype=float, count=len(self._values))
+        edges = np.histogram_bin_edges(values, bins='auto')
+        width = float(np.mean(np.diff(edges))) if len(edges) > 1 else 0.0
+        self._bin_width = width if width > 0 else float(self.min_epsilon)
+        keys, counts = np.unique(np.floor(values / self._bin_width).astype(np.int64), return_counts=True)
+        self._bin_counts = dict(zip(keys.tolist(), counts.tolist()))
+        self._bins_changed = True
+        self._since_refit = 0
+
+    def _bin_add(self, x):
+        key = self._bin(x)
+        count = self._bin_counts.get(key, 0)
+        if count == 0:
+            self._bins_changed = True
+        self._bin_counts[key] = count + 1
+
+    def _bin_remove(self, x):
+        key = self._bin(x)
+        count = self._bin_counts[key] - 1
+        if count == 0:
+            del self._bin_counts[key]
+            self._bins_changed = True
+        else:
+            self._bin_counts[key] = count
+
+    def _update_epsilon(self):
+        """
+        非空区间集合变化时重新计算 epsilon；epsilon 变化时重建空隙列表
+        """
+        if not self._bins_changed:
+            return
+        self._bins_changed = False
+        keys = np.array(sorted(self._bin_counts), dtype=float)
+        epsilon = float(gap_epsilon(keys * self._bin_width, self._bin_width, self.min_epsilon))
+        if epsilon != self.epsilon:
+            self.epsilon = epsilon
+            values = np.asarray(self._sorted)
+            if len(values) > 1:
+                self._gaps = values[:-1][np.diff(values) > epsilon].tolist()
+            else:
+                self._gaps = []
+
+    # 排序窗口与空隙 -------------------------------------------------------
+
+    def _is_gap(self, lower, upper):
+        return self.epsilon is not None and upper - lower > self.epsilon
+
+    def _gap_add(self, key):
+        bisect.insort(self._gaps, key)
+
+    def _gap_remove(self, key):
+        del self._gaps[bisect.bisect_left(self._gaps, key)]
+
+    def _insert(self, x):
+        s = self._sorted
+        i = bisect.bisect_right(s, x)
+        pred = s[i - 1] if i > 0 else None
+        succ = s[i] if i < len(s) else None
+        if pred is not None and succ is not None and self._is_gap(pred, succ):
+            self._gap_remove(pred)
+        if pred is not None and self._is_gap(pred, x):
+            self._gap_add(pred)
+        if succ is not None and self._is_gap(x, succ):
+            self._gap_add(x)
+        s.insert(i, x)
+
+    def _delete(self, x):
+        s = self._sorted
+        i = bisect.bisect_left(s, x)
+        duplicated = (i + 1 < len(s) and s[i + 1] == x) or (i > 0 and s[i - 1] == x)
+        if not duplicated:
+            pred = s[i - 1] if i > 0 else None
+            succ = s[i + 1] if i + 1 < len(s) else None
+            if pred is not None and self._is_gap(pred, x):
+                self._gap_remove(pred)
+            if succ is not None and self._is_gap(x, succ):
+                self._gap_remove(x)
+            if pred is not None and succ is not None and self._is_gap(pred, succ):
+                self._gap_add(pred)
+        del s[i]
+
+    def normal_bounds(self):
+        """
+        当前窗口正常簇的取值范围
+        :return: (下界, 上界) 正常值满足 下界 < x <= 上界；无占多数的簇时返回 None
+        """
+        s = self._sorted
+        n = len(s)
+        if n == 0:
+            return None
+        median = s[n // 2]
+        j = bisect.bisect_left(self._gaps, median)
+        lower = self._gaps[j - 1] if j > 0 else -np.inf
+        upper = self._gaps[j] if j < len(self._gaps) else np.inf
+        count = bisect.bisect_right(s, upper) - bisect.bisect_right(s, lower)
+        if count <= 0.5 * n:
+            return None
+        return lower, upper
+
+    # 对外接口 -------------------------------------------------------------
+
+    def update(self, values):
+        """
+        追加一个或一批读数，并按加入时的窗口判定每个读数是否异常
+        :param values: 单个读数或读数序列（时间顺序）
+        :return: 与 values 等长的布尔数组，True 表示异常
+        """
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        flags = np.zeros(len(values), dtype=bool)
+        for k, x in enumerate(values.tolist()):
+            if len(self._values) == self.window:
+                old = self._values.popleft()
+                self._delete(old)
+                if self._bin_width is not None:
+                    self._bin_remove(old)
+            self._values.append(x)
+            self._insert(x)
+
+            if self._bin_width is None:
+                if len(self._values) < self.warmup:
+                    continue
+                self._refit_bins()
+            else:
+                self._bin_add(x)
+                self._since_refit += 1
+                if self._since_refit >= self.refit_interval:
+                    self._refit_bins()
+
+            self._update_epsilon()
+            bounds = self.normal_bounds()
+            if bounds is not None:
+                flags[k] = not (bounds[0] < x <= bounds[1])
+        return flags
+
+    def window_anomalies(self):
+        """
+        按当前窗口重新判定窗口内全部数据
+        :return: 与窗口数据（时间顺序）等长的布尔数组，True 表示异常
+        """
+        values = np.fromiter(self._values, dtype=float, count=len(self._values))
+        if self.epsilon is None:
+            return np.zeros(len(values), dtype=bool)
+        bounds = self.normal_bounds()
+        if bounds is None:
+            return np.zeros(len(values), dtype=bool)
+        return ~((values > bounds[0]) & (values <= bounds[1]))
+
+
+class SensorStreamDetector:
+    """
+    多索力在线检测：每个 SENSOR_ID 各自维护一个 StreamingDBScan
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: 传给每个 StreamingDBScan 的参数（window、warmup 等）
+        """
+        self.kwargs = kwargs
+        self.detectors = {}
+
+    def detector(self, sensor_id):
+        if sensor_id not in self.detectors:
+            self.detectors[sensor_id] = StreamingDBScan(**self.kwargs)
+        return self.detectors[sensor_id]
+
+    def update(self, sensor_id, values, timestamps=None):
+        """
+        追加某个索力的一批读数
+        :param sensor_id: 索力名称
+        :param values: 读数序列（时间顺序）
+        :param timestamps: 与 values 对应的时间，可为None
+        :return: 异常读数列表，每项为 {'SENSOR_ID', 'MDATE', 'M_RESULT'}
+        """
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        flags = self.detector(sensor_id).update(values)
+        anomalies = []
+        for k in np.flatnonzero(flags):
+            anomalies.append({
+                'SENSOR_ID': sensor_id,
+                'MDATE': timestamps[k] if timestamps is not None else None,
+                'M_RESULT': float(values[k]),
+            })
+        return anomalies
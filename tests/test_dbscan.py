@@ -0,0 +1,105 @@
+import os
+import re
+
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN
+
+from DDDBscan import DBScan, _histogram_bin_stats
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data.txt')
+
+
+def load_data_txt():
+    """
+    data.txt 中记录的索力读数（每行形如 zhongliang:-236.448135g）
+    """
+    with open(DATA_FILE, encoding='utf-8') as f:
+        return np.array([float(v) for v in re.findall(r'zhongliang:([-\d.]+)g', f.read())])
+
+
+def reference_bin_stats(x, edges, cidx):
+    """
+    原逐区间掩码统计
+    """
+    md = [[] for _ in range(len(cidx) - 1)]
+    stdd = [[] for _ in range(len(cidx) - 1)]
+    for m in range(len(cidx) - 1):
+        kk1 = edges[cidx[m]]
+        kk2 = edges[cidx[m + 1]]
+        mask = np.logical_and(x <= kk2, x >= kk1)
+        mask1 = np.where(mask == True)[0]
+        dd = [x[a] for a in mask1]
+        md[m] = np.mean(dd)
+        stdd[m] = np.std(dd)
+    return np.array(md), np.array(stdd)
+
+
+def reference_dbscan(x):
+    """
+    原DBScan：逐区间统计 + sklearn.cluster.DBSCAN
+    """
+    counts, edges = np.histogram(x, bins='auto')
+    cidx = np.where(counts > 0)[0]
+    intv = np.mean(np.diff(edges))
+
+    if len(cidx) > 1:
+        dis = np.diff(edges[cidx]) - intv
+        if np.mean(dis) == 0:
+            dis = 0
+    else:
+        dis = 0
+    mm = np.where(dis > 0)[0]
+    epsilon = dis[mm[0]] if len(mm) > 0 else intv / 2
+    if epsilon < 100:
+        epsilon = 100
+
+    classidx = DBSCAN(eps=epsilon, min_samples=1).fit(np.array(x).reshape(-1, 1)).labels_
+    counts1, edges1 = np.histogram(classidx, bins=np.arange(classidx.min(), classidx.max() + 2))
+    Normclass = np.ceil(edges1[np.where(counts1 > 0.5 * len(x))])
+    L_idx1 = np.where(classidx == Normclass)[0]
+    L_idx2 = np.where(classidx != Normclass)[0]
+    classidx[L_idx1] = 1
+    classidx[L_idx2] = 2
+    return np.where(classidx == 2)[0]
+
+
+def synthetic_series():
+    rng = np.random.default_rng(20231)
+    t = np.arange(4320)
+    daily = 3000 + 150 * np.sin(2 * np.pi * t / 144) + rng.normal(0, 20, len(t))
+    spikes = daily.copy()
+    spikes[rng.choice(len(t), 25, replace=False)] += rng.choice([-1, 1], 25) * rng.uniform(600, 1500, 25)
+    shifted = daily.copy()
+    shifted[3000:] += 900
+    # 整数量化的读数落在直方图区间边界上，检验闭区间的重叠处理
+    quantized = np.round(rng.normal(5000, 300, 2000) / 50) * 50
+    quantized[:10] = 12000
+    return {
+        'spikes': spikes,
+        'level_shift': shifted,
+        'quantized': quantized,
+        'two_values': np.array([100.0] * 30 + [5000.0] * 5),
+        'short': rng.normal(2000, 10, 12),
+    }
+
+
+SERIES = dict(synthetic_series(), data_txt=load_data_txt())
+
+
+@pytest.mark.parametrize('name', sorted(SERIES))
+def test_bin_stats_match_per_bin_loop(name):
+    x = SERIES[name]
+    counts, edges = np.histogram(x, bins='auto')
+    cidx = np.where(counts > 0)[0]
+    md, stdd = _histogram_bin_stats(x, edges, cidx)
+    expected_md, expected_stdd = reference_bin_stats(x, edges, cidx)
+    np.testing.assert_allclose(md, expected_md, rtol=1e-10)
+    np.testing.assert_allclose(stdd, expected_stdd, rtol=1e-8, atol=1e-8)
+
+
+@pytest.mark.parametrize('engine', ['sorted', 'sklearn'])
+@pytest.mark.parametrize('name', sorted(SERIES))
+def test_error_indices_match_reference(name, engine):
+    x = SERIES[name]
+    np.testing.assert_array_equal(DBScan(x, engine=engine), reference_dbscan(x))